@@ -12,6 +12,7 @@ class Category(Enum):
     END = "end"
     OUTPUT = "output"
     TRANSFORM = "transform"
+    DIAGNOSTIC = "diagnostic"
 
 
 T = TypeVar("T")
@@ -110,6 +111,27 @@ class ObjectOutputEvent(OutputEvent, Generic[T]):
     content: T
 
 
+class PartialObjectOutputEvent(BaseStreamEvent):
+    """
+    Snapshot of an object output that is still being generated, containing only the values completed so far.
+    Superseded by the ObjectOutputEvent that follows it.
+    """
+
+    category: Literal[Category.OUTPUT] = Category.OUTPUT
+    event_type: Literal["partial_object"] = "partial_object"
+    content: Any
+
+
+class LLMMetricsEvent(BaseStreamEvent):
+    """
+    Diagnostic timings of an llm call (request build, queue wait, time to first token, throughput, parsing).
+    """
+
+    category: Literal[Category.DIAGNOSTIC] = Category.DIAGNOSTIC
+    event_type: Literal["llm_metrics"] = "llm_metrics"
+    metrics: Dict[str, Any]
+
+
 # note EndStreamEvent does not need to reference the type of event it ends since this is captured by context
 class EndStreamEvent(BaseStreamEvent, ABC):
     category: Literal[Category.END] = Category.END
@@ -145,11 +167,13 @@ StreamEvent = (
     | LLMToolCallRequestEvent
     | StringOutputEvent
     | ObjectOutputEvent
+    | PartialObjectOutputEvent
     | SuccessEvent
     | CanceledEvent
     | ErrorEvent
     | AgentStateEvent
     | UserInputEvent
+    | LLMMetricsEvent
 )
 
 _type_mapping = {c.model_fields["event_type"].annotation.__args__[0]: c for c in StreamEvent.__args__}
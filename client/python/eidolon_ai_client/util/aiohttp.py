@@ -1,4 +1,4 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 import json
 
@@ -7,13 +7,14 @@ from httpx_sse import EventSource
 from pydantic_core import to_jsonable_python
 
 from eidolon_ai_client.events import BaseStreamEvent
+from eidolon_ai_client.util.local_transport import local_app, local_transport, stream_local
 from eidolon_ai_client.util.logger import logger
 from eidolon_ai_client.util.request_context import RequestContext
 
 
 # noinspection PyShadowingNames
 async def get_content(url: str, json: Optional[Dict[str, Any]] = None, **kwargs):
-    async with AsyncClient(timeout=Timeout(5.0, read=600.0)) as client:
+    async with AsyncClient(timeout=Timeout(5.0, read=600.0), transport=local_transport(url)) as client:
         params = {"url": url, "headers": RequestContext.headers}
         if json:
             params["json"] = json
@@ -22,12 +23,28 @@ async def get_content(url: str, json: Optional[Dict[str, Any]] = None, **kwargs)
         return response.json()
 
 
+async def get_content_if_modified(url: str, etag: Optional[str] = None, **kwargs) -> Tuple[bool, Any, Optional[str]]:
+    """
+    Conditional GET. Returns (modified, content, etag), where content is None if the server reports that etag is
+    still current.
+    """
+    headers = dict(RequestContext.headers)
+    if etag:
+        headers["If-None-Match"] = etag
+    async with AsyncClient(timeout=Timeout(5.0, read=600.0), transport=local_transport(url)) as client:
+        response = await client.get(url=url, headers=headers, **kwargs)
+        if response.status_code == codes.NOT_MODIFIED:
+            return False, None, etag
+        await AgentError.check(response)
+        return True, response.json(), response.headers.get("ETag")
+
+
 # noinspection PyShadowingNames
 async def post_content(url, json: Optional[Any] = None, **kwargs):
     params = {"url": url, "headers": RequestContext.headers}
     if json:
         params["json"] = to_jsonable_python(json)
-    async with AsyncClient(timeout=Timeout(5.0, read=600.0)) as client:
+    async with AsyncClient(timeout=Timeout(5.0, read=600.0), transport=local_transport(url)) as client:
         response = await client.post(**params, **kwargs)
         await AgentError.check(response)
         return response.json()
@@ -36,7 +53,7 @@ async def post_content(url, json: Optional[Any] = None, **kwargs):
 # noinspection PyShadowingNames
 async def delete(url, **kwargs):
     params = {"url": url, "headers": RequestContext.headers}
-    async with AsyncClient(timeout=Timeout(5.0, read=600.0)) as client:
+    async with AsyncClient(timeout=Timeout(5.0, read=600.0), transport=local_transport(url)) as client:
         response = await client.delete(**params, **kwargs)
         await AgentError.check(response)
         return response.json()
@@ -48,8 +65,16 @@ async def stream_content(url: str, body, **kwargs):
         **RequestContext.headers,
         "Accept": "text/event-stream",
     }
+    app = local_app(url)
+    if app:
+        try:
+            async for event in stream_local(app, url, body, headers):
+                yield event
+        except HTTPStatusError as e:
+            await AgentError.check(e.response)
+        return
     request = {"url": url, "json": body, "method": "POST", "headers": headers, **kwargs}
-    async with AsyncClient(timeout=Timeout(5.0, read=600.0)) as client:
+    async with AsyncClient(timeout=Timeout(5.0, read=600.0), transport=local_transport(url)) as client:
         async with client.stream(**request) as response:
             await AgentError.check(response)
             async for sse_event in EventSource(response).aiter_sse():
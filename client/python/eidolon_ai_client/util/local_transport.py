@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+
+import httpx
+
+from eidolon_ai_client.events import BaseStreamEvent
+
+# ASGI scope key of a coroutine function a server can emit events to, rather than encoding them as server sent events
+EVENT_SINK = "eidolon.event_sink"
+
+# events a server emits ahead of the caller receiving them, before emitting waits
+_MAX_BUFFERED_EVENTS = 64
+_local_machines: Dict[Any, Tuple[Callable[[], str], asyncio.AbstractEventLoop]] = {}
+
+
+def register_local_machine(app, machine_url: Union[str, Callable[[], str]]):
+    """
+    Register an ASGI app serving machine_url (or the url a callable returns when a request is made) from this process.
+    Requests to the machine made on the app's event loop are dispatched to the app directly rather than over the
+    network.
+    """
+    url_fn = machine_url if callable(machine_url) else lambda: machine_url
+    _local_machines[app] = (url_fn, asyncio.get_running_loop())
+
+
+def unregister_local_machine(app):
+    _local_machines.pop(app, None)
+
+
+def local_app(url: str):
+    if not _local_machines:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    for app, (url_fn, app_loop) in _local_machines.items():
+        machine = url_fn().rstrip("/")
+        if app_loop is loop and (url == machine or url.startswith(machine + "/")):
+            return app
+    return None
+
+
+def _isolated(coro):
+    # the server side of a request starts with a fresh context, as it would in another process
+    return asyncio.create_task(coro, context=contextvars.Context())
+
+
+class LocalTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport calling an ASGI app in this process.
+    """
+
+    def __init__(self, app):
+        self._transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await _isolated(self._transport.handle_async_request(request))
+
+
+def local_transport(url: str) -> Optional[LocalTransport]:
+    app = local_app(url)
+    return LocalTransport(app) if app else None
+
+
+async def stream_local(app, url: str, body: Any, headers: Dict[str, str]) -> AsyncIterator[BaseStreamEvent]:
+    """
+    POST to an ASGI app in this process, receiving the events it emits to the EVENT_SINK as objects. The app waits
+    to emit once the caller falls _MAX_BUFFERED_EVENTS events behind.
+
+    Raises an httpx.HTTPStatusError if the app responds with an error.
+    """
+    parsed = httpx.URL(url)
+    events = asyncio.Queue(_MAX_BUFFERED_EVENTS)
+    status = []
+    response_body = []
+    response_complete = asyncio.Event()
+    request_body = [json.dumps(body).encode() if body is not None else b""]
+
+    async def receive():
+        if request_body:
+            return {"type": "http.request", "body": request_body.pop(), "more_body": False}
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        elif message["type"] == "http.response.body":
+            response_body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": parsed.scheme,
+        "path": parsed.path,
+        "raw_path": parsed.raw_path.split(b"?")[0],
+        "query_string": parsed.query,
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")]
+        + [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "server": (parsed.host, parsed.port),
+        "client": ("127.0.0.1", 0),
+        EVENT_SINK: events.put,
+    }
+
+    task = _isolated(app(scope, receive, send))
+    getter = None
+    try:
+        while True:
+            if not events.empty():
+                yield events.get_nowait()
+                continue
+            if task.done():
+                break
+            # the queue is bounded, so the end of the app is awaited alongside its next event rather than queued
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait([getter, task], return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                # an event put since is left in the queue
+                getter.cancel()
+        await task
+        if status and status[0] >= 400:
+            request = httpx.Request("POST", url)
+            response = httpx.Response(status[0], content=b"".join(response_body), request=request)
+            response.raise_for_status()
+    finally:
+        if getter:
+            getter.cancel()
+        if not task.done():
+            # the server sees the caller going away as it would a disconnect
+            task.cancel()
+            await asyncio.wait([task])
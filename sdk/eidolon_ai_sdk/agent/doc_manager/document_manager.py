@@ -1,21 +1,20 @@
-import asyncio
 import logging
 import time
 from pydantic import BaseModel, Field
-from typing import List
-
-from eidolon_ai_sdk.agent.doc_manager.loaders.base_loader import (
-    DocumentLoader,
-    FileInfo,
-    RemovedFile,
-    ModifiedFile,
-    AddedFile,
+from typing import List, Optional
+
+from eidolon_ai_sdk.agent.doc_manager.ingestion_pipeline import (
+    IngestionPipeline,
+    IngestionPipelineSpec,
+    ParsePool,
+    StageStats,
 )
+from eidolon_ai_sdk.agent.doc_manager.loaders.base_loader import DocumentLoader
 from eidolon_ai_sdk.agent.doc_manager.parsers.base_parser import DocumentParser
 from eidolon_ai_sdk.agent.doc_manager.transformer.document_transformer import DocumentTransformer
 from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.lexical_index import LexicalIndex, LexicalIndexSpec
 from eidolon_ai_sdk.system.reference_model import Specable, AnnotatedReference
-from eidolon_ai_client.util.logger import logger
 
 
 class SearchResult(BaseModel):
@@ -42,6 +41,14 @@ class DocumentManagerSpec(BaseModel):
     loader: AnnotatedReference[DocumentLoader]
     parser: AnnotatedReference[DocumentParser]
     splitter: AnnotatedReference[DocumentTransformer]
+    lexical_index: Optional[LexicalIndexSpec] = Field(
+        default=None,
+        description="Also index documents for BM25 keyword search. Files synced before this is enabled are indexed "
+        "when they next change.",
+    )
+    ingestion: IngestionPipelineSpec = Field(
+        default_factory=IngestionPipelineSpec, description="How synced files are parsed, embedded and written."
+    )
 
 
 class DocumentManager(Specable[DocumentManagerSpec]):
@@ -56,43 +63,24 @@ class DocumentManager(Specable[DocumentManagerSpec]):
         self.splitter = self.spec.splitter.instantiate()
         self.logger = logging.getLogger("eidolon")
         self.collection_name = f"doc_sync_{self.spec.name}"
+        self.lexical_index = (
+            LexicalIndex(f"doc_contents_{self.spec.name}", self.spec.lexical_index) if self.spec.lexical_index else None
+        )
+        # kept between syncs and shared with the other document managers, see stop
+        self.parse_pool = ParsePool.shared(self.spec.ingestion.parse_processes)
 
-    async def _addFile(self, file_info: FileInfo):
-        try:
-            parsedDocs = list(self.parser.parse(file_info.data))
-            docs = list(self.splitter.transform_documents(parsedDocs))
-            await AgentOS.symbolic_memory.insert_one(
-                self.collection_name,
-                {
-                    "file_path": file_info.path,
-                    "data": file_info.metadata,
-                    "doc_ids": [doc.id for doc in docs],
-                },
-            )
-            if len(docs) == 0:
-                self.logger.warning(f"File contained no text {file_info.path}")
-                return
-            await AgentOS.similarity_memory.vector_store.add(f"doc_contents_{self.spec.name}", docs)
-            self.logger.info(f"Added file {file_info.path}")
-        except Exception:
-            self.logger.warning(f"Failed to parse file {file_info.path}", exc_info=True)
-
-    async def _removeFile(self, path: str):
-        # get the doc ids for the file
-        file_info = await AgentOS.symbolic_memory.find_one(self.collection_name, {"file_path": path})
-        if file_info is not None:
-            doc_ids = file_info["doc_ids"]
-            await AgentOS.similarity_memory.vector_store.delete(f"doc_contents_{self.spec.name}", doc_ids)
-            await AgentOS.symbolic_memory.delete(self.collection_name, {"file_path": path})
-
-    async def _replaceFile(self, file_info: FileInfo):
-        await self._removeFile(file_info.path)
-        await self._addFile(file_info)
+    async def stop(self):
+        """Shut down the processes files are parsed in, a later sync of any document manager starts them again."""
+        self.parse_pool.shutdown()
 
     async def list_files(self):
         return self.loader.list_files()
 
-    async def sync_docs(self, force: bool = False):
+    async def sync_docs(self, force: bool = False) -> Optional[List[StageStats]]:
+        """
+        Apply the changes of the loader's files since the last sync. Returns how each ingestion stage performed, or
+        None when the last sync is more recent than recheck_frequency.
+        """
         if force or self.last_reload + self.spec.recheck_frequency < time.time():
             self.logger.info(f"Syncing files from {self.spec.name}")
 
@@ -103,15 +91,19 @@ class DocumentManager(Specable[DocumentManagerSpec]):
 
             self.logger.info(f"Found {len(data)} files in symbolic memory")
 
-            tasks = []
-            async for change in self.loader.get_changes(data):
-                if isinstance(change, AddedFile):
-                    tasks.append(self._addFile(change.file_info))
-                elif isinstance(change, ModifiedFile):
-                    tasks.append(self._replaceFile(change.file_info))
-                elif isinstance(change, RemovedFile):
-                    tasks.append(self._removeFile(change.file_path))
-                else:
-                    logger.warning(f"Unknown change type {change}")
-            await asyncio.gather(*tasks)
+            pipeline = IngestionPipeline(
+                self.spec.ingestion,
+                self.parser,
+                self.splitter,
+                self.collection_name,
+                f"doc_contents_{self.spec.name}",
+                self.lexical_index,
+                self.parse_pool,
+            )
+            stats = await pipeline.run(self.loader.get_changes(data))
             self.last_reload = time.time()
+            self.logger.info(
+                f"Synced files from {self.spec.name}: "
+                + ", ".join(f"{s.name} {s.files} files ({s.files_per_second:.1f}/s)" for s in stats)
+            )
+            return stats
@@ -0,0 +1,286 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import IOBase
+from typing import AsyncIterator, ClassVar, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from eidolon_ai_client.util.logger import logger
+from eidolon_ai_sdk.agent.doc_manager.loaders.base_loader import (
+    AddedFile,
+    FileChange,
+    FileInfo,
+    ModifiedFile,
+    RemovedFile,
+)
+from eidolon_ai_sdk.agent.doc_manager.parsers.base_parser import DataBlob, DocumentParser
+from eidolon_ai_sdk.agent.doc_manager.transformer.document_transformer import DocumentTransformer
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.document import Document, EmbeddedDocument
+from eidolon_ai_sdk.memory.lexical_index import LexicalIndex
+from eidolon_ai_sdk.util.async_wrapper import make_async
+
+# tells the workers of a stage that the stage before it is finished
+_DONE = object()
+
+
+class IngestionPipelineSpec(BaseModel):
+    parse_processes: Optional[int] = Field(
+        default=None,
+        description="The number of processes parsing and splitting files, the number of CPUs by default. Document "
+        "managers with the same number share one pool of processes. 0 parses in a thread instead, for parsers or "
+        "loaders whose files can not be sent to another process.",
+    )
+    embed_concurrency: int = Field(default=4, description="The number of files embedded at once.")
+    queue_size: int = Field(
+        default=16, description="The number of files waiting for each stage before the stage feeding it waits."
+    )
+    write_batch_size: int = Field(
+        default=512, description="The number of chunks above which waiting files are no longer added to a write."
+    )
+
+
+class StageStats(BaseModel):
+    name: str
+    files: int = 0
+    chunks: int = 0
+    failed: int = Field(default=0, description="The number of files the stage failed on.")
+    busy_seconds: float = Field(default=0.0, description="The time the stage spent on files, summed over its workers.")
+    elapsed_seconds: float = Field(
+        default=0.0, description="The time from the stage starting its first file to finishing its last."
+    )
+    files_per_second: float = 0.0
+
+
+class _Stage:
+    def __init__(self, name: str):
+        self.stats = StageStats(name=name)
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+
+    def record(self, started: float, chunks: int = 0, files: int = 1):
+        finished = time.perf_counter()
+        self.stats.files += files
+        self.stats.chunks += chunks
+        self.stats.busy_seconds += finished - started
+        self.first = started if self.first is None else min(self.first, started)
+        self.last = finished
+
+    def report(self) -> StageStats:
+        if self.first is not None:
+            self.stats.elapsed_seconds = self.last - self.first
+            if self.stats.elapsed_seconds:
+                self.stats.files_per_second = self.stats.files / self.stats.elapsed_seconds
+        return self.stats
+
+
+def parse_and_split(parser: DocumentParser, splitter: DocumentTransformer, blob: DataBlob) -> List[Document]:
+    return list(splitter.transform_documents(list(parser.parse(blob))))
+
+
+class ParsePool:
+    """
+    The processes files are parsed in, started with the first file parsed and kept until shutdown, so syncs do not pay
+    for starting them. Processes are started by a forkserver (or spawned where there is none) rather than forked from
+    the worker, which would copy the state of its threads, such as locks they hold, into the children.
+
+    Document managers share the pool of the worker (see shared), so a machine of many document managers does not start
+    a pool of processes for each.
+    """
+
+    _shared: ClassVar[Dict[int, "ParsePool"]] = {}
+
+    def __init__(self, processes: Optional[int]):
+        self.processes = (os.cpu_count() or 1) if processes is None else processes
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def shared(cls, processes: Optional[int]) -> "ParsePool":
+        """The pool of this worker with the number of processes."""
+        pool = cls(processes)
+        return cls._shared.setdefault(pool.processes, pool)
+
+    def executor(self) -> Optional[ProcessPoolExecutor]:
+        """The process pool, None when parsing in the event loop's default thread pool."""
+        if self.processes and not self._executor:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._executor = ProcessPoolExecutor(self.processes, mp_context=context)
+        return self._executor
+
+    def replace(self, broken: ProcessPoolExecutor):
+        """Start a new pool on next use, unless one has already replaced the broken pool."""
+        if self._executor is broken:
+            self._executor = None
+            broken.shutdown(wait=False)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class IngestionPipeline:
+    """
+    Applies the file changes of a sync in stages connected by bounded queues, so a slow stage holds back the stages
+    feeding it rather than buffering every file:
+
+    - load: reads changes from the loader and removes the chunks of removed and modified files.
+    - parse: parses and splits files in a process pool, keeping the event loop free while large files are parsed.
+    - embed: embeds the chunks of up to embed_concurrency files at once.
+    - write: writes the files waiting to be written together, to the vector store, lexical index and symbolic memory.
+
+    A file that fails to parse, embed or write is not recorded in symbolic memory, so the next sync retries it. Files
+    are parsed in the given pool, or in a pool of the pipeline's own that is shut down when the sync finishes.
+    """
+
+    def __init__(
+        self,
+        spec: IngestionPipelineSpec,
+        parser: DocumentParser,
+        splitter: DocumentTransformer,
+        records_collection: str,
+        contents_collection: str,
+        lexical_index: Optional[LexicalIndex] = None,
+        pool: Optional[ParsePool] = None,
+    ):
+        self.spec = spec
+        self.parser = parser
+        self.splitter = splitter
+        self.records_collection = records_collection
+        self.contents_collection = contents_collection
+        self.lexical_index = lexical_index
+        self.stages = {name: _Stage(name) for name in ("load", "parse", "embed", "write")}
+        self.pool = pool or ParsePool(spec.parse_processes)
+        self._owns_pool = pool is None
+
+    async def run(self, changes: AsyncIterator[FileChange]) -> List[StageStats]:
+        to_parse, to_embed, to_write = (asyncio.Queue(self.spec.queue_size) for _ in range(3))
+        parse_workers = self.pool.processes or 1
+
+        async def stage(work, workers, inbox, outbox, next_workers):
+            await asyncio.gather(*(work(inbox, outbox) for _ in range(workers)))
+            for _ in range(next_workers):
+                await outbox.put(_DONE)
+
+        tasks = [
+            asyncio.create_task(stage(self._load, 1, changes, to_parse, parse_workers)),
+            asyncio.create_task(stage(self._parse, parse_workers, to_parse, to_embed, self.spec.embed_concurrency)),
+            asyncio.create_task(stage(self._embed, self.spec.embed_concurrency, to_embed, to_write, 1)),
+            asyncio.create_task(self._write(to_write)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self._owns_pool:
+                self.pool.shutdown()
+        return [stage.report() for stage in self.stages.values()]
+
+    async def _load(self, changes: AsyncIterator[FileChange], outbox: asyncio.Queue):
+        stage = self.stages["load"]
+        started = time.perf_counter()
+        async for change in changes:
+            if isinstance(change, RemovedFile):
+                await self.remove(change.file_path)
+                stage.record(started)
+            elif isinstance(change, (AddedFile, ModifiedFile)):
+                if isinstance(change, ModifiedFile):
+                    await self.remove(change.file_info.path)
+                blob = change.file_info.data
+                if isinstance(blob.data, IOBase):
+                    # streams can not be sent to the parse processes
+                    blob.data = await make_async(blob.data.read)()
+                stage.record(started)
+                await outbox.put(change.file_info)
+            else:
+                logger.warning(f"Unknown change type {change}")
+            started = time.perf_counter()
+
+    async def _parse(self, inbox: asyncio.Queue, outbox: asyncio.Queue):
+        stage, loop = self.stages["parse"], asyncio.get_running_loop()
+        while (file_info := await inbox.get()) is not _DONE:
+            started, pool = time.perf_counter(), self.pool.executor()
+            try:
+                docs = await loop.run_in_executor(pool, parse_and_split, self.parser, self.splitter, file_info.data)
+            except BrokenProcessPool:
+                # a parse process died, taking the files it was handed with it. Start a new pool for the rest
+                logger.warning(f"Parse process crashed on {file_info.path}")
+                self.pool.replace(pool)
+                stage.stats.failed += 1
+                continue
+            except Exception:
+                logger.warning(f"Failed to parse file {file_info.path}", exc_info=True)
+                stage.stats.failed += 1
+                continue
+            stage.record(started, len(docs))
+            await outbox.put((file_info, docs))
+
+    async def _embed(self, inbox: asyncio.Queue, outbox: asyncio.Queue):
+        stage = self.stages["embed"]
+        while (item := await inbox.get()) is not _DONE:
+            file_info, docs = item
+            started = time.perf_counter()
+            try:
+                embedded = [e async for e in AgentOS.similarity_memory.embedder.embed(docs)] if docs else []
+            except Exception:
+                logger.warning(f"Failed to embed file {file_info.path}", exc_info=True)
+                stage.stats.failed += 1
+                continue
+            stage.record(started, len(docs))
+            await outbox.put((file_info, docs, embedded))
+
+    async def _write(self, inbox: asyncio.Queue):
+        finished = False
+        while not finished:
+            batch, chunks = [], 0
+            # take what is already waiting, so writes grow with the backlog instead of waiting for a full batch
+            while not batch or (chunks < self.spec.write_batch_size and not inbox.empty()):
+                item = await inbox.get()
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+                chunks += len(item[1])
+            if batch:
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Tuple[FileInfo, List[Document], List[EmbeddedDocument]]]):
+        stage = self.stages["write"]
+        started = time.perf_counter()
+        docs = [doc for _, file_docs, _ in batch for doc in file_docs]
+        try:
+            if docs:
+                embedded = [e for _, _, file_embedded in batch for e in file_embedded]
+                await AgentOS.similarity_memory.vector_store.add_embedded(self.contents_collection, docs, embedded)
+                if self.lexical_index:
+                    await self.lexical_index.add(docs)
+            records = [
+                {"file_path": file_info.path, "data": file_info.metadata, "doc_ids": [doc.id for doc in file_docs]}
+                for file_info, file_docs, _ in batch
+            ]
+            await AgentOS.symbolic_memory.insert(self.records_collection, records)
+        except Exception:
+            logger.warning(f"Failed to write {len(batch)} files", exc_info=True)
+            stage.stats.failed += len(batch)
+            return
+        for file_info, file_docs, _ in batch:
+            if file_docs:
+                logger.info(f"Added file {file_info.path}")
+            else:
+                logger.warning(f"File contained no text {file_info.path}")
+        stage.record(started, len(docs), files=len(batch))
+
+    async def remove(self, path: str):
+        file_info = await AgentOS.symbolic_memory.find_one(self.records_collection, {"file_path": path})
+        if file_info is not None:
+            doc_ids = file_info["doc_ids"]
+            await AgentOS.similarity_memory.vector_store.delete(self.contents_collection, doc_ids)
+            if self.lexical_index:
+                await self.lexical_index.remove(doc_ids)
+            await AgentOS.symbolic_memory.delete(self.records_collection, {"file_path": path})
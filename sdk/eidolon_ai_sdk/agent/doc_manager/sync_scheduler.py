@@ -0,0 +1,250 @@
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
+
+from eidolon_ai_client.util.logger import logger as eidolon_logger
+from eidolon_ai_sdk.agent.doc_manager.document_manager import DocumentManager
+from eidolon_ai_sdk.agent.doc_manager.ingestion_pipeline import StageStats
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.system.reference_model import Specable
+
+logger = eidolon_logger.getChild("doc_sync")
+
+
+class DocumentSyncSchedulerSpec(BaseModel):
+    jitter: float = Field(
+        default=0.1, description="The fraction of each document manager's recheck_frequency that is randomized."
+    )
+    lease_seconds: float = Field(
+        default=300.0,
+        description="How long a worker holds the lease on a collection without renewing it. Leases are renewed while "
+        "a sync runs, so this only bounds how long a crashed worker blocks other workers.",
+    )
+    lease_collection: str = Field(default="doc_sync_leases", description="The symbolic memory collection of leases.")
+    sync_on_start: bool = Field(
+        default=False,
+        description="Start syncing every document manager when the machine starts, rather than on its first search.",
+    )
+
+
+class SyncStatus(BaseModel):
+    name: str
+    state: str = Field(default="idle", description="idle, syncing or stopped.")
+    runs: int = Field(default=0, description="The number of syncs this worker ran.")
+    skipped: int = Field(
+        default=0,
+        description="The number of syncs skipped as another worker held the lease, or had synced the collection "
+        "within the last recheck_frequency.",
+    )
+    last_started: Optional[float] = None
+    last_finished: Optional[float] = None
+    last_duration: Optional[float] = None
+    last_error: Optional[str] = None
+    next_run: Optional[float] = None
+    stages: List[StageStats] = Field(default=[], description="How each ingestion stage performed in the last sync.")
+
+
+class _Entry:
+    def __init__(self, manager: DocumentManager):
+        self.manager = manager
+        self.status = SyncStatus(name=manager.spec.name)
+        self.task: Optional[asyncio.Task] = None
+        self.wake = asyncio.Event()
+        # set once the first sync this worker attempted is over, synced here or skipped for another worker's sync
+        self.first_sync = asyncio.Event()
+
+
+class DocumentSyncScheduler(Specable[DocumentSyncSchedulerSpec]):
+    """
+    Machine level scheduler syncing the documents of every DocumentManager in the background, so searches do not pay
+    for walking, parsing and embedding changed files.
+
+    Each document manager is synced every recheck_frequency seconds (with jitter, so workers started together spread
+    out) starting from its first search, or from machine start with sync_on_start. Workers sharing symbolic memory take
+    a lease on a collection before syncing it, so only one syncs a collection at a time, and skip the sync when the
+    lease records another sync that finished within the period. A collection is so synced about once per
+    recheck_frequency however many workers there are, unless a sync is triggered. A lease is taken and released by
+    compare and swap on its token, relying on the duplicate key error an upsert raises when its query no longer
+    matches the lease.
+
+    The lease assumes every worker searches what the others sync. Process local vector stores (see
+    VectorStore.process_local, such as the numpy and hnsw stores) are only searched by the worker that wrote them, so
+    with them no lease is taken and each worker syncs on its own schedule. Such stores are only suited to machines of
+    one worker: the record of synced files is kept in symbolic memory, so files one worker synced are not synced again
+    into the stores of the others.
+    """
+
+    _entries: Dict[str, _Entry]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries = {}
+        self._started = False
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def start(self):
+        self._started = True
+        if self.spec.sync_on_start:
+            for entry in self._entries.values():
+                self._schedule(entry)
+
+    async def stop(self):
+        self._started = False
+        tasks = [entry.task for entry in self._entries.values() if entry.task]
+        for entry in self._entries.values():
+            if entry.task:
+                entry.task.cancel()
+                entry.task = None
+            entry.status.state = "stopped"
+            # searches waiting for a first sync that will not happen search what has been synced so far
+            entry.first_sync.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(entry.manager.stop() for entry in self._entries.values()))
+
+    def register(self, manager: DocumentManager) -> _Entry:
+        entry = self._entries.get(manager.spec.name)
+        if entry is None or entry.manager is not manager:
+            entry = self._entries[manager.spec.name] = _Entry(manager)
+            if self._started and self.spec.sync_on_start:
+                self._schedule(entry)
+        return entry
+
+    def _schedule(self, entry: _Entry):
+        if entry.task is None or entry.task.done():
+            entry.task = asyncio.create_task(self._run(entry))
+
+    async def ensure_synced(self, manager: DocumentManager):
+        """
+        Schedule the manager's syncs. Only waits for the first sync of a collection no worker has synced yet, as there
+        is nothing to search before it.
+        """
+        entry = self.register(manager)
+        self._schedule(entry)
+        if not entry.first_sync.is_set() and not await self._synced_elsewhere(entry):
+            await entry.first_sync.wait()
+
+    def trigger(self, name: str) -> Optional[SyncStatus]:
+        """Sync a document manager now, or as soon as its running sync finishes. None for unknown names."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        self._schedule(entry)
+        entry.wake.set()
+        return entry.status
+
+    def status(self) -> List[SyncStatus]:
+        return [entry.status for entry in self._entries.values()]
+
+    async def _run(self, entry: _Entry):
+        frequency = entry.manager.spec.recheck_frequency
+        triggered = False
+        while True:
+            entry.wake.clear()
+            await self._sync(entry, triggered)
+            entry.first_sync.set()
+            delay = frequency * (1 + random.uniform(-self.spec.jitter, self.spec.jitter))
+            entry.status.next_run = time.time() + delay
+            try:
+                await asyncio.wait_for(entry.wake.wait(), delay)
+                triggered = True
+            except asyncio.TimeoutError:
+                triggered = False
+
+    async def _sync(self, entry: _Entry, triggered: bool = False):
+        name, status = entry.manager.spec.name, entry.status
+        # syncs of this worker come around within the jitter of the period, they are not skipped for its own last sync
+        fresh_for = 0 if triggered else entry.manager.spec.recheck_frequency * (1 - self.spec.jitter)
+        token, last_finished, renewal = None, None, None
+        if not self._process_local():
+            try:
+                token, last_finished = await self._acquire(name, fresh_for)
+            except Exception:
+                logger.warning(f"Failed to take the sync lease of {name}", exc_info=True)
+                return
+            if not token:
+                status.skipped += 1
+                return
+            renewal = asyncio.create_task(self._renew(name, token, last_finished))
+        status.state, status.last_started = "syncing", time.time()
+        try:
+            status.stages = await entry.manager.sync_docs(force=True) or []
+            status.last_error = None
+        except Exception as e:
+            logger.exception(f"Failed to sync {name}")
+            status.last_error = str(e)
+        finally:
+            status.state, status.last_finished = "idle", time.time()
+            status.last_duration = status.last_finished - status.last_started
+            status.runs += 1
+            if renewal:
+                renewal.cancel()
+                try:
+                    await self._release(name, token, status.last_finished)
+                except Exception:
+                    logger.warning(f"Failed to release the sync lease of {name}", exc_info=True)
+
+    @staticmethod
+    def _process_local() -> bool:
+        similarity_memory = AgentOS.similarity_memory
+        return similarity_memory is not ... and similarity_memory.vector_store.process_local
+
+    async def _synced_elsewhere(self, entry: _Entry) -> bool:
+        if self._process_local():
+            return False
+        lease = await AgentOS.symbolic_memory.find_one(self.spec.lease_collection, {"_id": entry.manager.spec.name})
+        return bool(lease and lease.get("last_finished"))
+
+    def _lease(self, name: str, token: str, expires: float, **kwargs) -> dict:
+        return dict(_id=name, token=token, owner=self.worker, expires=expires, **kwargs)
+
+    async def _acquire(self, name: str, fresh_for: float = 0) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Take the lease of a collection, unless another worker holds it or a sync finished less than fresh_for seconds
+        ago. Returns the lease's token, None when not taken, and when the last sync finished.
+        """
+        now, token = time.time(), uuid.uuid4().hex
+        lease = await AgentOS.symbolic_memory.find_one(self.spec.lease_collection, {"_id": name})
+        last_finished = lease.get("last_finished") if lease else None
+        document = self._lease(name, token, now + self.spec.lease_seconds, last_finished=last_finished)
+        try:
+            if lease is None:
+                await AgentOS.symbolic_memory.insert_one(self.spec.lease_collection, document)
+            elif lease["expires"] > now or (last_finished and now - last_finished < fresh_for):
+                return None, last_finished
+            else:
+                await self._swap(name, lease["token"], document)
+        except DuplicateKeyError:
+            # another worker took the lease since it was read
+            return None, last_finished
+        return token, last_finished
+
+    async def _renew(self, name: str, token: str, last_finished: Optional[float]):
+        while True:
+            await asyncio.sleep(self.spec.lease_seconds / 3)
+            expires = time.time() + self.spec.lease_seconds
+            try:
+                await self._swap(name, token, self._lease(name, token, expires, last_finished=last_finished))
+            except DuplicateKeyError:
+                logger.warning(f"Lost the sync lease of {name}, another worker may sync it at the same time")
+                return
+
+    async def _release(self, name: str, token: str, finished: float):
+        try:
+            await self._swap(name, token, self._lease(name, token, 0, last_finished=finished))
+        except DuplicateKeyError:
+            pass
+
+    async def _swap(self, name: str, token: str, document: dict):
+        """Replace the lease if it still has token, raising a DuplicateKeyError otherwise."""
+        await AgentOS.symbolic_memory.upsert_one(self.spec.lease_collection, document, {"_id": name, "token": token})
+
+
+def find_document_managers(agent: object) -> List[DocumentManager]:
+    return [value for value in vars(agent).values() if isinstance(value, DocumentManager)]
@@ -1,5 +1,5 @@
 import asyncio
-from typing import Annotated, List
+from typing import Annotated, Any, Dict, List, Optional
 from urllib.parse import urlparse
 
 from fastapi import Body
@@ -92,24 +92,54 @@ class RetrieverAgent(Specable[RetrieverAgentSpec]):
 
     @register_program(description=make_description)
     async def search(
-        self, question: Annotated[str, Body(description="The question to search for", embed=True)]
+        self,
+        question: Annotated[str, Body(description="The question to search for", embed=True)],
+        source_prefix: Annotated[
+            Optional[str], Body(description="Only search files whose path starts with this prefix.", embed=True)
+        ] = None,
+        mime_types: Annotated[
+            Optional[List[str]], Body(description="Only search files of these mime types.", embed=True)
+        ] = None,
+        metadata: Annotated[
+            Optional[Dict[str, Any]],
+            Body(
+                description="Only search documents with these metadata values. A list of values matches any of them.",
+                embed=True,
+            ),
+        ] = None,
     ) -> List[DocSummary]:
         """
         Process the question by searching the document store.
         :param question: The question to process
+        :param source_prefix: Only search files whose path starts with this prefix
+        :param mime_types: Only search files of these mime types
+        :param metadata: Only search documents with these metadata values
         :return: The response from the cpu
         """
-        await self.document_manager.sync_docs()
+        # documents are synced in the background, this only waits for the first sync of the collection
+        await AgentOS.document_sync_scheduler.ensure_synced(self.document_manager)
 
         if self.question_transformer:
             questions = await self.question_transformer.transform(question)
         else:
             questions = [question]
-        _docs = await asyncio.gather(*(self._embed_question(question) for question in questions))
-        question_to_docs = {tu[0]: tu[1] for tu in zip(questions, _docs)}
+        # all variants of the question are embedded in one request and searched for in one query
+        embedded = await AgentOS.similarity_memory.embedder.embed_texts(questions)
+        where = _where(source_prefix, mime_types, metadata)
+        _docs = await AgentOS.similarity_memory.vector_store.raw_query_batch(
+            f"doc_contents_{self.spec.name}", embedded, self.spec.max_num_results, where
+        )
         rerank_questions = {}
-        for question, docs in question_to_docs.items():
-            rerank_questions[question] = {doc.id: doc.score for doc in docs}
+        for question, docs in zip(questions, _docs):
+            # vector stores return distances, rerankers rank higher scores first
+            rerank_questions[question] = {doc.id: -doc.score for doc in docs}
+        lexical_index = self.document_manager.lexical_index
+        if lexical_index:
+            lexical = await asyncio.gather(
+                *(lexical_index.search(q, self.spec.max_num_results, where) for q in questions)
+            )
+            for question, results in zip(questions, lexical):
+                rerank_questions[f"lexical: {question}"] = dict(results)
 
         reranked_docs = await self.document_reranker.rerank(rerank_questions)
 
@@ -128,9 +158,17 @@ class RetrieverAgent(Specable[RetrieverAgentSpec]):
 
         return summaries
 
-    async def _embed_question(self, question):
-        embedded_q = await AgentOS.similarity_memory.embedder.embed_text(question)
-        results_ = await AgentOS.similarity_memory.vector_store.raw_query(
-            f"doc_contents_{self.spec.name}", embedded_q, self.spec.max_num_results
-        )
-        return results_
+
+def _where(
+    source_prefix: Optional[str], mime_types: Optional[List[str]], metadata: Optional[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    clauses = []
+    if source_prefix:
+        clauses.append({"source": {"$prefix": source_prefix}})
+    if mime_types:
+        clauses.append({"mime_type": {"$in": mime_types}})
+    for key, value in (metadata or {}).items():
+        clauses.append({key: {"$in": value} if isinstance(value, list) else value})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
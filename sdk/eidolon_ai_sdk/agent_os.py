@@ -18,6 +18,10 @@ class AgentOS:
     symbolic_memory: "SymbolicMemory" = ...  # noqa: F821
     similarity_memory: "SimilarityMemory" = ...  # noqa: F821
     security_manager: "SecurityManager" = ...  # noqa: F821
+    client_registry: "ClientRegistry" = ...  # noqa: F821
+    llm_scheduler: "LLMScheduler" = ...  # noqa: F821
+    llm_metrics: "LLMMetrics" = ...  # noqa: F821
+    document_sync_scheduler: "DocumentSyncScheduler" = ...  # noqa: F821
 
     @staticmethod
     def current_machine_url() -> str:
@@ -42,6 +46,10 @@ class AgentOS:
         cls.symbolic_memory = machine.memory.symbolic_memory
         cls.similarity_memory = machine.memory.similarity_memory
         cls.security_manager = machine.security_manager
+        cls.client_registry = machine.client_registry
+        cls.llm_scheduler = machine.llm_scheduler
+        cls.llm_metrics = machine.llm_metrics
+        cls.document_sync_scheduler = machine.document_sync_scheduler
 
     @classmethod
     def register_resource(cls, resource: Resource, source=None):  # noqa: F821
@@ -103,4 +111,8 @@ class AgentOS:
         cls.file_memory = ...
         cls.symbolic_memory = ...
         cls.similarity_memory = ...
+        cls.client_registry = ...
+        cls.llm_scheduler = ...
+        cls.llm_metrics = ...
+        cls.document_sync_scheduler = ...
         cls.embedder = ...
@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import logging.config
 import pathlib
 from collections import deque
@@ -122,6 +123,22 @@ async def start_os(app: FastAPI, resource_generator, machine_name, log_level=log
     async def version():
         return {"version": EIDOLON_SDK_VERSION}
 
+    @app.get("/system/metrics/llm", tags=["system"], description="Get llm call histograms per model and agent")
+    async def llm_metrics():
+        return JSONResponse(content=AgentOS.llm_metrics.summary(), status_code=200)
+
+    @app.get("/system/doc_sync", tags=["system"], description="Get the background sync status of document managers")
+    async def doc_sync_status():
+        statuses = [s.model_dump() for s in AgentOS.document_sync_scheduler.status()]
+        return JSONResponse(content=statuses, status_code=200)
+
+    @app.post("/system/doc_sync/{name}", tags=["system"], description="Sync a document manager now")
+    async def doc_sync_trigger(name: str):
+        status = AgentOS.document_sync_scheduler.trigger(name)
+        if status is None:
+            return JSONResponse(content={"error": f"Document manager {name} not found"}, status_code=404)
+        return JSONResponse(content=status.model_dump(), status_code=202)
+
     # todo, this needs pagination
     @app.get("/system/processes", tags=["system"], description="Get all processes")
     async def processes():
@@ -195,6 +212,27 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         return response
 
 
+class ETagMiddleware(BaseHTTPMiddleware):
+    """
+    Adds ETags to the schema and program listings remote agents poll, answering unchanged documents with a 304.
+    """
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        response = await call_next(request)
+        path = request.url.path
+        if request.method != "GET" or response.status_code != 200:
+            return response
+        if path != "/openapi.json" and not path.endswith("/programs"):
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+        headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        return Response(content=body, status_code=200, headers=headers, media_type=response.media_type)
+
+
 class SecurityMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
         resp = await AgentOS.security_manager.authorization_processor.dispatch(request)
@@ -232,6 +270,7 @@ def main():
 # noinspection PyTypeChecker
 def start_app(lifespan):
     _app = FastAPI(lifespan=lifespan)
+    _app.add_middleware(ETagMiddleware)
     _app.add_middleware(LoggingMiddleware)
     _app.add_middleware(SecurityMiddleware)
     _app.add_middleware(ContextMiddleware)
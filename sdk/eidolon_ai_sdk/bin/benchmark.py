@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import resource
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Annotated, List, Dict, Optional
+
+import httpx
+import typer
+import uvicorn
+
+from eidolon_ai_sdk.bin.agent_http_server import start_os, start_app
+from eidolon_ai_sdk.system.resources.resources_base import Resource, Metadata
+
+app = typer.Typer()
+
+SIMPLE = "simple"
+CONVERSATIONAL = "conversational"
+
+
+def benchmark_resources(file_memory_loc: str, llm_unit: dict) -> List[Resource]:
+    """
+    An offline machine with a simple agent and a conversational agent that calls the simple agent as a tool. Both use
+    the MockLLMUnit so only sdk overhead (and the configured mock latency) is measured.
+    """
+    conversational_llm = dict(
+        llm_unit,
+        script=[
+            dict(
+                content="",
+                tool_calls=[dict(name=f"*_{SIMPLE}_*", arguments=dict(body=dict(question="what is the answer?")))],
+            ),
+            dict(content="The simple agent says it is a mock response."),
+        ],
+    )
+    simple_action = dict(
+        description="Answer a question", input_schema=dict(question=dict(type="string")), user_prompt="{{ question }}"
+    )
+    return [
+        Resource(
+            apiVersion="eidolon/v1",
+            kind="Machine",
+            metadata=Metadata(name="benchmark"),
+            spec=dict(
+                symbolic_memory="LocalSymbolicMemory",
+                file_memory=dict(implementation="LocalFileMemory", root_dir=file_memory_loc),
+                similarity_memory=dict(embedder="NoopEmbedding", vector_store="NoopVectorStore"),
+            ),
+        ),
+        Resource(
+            apiVersion="eidolon/v1",
+            kind="Agent",
+            metadata=Metadata(name=SIMPLE),
+            spec=dict(implementation="SimpleAgent", actions=[simple_action], cpu=dict(llm_unit=llm_unit)),
+        ),
+        Resource(
+            apiVersion="eidolon/v1",
+            kind="Agent",
+            metadata=Metadata(name=CONVERSATIONAL),
+            spec=dict(
+                implementation="SimpleAgent",
+                actions=[simple_action],
+                agent_refs=[SIMPLE],
+                cpu=dict(llm_unit=conversational_llm),
+            ),
+        ),
+    ]
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes a task that sleeps for a fixed interval.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def run_server(resources: List[Resource], port: int, lag_monitor: LoopLagMonitor):
+    @asynccontextmanager
+    async def lifespan(_app):
+        async with start_os(_app, resources, "benchmark", log_level=logging.WARNING):
+            lag_monitor.start()
+            yield
+            lag_monitor.stop()
+
+    config = uvicorn.Config(start_app(lifespan), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    # agents call each other through the local machine
+    local_machine = os.environ.get("EIDOLON_LOCAL_MACHINE")
+    os.environ["EIDOLON_LOCAL_MACHINE"] = f"http://127.0.0.1:{port}"
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            await asyncio.sleep(0.05)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await asyncio.to_thread(thread.join)
+        if local_machine is None:
+            del os.environ["EIDOLON_LOCAL_MACHINE"]
+        else:
+            os.environ["EIDOLON_LOCAL_MACHINE"] = local_machine
+
+
+async def _call_agent(client: httpx.AsyncClient, agent: str) -> float:
+    started = time.perf_counter()
+    process = (await client.post(f"/agents/{agent}/processes")).raise_for_status().json()
+    response = await client.post(
+        f"/agents/{agent}/processes/{process['process_id']}/actions/converse",
+        json=dict(question="what is the answer?"),
+        headers={"Accept": "application/json"},
+    )
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return dict(p50=None, p95=None, p99=None)
+    if len(values) == 1:
+        return dict(p50=values[0], p95=values[0], p99=values[0])
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return dict(p50=cuts[49], p95=cuts[94], p99=cuts[98])
+
+
+async def run_benchmark(
+    agents: List[str], concurrency: int, requests: int, llm_unit: dict, timeout: float = 60.0
+) -> Dict[str, dict]:
+    """
+    Drive `requests` agent calls (spread round-robin over `agents`) with `concurrency` concurrent clients against an
+    in-process server and report throughput, latency percentiles, event loop lag and memory.
+    """
+    lag_monitor = LoopLagMonitor()
+    latencies: Dict[str, List[float]] = {agent: [] for agent in agents}
+    errors: Dict[str, int] = {agent: 0 for agent in agents}
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as file_memory_loc:
+        async with run_server(benchmark_resources(file_memory_loc, llm_unit), port, lag_monitor) as url:
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+                queue = asyncio.Queue()
+                for i in range(requests):
+                    queue.put_nowait(agents[i % len(agents)])
+
+                async def worker():
+                    while not queue.empty():
+                        agent = queue.get_nowait()
+                        try:
+                            latencies[agent].append(await _call_agent(client, agent))
+                        except Exception:
+                            errors[agent] += 1
+
+                started = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+                elapsed = time.perf_counter() - started
+
+    completed = sum(len(v) for v in latencies.values())
+    return dict(
+        total=dict(
+            requests=requests,
+            completed=completed,
+            errors=sum(errors.values()),
+            seconds=elapsed,
+            throughput=completed / elapsed,
+            **_percentiles(sorted(sum(latencies.values(), []))),
+        ),
+        **{
+            agent: dict(completed=len(values), errors=errors[agent], **_percentiles(sorted(values)))
+            for agent, values in latencies.items()
+        },
+        event_loop_lag=dict(max=max(lag_monitor.samples, default=None), **_percentiles(sorted(lag_monitor.samples))),
+        # ru_maxrss is reported in kilobytes on linux
+        memory=dict(peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+    )
+
+
+def _format(report: Dict[str, dict]) -> str:
+    lines = []
+    for section, values in report.items():
+        formatted = ", ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in values.items())
+        lines.append(f"{section}: {formatted}")
+    return "\n".join(lines)
+
+
+@app.command()
+def main(
+    concurrency: Annotated[int, typer.Option(help="The number of concurrent clients")] = 10,
+    requests: Annotated[int, typer.Option(help="The total number of agent calls to make")] = 200,
+    agent: Annotated[List[str], typer.Option(help="The agents to call")] = (SIMPLE, CONVERSATIONAL),
+    time_to_first_token: Annotated[float, typer.Option(help="Mock llm time to first token")] = 0.0,
+    tokens_per_second: Annotated[Optional[float], typer.Option(help="Mock llm tokens per second")] = None,
+    jitter: Annotated[float, typer.Option(help="Mock llm latency jitter")] = 0.0,
+):
+    llm_unit = dict(
+        implementation="MockLLMUnit",
+        time_to_first_token=time_to_first_token,
+        tokens_per_second=tokens_per_second,
+        jitter=jitter,
+    )
+    report = asyncio.run(run_benchmark(list(agent), concurrency, requests, llm_unit))
+    typer.echo(_format(report))
+
+
+if __name__ == "__main__":
+    app()
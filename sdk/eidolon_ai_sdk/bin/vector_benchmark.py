@@ -0,0 +1,102 @@
+import asyncio
+import tempfile
+import time
+from typing import Annotated, Dict, List, Tuple
+
+import numpy as np
+import typer
+
+from eidolon_ai_sdk.bin.benchmark import _format, _percentiles
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+from eidolon_ai_sdk.memory.hnsw_vector_store import HnswParams, HnswVectorStore, HnswVectorStoreSpec
+from eidolon_ai_sdk.memory.numpy_vector_store import NumpyVectorStore, NumpyVectorStoreSpec
+
+app = typer.Typer()
+
+COLLECTION = "benchmark"
+
+
+def clustered_vectors(rows: int, dimensions: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """
+    Random vectors grouped around random centers, which is closer to real embeddings than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions))
+    vectors = centers[rng.integers(clusters, size=rows)] + 0.5 * rng.standard_normal((rows, dimensions))
+    return vectors.astype(np.float32)
+
+
+async def _load(store, vectors: np.ndarray, batch_size: int = 1000) -> float:
+    started = time.perf_counter()
+    for start in range(0, len(vectors), batch_size):
+        docs = [
+            EmbeddedDocument(id=str(i), embedding=v.tolist())
+            for i, v in enumerate(vectors[start : start + batch_size], start)
+        ]
+        await store.add_embedding(COLLECTION, docs)
+    return time.perf_counter() - started
+
+
+async def _search(store, queries: np.ndarray, k: int, **kwargs) -> Tuple[List[List[str]], List[float]]:
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        found = await store.query_embedding(COLLECTION, query.tolist(), k, **kwargs)
+        latencies.append(time.perf_counter() - started)
+        results.append([r.id for r in found])
+    return results, latencies
+
+
+async def run_vector_benchmark(
+    rows: int,
+    dimensions: int,
+    queries: int,
+    k: int,
+    ef_search: List[int],
+    m: int = 16,
+    ef_construction: int = 200,
+    clusters: int = 100,
+) -> Dict[str, dict]:
+    """
+    Compare the recall and latency of HNSW searches at several ef_search values against exact (brute-force) search
+    of the same vectors.
+    """
+    vectors = clustered_vectors(rows, dimensions, clusters)
+    query_vectors = clustered_vectors(queries, dimensions, clusters, seed=1)
+    report = {}
+    with tempfile.TemporaryDirectory() as exact_dir, tempfile.TemporaryDirectory() as hnsw_dir:
+        exact_store = NumpyVectorStore(NumpyVectorStoreSpec(root_dir=exact_dir))
+        load_seconds = await _load(exact_store, vectors)
+        expected, latencies = await _search(exact_store, query_vectors, k)
+        report["exact"] = dict(load_seconds=load_seconds, recall=1.0, **_percentiles(sorted(latencies)))
+
+        params = HnswParams(m=m, ef_construction=ef_construction)
+        hnsw_store = HnswVectorStore(HnswVectorStoreSpec(root_dir=hnsw_dir, index=params, exact_search_limit=0))
+        load_seconds = await _load(hnsw_store, vectors)
+        for ef in ef_search:
+            found, latencies = await _search(hnsw_store, query_vectors, k, ef_search=ef)
+            recall = np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)])
+            report[f"hnsw ef_search={ef}"] = dict(
+                load_seconds=load_seconds, recall=float(recall), **_percentiles(sorted(latencies))
+            )
+    return report
+
+
+@app.command()
+def main(
+    rows: Annotated[int, typer.Option(help="The number of vectors to index")] = 20_000,
+    dimensions: Annotated[int, typer.Option(help="The number of dimensions of the vectors")] = 128,
+    queries: Annotated[int, typer.Option(help="The number of queries to run")] = 200,
+    k: Annotated[int, typer.Option(help="The number of results per query")] = 10,
+    ef_search: Annotated[List[int], typer.Option(help="The ef_search values to measure")] = (16, 64, 256),
+    m: Annotated[int, typer.Option(help="The HNSW M parameter")] = 16,
+    ef_construction: Annotated[int, typer.Option(help="The HNSW ef_construction parameter")] = 200,
+):
+    report = asyncio.run(
+        run_vector_benchmark(rows, dimensions, queries, k, list(ef_search), m=m, ef_construction=ef_construction)
+    )
+    typer.echo(_format(report))
+
+
+if __name__ == "__main__":
+    app()
@@ -8,6 +8,7 @@ from eidolon_ai_sdk.agent.doc_manager.loaders.filesystem_loader import Filesyste
 from eidolon_ai_sdk.agent.doc_manager.loaders.github_loader import GitHubLoader
 from eidolon_ai_sdk.agent.doc_manager.parsers.auto_parser import AutoParser
 from eidolon_ai_sdk.agent.doc_manager.parsers.base_parser import DocumentParser
+from eidolon_ai_sdk.agent.doc_manager.sync_scheduler import DocumentSyncScheduler
 from eidolon_ai_sdk.agent.doc_manager.transformer.auto_transformer import AutoTransformer
 from eidolon_ai_sdk.agent.doc_manager.transformer.document_transformer import DocumentTransformer
 from eidolon_ai_sdk.agent.generic_agent import GenericAgent
@@ -24,6 +25,15 @@ from eidolon_ai_sdk.cpu.agent_cpu import AgentCPU
 from eidolon_ai_sdk.cpu.agent_io import IOUnit
 from eidolon_ai_sdk.cpu.conversation_memory_unit import RawMemoryUnit
 from eidolon_ai_sdk.cpu.conversational_agent_cpu import ConversationalAgentCPU
+from eidolon_ai_sdk.cpu.llm.llm_response_cache import (
+    LLMResponseCache,
+    InMemoryLLMResponseCache,
+    FileMemoryLLMResponseCache,
+    SymbolicMemoryLLMResponseCache,
+)
+from eidolon_ai_sdk.cpu.llm.llm_metrics import LLMMetrics
+from eidolon_ai_sdk.cpu.llm.llm_scheduler import LLMScheduler
+from eidolon_ai_sdk.cpu.llm.mock_llm_unit import MockLLMUnit
 from eidolon_ai_sdk.cpu.llm.open_ai_llm_unit import OpenAIGPT
 from eidolon_ai_sdk.cpu.llm.open_ai_speech import OpenAiSpeech
 from eidolon_ai_sdk.cpu.llm_unit import LLMUnit
@@ -36,7 +46,9 @@ except ImportError:
     logger.warning("Error, ChromaVectorStore is not available")
     ChromaVectorStore = None
 
-from eidolon_ai_sdk.memory.embeddings import NoopEmbedding, Embedding, OpenAIEmbedding
+from eidolon_ai_sdk.memory.numpy_vector_store import NumpyVectorStore
+from eidolon_ai_sdk.memory.hnsw_vector_store import HnswVectorStore
+from eidolon_ai_sdk.memory.embeddings import NoopEmbedding, Embedding, OpenAIEmbedding, HashingEmbedding
 from eidolon_ai_sdk.memory.file_memory import FileMemory
 from eidolon_ai_sdk.memory.local_file_memory import LocalFileMemory
 from eidolon_ai_sdk.memory.local_symbolic_memory import LocalSymbolicMemory
@@ -47,6 +59,7 @@ from eidolon_ai_sdk.memory.similarity_memory import SimilarityMemory
 from eidolon_ai_sdk.memory.vector_store import VectorStore
 from eidolon_ai_sdk.security.security_manager import SecurityManager
 from eidolon_ai_sdk.system.agent_machine import AgentMachine
+from eidolon_ai_sdk.system.client_registry import ClientRegistry
 from eidolon_ai_sdk.system.resources.reference_resource import ReferenceResource
 from eidolon_ai_sdk.system.resources.resources_base import Metadata
 from eidolon_ai_sdk.util.class_utils import fqn
@@ -83,6 +96,10 @@ def named_builtins():
         AgentMachine,
         # security manager
         SecurityManager,
+        ClientRegistry,
+        LLMScheduler,
+        LLMMetrics,
+        DocumentSyncScheduler,
         # agents
         ("Agent", SimpleAgent),
         SimpleAgent,
@@ -96,6 +113,11 @@ def named_builtins():
         IOUnit,
         (LLMUnit, OpenAIGPT),
         OpenAIGPT,
+        MockLLMUnit,
+        (LLMResponseCache, InMemoryLLMResponseCache),
+        InMemoryLLMResponseCache,
+        FileMemoryLLMResponseCache,
+        SymbolicMemoryLLMResponseCache,
         (MemoryUnit, RawMemoryUnit),
         RawMemoryUnit,
         WebSearch,
@@ -109,9 +131,12 @@ def named_builtins():
         (Embedding, OpenAIEmbedding),
         NoopEmbedding,
         OpenAIEmbedding,
+        HashingEmbedding,
         (VectorStore, ChromaVectorStore),
         NoopVectorStore,
         ChromaVectorStore,
+        NumpyVectorStore,
+        HnswVectorStore,
         # sub components
         (DocumentParser, AutoParser),
         AutoParser,
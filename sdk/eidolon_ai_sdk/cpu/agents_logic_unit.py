@@ -1,10 +1,14 @@
-from pydantic import BaseModel
-from typing import List, Any, Dict, AsyncIterator
+import asyncio
+from collections import OrderedDict
 
-from eidolon_ai_client.client import Machine, Agent, AgentResponseIterator
+from pydantic import BaseModel, Field
+from typing import List, Any, Dict, AsyncIterator, Hashable, Optional, Type, Tuple, Callable
+
+from eidolon_ai_client.client import Agent, AgentResponseIterator
 from eidolon_ai_sdk.cpu.agent_call_history import AgentCallHistory
 from eidolon_ai_sdk.cpu.call_context import CallContext
 from eidolon_ai_sdk.cpu.logic_unit import LogicUnit
+from eidolon_ai_sdk.cpu.remote_agent_cache import RemoteAgentCache
 from eidolon_ai_client.events import StreamEvent
 from eidolon_ai_sdk.system.fn_handler import FnHandler
 from eidolon_ai_sdk.system.reference_model import Specable
@@ -15,32 +19,72 @@ from eidolon_ai_sdk.util.schema_to_model import schema_to_model
 class AgentsLogicUnitSpec(BaseModel):
     tool_prefix: str = "convo"
     agents: List[str]
+    remote_cache_ttl_seconds: float = Field(
+        default=60.0,
+        description="How long remote program lists and schemas are used before being revalidated with the machine.",
+    )
+    max_cached_threads: int = Field(
+        default=1000, description="The number of threads whose agent call history is cached in memory."
+    )
 
 
 class AgentsLogicUnit(Specable[AgentsLogicUnitSpec], LogicUnit):
-    _machine_schemas: Dict[str, dict]
+    _remote: RemoteAgentCache
+    _body_models: Dict[Tuple[str, str], Tuple[dict, Type[BaseModel]]]
+    _call_histories: OrderedDict[Tuple[str, Optional[str]], Dict[Tuple[str, str], AgentCallHistory]]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._machine_schemas = {}
+        self._remote = RemoteAgentCache(self.spec.remote_cache_ttl_seconds)
+        self._body_models = {}
+        self._call_histories = OrderedDict()
+
+    async def tools_version(self, call_context: CallContext) -> Optional[Hashable]:
+        # tools are bound to the calling thread and grow with the agents it has called (remote schemas are cached)
+        call_history = await self.get_call_history(call_context)
+        return (
+            call_context.process_id,
+            call_context.thread_id,
+            tuple((c.remote_process_id, c.state, tuple(c.available_actions)) for c in call_history),
+        )
 
     async def build_tools(self, call_context: CallContext) -> List[FnHandler]:
-        tools = await self.build_program_tools(call_context)
-        call_history = await AgentCallHistory.get_agent_state(call_context.process_id, call_context.thread_id)
-        for call in call_history:
-            for action in call.available_actions:
-                context_ = await self.build_action_tool(
-                    call.machine, call.agent, action, call.remote_process_id, call_context
-                )
-                if context_:
-                    tools.append(context_)
-
-        return tools
+        call_history = await self.get_call_history(call_context)
+        program_tools, *action_tools = await asyncio.gather(
+            self.build_program_tools(call_context),
+            *(
+                self.build_action_tool(call.machine, call.agent, action, call.remote_process_id, call_context)
+                for call in call_history
+                for action in call.available_actions
+            ),
+        )
+        return program_tools + [tool for tool in action_tools if tool]
+
+    async def get_call_history(self, call_context: CallContext) -> List[AgentCallHistory]:
+        key = (call_context.process_id, call_context.thread_id)
+        if key in self._call_histories:
+            self._call_histories.move_to_end(key)
+        else:
+            history = await AgentCallHistory.get_agent_state(call_context.process_id, call_context.thread_id)
+            # another request may have loaded the thread while we were waiting
+            if key not in self._call_histories:
+                self._call_histories[key] = {(c.agent, c.remote_process_id): c for c in history}
+                while len(self._call_histories) > self.spec.max_cached_threads:
+                    self._call_histories.popitem(last=False)
+        return list(self._call_histories[key].values())
+
+    def record_call(self, call: AgentCallHistory):
+        """
+        Update the cached call history of the calling thread once a recorded call has been stored.
+        """
+        history = self._call_histories.get((call.parent_process_id, call.parent_thread_id))
+        if history is not None:
+            history[(call.agent, call.remote_process_id)] = call
 
     async def clone_thread(self, old_context: CallContext, new_context: CallContext):
         call_history = await AgentCallHistory.get_agent_state(old_context.process_id, old_context.thread_id)
         for call in call_history:
-            await AgentCallHistory(
+            cloned = AgentCallHistory(
                 parent_process_id=new_context.process_id,
                 parent_thread_id=new_context.thread_id,
                 machine=call.machine,
@@ -48,20 +92,16 @@ class AgentsLogicUnit(Specable[AgentsLogicUnitSpec], LogicUnit):
                 remote_process_id=call.remote_process_id,
                 state=call.state,
                 available_actions=call.available_actions,
-            ).upsert()
-
-    async def _get_schema(self, machine: str) -> dict:
-        if machine not in self._machine_schemas:
-            self._machine_schemas[machine] = await Machine(machine=machine).get_schema()
-        return self._machine_schemas[machine]
+            )
+            await cloned.upsert()
+            self.record_call(cloned)
 
     async def build_action_tool(
         self, machine: str, agent: str, action: str, remote_process_id: str, call_context: CallContext
     ):
         agent_client = Agent.get(agent)
         path = f"/agents/{agent}/processes/{{process_id}}/actions/{action}"
-        machine_schema = await self._get_schema(machine)
-        endpoint_schema = machine_schema["paths"][path]["post"]
+        endpoint_schema = await self._remote.endpoint_schema(machine, path)
         try:
             name = self._name(agent, action=action)
             tool = self._build_tool_def(
@@ -69,6 +109,7 @@ class AgentsLogicUnit(Specable[AgentsLogicUnitSpec], LogicUnit):
                 action,
                 name,
                 endpoint_schema,
+                self._body_model(machine, path, endpoint_schema, name),
                 self._process_tool(agent_client, action, remote_process_id, call_context),
             )
             return tool
@@ -76,29 +117,32 @@ class AgentsLogicUnit(Specable[AgentsLogicUnitSpec], LogicUnit):
             logger.warning(f"unable to build tool {path}", exc_info=True)
 
     async def build_program_tools(self, call_context: CallContext):
+        agent_tools = await asyncio.gather(*(self._build_agent_program_tools(a, call_context) for a in self.spec.agents))
+        return [tool for tools in agent_tools for tool in tools]
+
+    async def _build_agent_program_tools(self, agent: str, call_context: CallContext):
+        agent_client = Agent.get(agent)
         tools = []
-        for agent in self.spec.agents:
-            agent_client = Agent.get(agent)
-            machine_schema = await self._get_schema(agent_client.machine)
-            for action in await agent_client.programs():
-                path = f"/agents/{agent}/processes/{{process_id}}/actions/{action}"
-                try:
-                    name = self._name(agent, action=action)
-                    tool = self._build_tool_def(
-                        agent,
-                        action,
-                        name,
-                        machine_schema["paths"][path]["post"],
-                        self._program_tool(agent_client, action, call_context),
-                    )
-                    tools.append(tool)
-                except ValueError:
-                    logger.warning(f"unable to build tool {path}", exc_info=True)
+        for action in await self._remote.programs(agent_client):
+            path = f"/agents/{agent}/processes/{{process_id}}/actions/{action}"
+            endpoint_schema = await self._remote.endpoint_schema(agent_client.machine, path)
+            try:
+                name = self._name(agent, action=action)
+                tool = self._build_tool_def(
+                    agent,
+                    action,
+                    name,
+                    endpoint_schema,
+                    self._body_model(agent_client.machine, path, endpoint_schema, name),
+                    self._program_tool(agent_client, action, call_context),
+                )
+                tools.append(tool)
+            except ValueError:
+                logger.warning(f"unable to build tool {path}", exc_info=True)
         return tools
 
-    def _build_tool_def(self, agent, operation, name, endpoint_schema, tool_call):
+    def _build_tool_def(self, agent, operation, name, endpoint_schema, model, tool_call):
         description = self._description(endpoint_schema, name)
-        model = self._body_model(endpoint_schema, name)
         return FnHandler(
             name=name,
             description=lambda a, b: description,
@@ -112,8 +156,15 @@ class AgentsLogicUnit(Specable[AgentsLogicUnitSpec], LogicUnit):
             },
         )
 
+    def _body_model(self, machine, path, endpoint_schema, name):
+        cached = self._body_models.get((machine, path))
+        if not cached or cached[0] is not endpoint_schema:
+            model = self._build_body_model(endpoint_schema, name)
+            cached = self._body_models[(machine, path)] = (endpoint_schema, model)
+        return cached[1]
+
     @staticmethod
-    def _body_model(endpoint_schema, name):
+    def _build_body_model(endpoint_schema, name):
         body = endpoint_schema.get("requestBody")
         if body and "application/json" not in body["content"]:
             raise ValueError(f"Agent action at {name} does not support application/json")
@@ -140,7 +191,10 @@ class AgentsLogicUnit(Specable[AgentsLogicUnitSpec], LogicUnit):
     def _program_tool(self, agent: Agent, program: str, call_context: CallContext):
         async def fn(_self, body):
             async for event in RecordAgentResponseIterator(
-                (await agent.create_process()).stream_action(program, body), call_context.process_id, call_context.thread_id
+                (await agent.create_process()).stream_action(program, body),
+                call_context.process_id,
+                call_context.thread_id,
+                on_record=self.record_call,
             ):
                 yield event
 
@@ -150,7 +204,10 @@ class AgentsLogicUnit(Specable[AgentsLogicUnitSpec], LogicUnit):
     def _process_tool(self, agent: Agent, action: str, process_id: str, call_context: CallContext):
         def fn(_self, body):
             return RecordAgentResponseIterator(
-                agent.process(process_id).stream_action(action, body), call_context.process_id, call_context.thread_id
+                agent.process(process_id).stream_action(action, body),
+                call_context.process_id,
+                call_context.thread_id,
+                on_record=self.record_call,
             )
 
         return fn
@@ -161,10 +218,17 @@ class RecordAgentResponseIterator(AgentResponseIterator):
     parent_process_id: str
     parent_thread_id: str
 
-    def __init__(self, data: AsyncIterator[StreamEvent], parent_process_id: str, parent_thread_id: str):
+    def __init__(
+        self,
+        data: AsyncIterator[StreamEvent],
+        parent_process_id: str,
+        parent_thread_id: str,
+        on_record: Optional[Callable[[AgentCallHistory], None]] = None,
+    ):
         super().__init__(data)
         self.parent_process_id = parent_process_id
         self.parent_thread_id = parent_thread_id
+        self.on_record = on_record
 
     async def iteration_complete(self):
         call_data = AgentCallHistory(
@@ -177,5 +241,7 @@ class RecordAgentResponseIterator(AgentResponseIterator):
             available_actions=self.available_actions,
         )
         await call_data.upsert()
+        if self.on_record:
+            self.on_record(call_data)
 
         return await super().iteration_complete()
@@ -1,6 +1,9 @@
-from typing import List, Type, Dict, Any, Union, Literal, AsyncIterator
+import asyncio
+from contextlib import AsyncExitStack
+from typing import List, Type, Dict, Any, Union, Literal, AsyncIterator, Optional
 
 from fastapi import HTTPException
+from pydantic import Field
 
 from eidolon_ai_sdk.cpu.agent_cpu import AgentCPU, AgentCPUSpec, Thread, CPUException
 from eidolon_ai_sdk.cpu.agent_io import IOUnit, CPUMessageTypes
@@ -14,6 +17,7 @@ from eidolon_ai_client.events import (
     StreamEvent,
     LLMToolCallRequestEvent,
     ToolCallStartEvent,
+    ToolCall,
 )
 from eidolon_ai_sdk.system.reference_model import Reference, AnnotatedReference, Specable
 from eidolon_ai_client.util.logger import logger
@@ -28,6 +32,19 @@ class ConversationalAgentCPUSpec(AgentCPUSpec):
     logic_units: List[Reference[LogicUnit]] = []
     record_conversation: bool = True
     allow_tool_errors: bool = True
+    max_parallel_tool_calls: Optional[int] = Field(
+        default=None, description="The maximum number of tool calls from one llm response that run concurrently."
+    )
+    max_parallel_tool_calls_per_logic_unit: Optional[int] = Field(
+        default=None, description="The maximum number of concurrent tool calls to each logic unit across requests."
+    )
+    tool_call_timeout: Optional[float] = Field(
+        default=None, description="The number of seconds a single tool call may run before it is timed out."
+    )
+    tool_calls_deadline: Optional[float] = Field(
+        default=None,
+        description="The number of seconds all tool calls from one llm response (including queueing) may take.",
+    )
 
 
 class ConversationalAgentCPU(AgentCPU, Specable[ConversationalAgentCPUSpec], ProcessingUnitLocator):
@@ -43,6 +60,7 @@ class ConversationalAgentCPU(AgentCPU, Specable[ConversationalAgentCPUSpec], Pro
         self.llm_unit = self.spec.llm_unit.instantiate(**kwargs)
         self.logic_units = [logic_unit.instantiate(**kwargs) for logic_unit in self.spec.logic_units]
         self.record_memory = self.spec.record_conversation
+        self._logic_unit_limits: Dict[int, asyncio.Semaphore] = {}
 
     def locate_unit(self, unit_type: Type[PU_T]) -> PU_T:
         for unit in self.logic_units:
@@ -115,9 +133,18 @@ class ConversationalAgentCPU(AgentCPU, Specable[ConversationalAgentCPUSpec], Pro
                 await self.memory_unit.storeMessages(call_context, [assistant_message])
             conversation.append(assistant_message)
 
-            # process tool calls
+            # process tool calls. Siblings are cancelled if one raises (when tool errors are not allowed)
+            turn_limit = None
+            if self.spec.max_parallel_tool_calls:
+                turn_limit = asyncio.Semaphore(self.spec.max_parallel_tool_calls)
+            deadline = None
+            if self.spec.tool_calls_deadline is not None:
+                deadline = asyncio.get_running_loop().time() + self.spec.tool_calls_deadline
             async for e in merge_streams(
-                [self._call_tool(call_context, tce, tool_defs, conversation) for tce in tool_call_events]
+                [
+                    self._call_tool(call_context, tce, tool_defs, conversation, turn_limit, deadline)
+                    for tce in tool_call_events
+                ]
             ):
                 yield e
             if not tool_call_events:
@@ -131,18 +158,54 @@ class ConversationalAgentCPU(AgentCPU, Specable[ConversationalAgentCPUSpec], Pro
         tool_call_event: LLMToolCallRequestEvent,
         tool_defs,
         conversation: List[LLMMessage],
+        turn_limit: Optional[asyncio.Semaphore] = None,
+        deadline: Optional[float] = None,
     ):
         tc = tool_call_event.tool_call
-        logic_unit_wrapper = ["NaN"]
 
         tool_def = tool_defs[tc.name]
+        async with AsyncExitStack() as slots:
+            for limit in [turn_limit, self._logic_unit_limit(tool_def.logic_unit)]:
+                if limit:
+                    await slots.enter_async_context(limit)
+            async for event in self._stream_tool(call_context, tc, tool_def, tool_defs, conversation, deadline):
+                yield event
+
+    def _logic_unit_limit(self, logic_unit: LogicUnit) -> Optional[asyncio.Semaphore]:
+        if not self.spec.max_parallel_tool_calls_per_logic_unit:
+            return None
+        key = id(logic_unit)
+        if key not in self._logic_unit_limits:
+            self._logic_unit_limits[key] = asyncio.Semaphore(self.spec.max_parallel_tool_calls_per_logic_unit)
+        return self._logic_unit_limits[key]
+
+    def _tool_timeout(self, deadline: Optional[float]) -> Optional[float]:
+        timeouts = []
+        if self.spec.tool_call_timeout is not None:
+            timeouts.append(self.spec.tool_call_timeout)
+        if deadline is not None:
+            timeouts.append(deadline - asyncio.get_running_loop().time())
+        return min(timeouts) if timeouts else None
+
+    async def _stream_tool(
+        self,
+        call_context: CallContext,
+        tc: ToolCall,
+        tool_def: LLMToolWrapper,
+        tool_defs,
+        conversation: List[LLMMessage],
+        deadline: Optional[float],
+    ):
+        logic_unit_wrapper = ["NaN"]
+        timeout = self._tool_timeout(deadline)
 
         def tool_event_stream():
             try:
                 logic_unit_wrapper[0] = tool_def.logic_unit.__class__.__name__
-                return tool_def.execute(tool_call=tc)
+                stream = tool_def.execute(tool_call=tc)
+                return stream if timeout is None else _with_timeout(stream, tc.name, timeout)
             except KeyError:
-                raise ValueError(f"Tool {tool_call_event.tool_call.name} not found. Available tools: {tool_defs.keys()}")
+                raise ValueError(f"Tool {tc.name} not found. Available tools: {tool_defs.keys()}")
 
         tool_stream = stream_manager(
             tool_event_stream,
@@ -159,7 +222,7 @@ class ConversationalAgentCPU(AgentCPU, Specable[ConversationalAgentCPUSpec], Pro
                 yield event
         except ManagedContextError:
             if self.spec.allow_tool_errors:
-                logger.warning("Error calling tool " + tool_call_event.tool_call.name, exc_info=True)
+                logger.warning("Error calling tool " + tc.name, exc_info=True)
             else:
                 raise
 
@@ -181,3 +244,25 @@ class ConversationalAgentCPU(AgentCPU, Specable[ConversationalAgentCPUSpec], Pro
             await processor.clone_thread(call_context, new_context)
 
         return Thread(call_context=new_context, cpu=self)
+
+
+async def _with_timeout(stream: AsyncIterator[StreamEvent], name: str, timeout: float) -> AsyncIterator[StreamEvent]:
+    """
+    Stream a tool's events, raising a TimeoutError once the tool has run longer than timeout seconds. The error is
+    reported to the llm as the tool's response.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    iterator = aiter(stream)
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(anext(iterator), max(0.0, deadline - loop.time()))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Tool call {name} timed out after {timeout:.1f} seconds")
+            yield event
+    finally:
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
@@ -0,0 +1,193 @@
+import bisect
+import time
+from typing import Dict, Optional, List, Tuple
+
+from pydantic import BaseModel, Field
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.system.reference_model import Specable
+
+# exponential bucket boundaries from 1ms (or 0.001 tokens) to ~9 hours (or ~33k tokens/s)
+_BUCKETS = [0.001 * 2**i for i in range(25)]
+
+
+class LLMCallMetrics(BaseModel):
+    """
+    Measurements of a single llm call. Times are in seconds.
+    """
+
+    model: str
+    agent: Optional[str] = None
+    build_time: float = Field(default=0.0, description="Time converting messages (including image work) and tools.")
+    queue_wait: float = Field(default=0.0, description="Time queued behind rate limits and retrying failed attempts.")
+    time_to_first_token: Optional[float] = Field(
+        default=None, description="Time from dispatching the request (including connecting) to the first token."
+    )
+    inter_token_gap_mean: Optional[float] = None
+    inter_token_gap_max: Optional[float] = None
+    output_tokens: int = Field(default=0, description="Number of streamed content and tool call chunks.")
+    tokens_per_second: Optional[float] = None
+    parse_time: float = Field(default=0.0, description="Time parsing tool calls and object responses.")
+    total_time: float = Field(default=0.0, description="Time from starting the request build to the parsed response.")
+
+
+class LLMCallTimer:
+    """
+    Accumulates the timings of one llm call as its response streams in.
+    """
+
+    def __init__(self, metrics: LLMCallMetrics, started: float):
+        self.metrics = metrics
+        self.started = started
+        self.gaps: List[float] = []
+        self._scheduled = None
+        self._dispatched = None
+        self._last_token = None
+        self.finished = False
+
+    def scheduled(self):
+        self._scheduled = time.perf_counter()
+
+    def dispatched(self):
+        self._dispatched = time.perf_counter()
+        self.metrics.queue_wait = self._dispatched - self._scheduled
+        # a retried request starts streaming over
+        self.gaps = []
+        self._last_token = None
+        self.metrics.output_tokens = 0
+
+    def token(self):
+        now = time.perf_counter()
+        if self._last_token is None:
+            self.metrics.time_to_first_token = now - self._dispatched
+        else:
+            self.gaps.append(now - self._last_token)
+        self._last_token = now
+        self.metrics.output_tokens += 1
+
+    def finish(self, parse_time: float) -> LLMCallMetrics:
+        self.finished = True
+        metrics = self.metrics
+        metrics.parse_time = parse_time
+        metrics.total_time = time.perf_counter() - self.started
+        if self.gaps:
+            metrics.inter_token_gap_mean = sum(self.gaps) / len(self.gaps)
+            metrics.inter_token_gap_max = max(self.gaps)
+            metrics.tokens_per_second = len(self.gaps) / sum(self.gaps) if sum(self.gaps) else None
+        return metrics
+
+
+class Histogram:
+    """
+    Fixed exponential bucket histogram. Percentiles are estimated by the upper bound of the containing bucket.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = p * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                upper = _BUCKETS[i] if i < len(_BUCKETS) else self.max
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return dict(
+            count=self.count,
+            mean=self.total / self.count if self.count else None,
+            min=self.min,
+            max=self.max,
+            p50=self.percentile(0.5),
+            p95=self.percentile(0.95),
+            p99=self.percentile(0.99),
+        )
+
+
+_HISTOGRAM_FIELDS = [
+    "build_time",
+    "queue_wait",
+    "time_to_first_token",
+    "output_tokens",
+    "tokens_per_second",
+    "parse_time",
+    "total_time",
+]
+
+
+class LLMMetricsSpec(BaseModel):
+    max_series: int = Field(
+        default=1000, description="The maximum number of model / agent combinations to track histograms for."
+    )
+
+
+class LLMMetrics(Specable[LLMMetricsSpec]):
+    """
+    Machine level histograms of llm call metrics per model and agent.
+    """
+
+    _series: Dict[Tuple[str, Optional[str]], Dict[str, Histogram]]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._series = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def record(self, metrics: LLMCallMetrics, inter_token_gaps: List[float] = ()):
+        key = (metrics.model, metrics.agent)
+        if key not in self._series:
+            if len(self._series) >= self.spec.max_series:
+                return
+            self._series[key] = {f: Histogram() for f in _HISTOGRAM_FIELDS + ["inter_token_gap"]}
+        series = self._series[key]
+        for field in _HISTOGRAM_FIELDS:
+            value = getattr(metrics, field)
+            if value is not None:
+                series[field].record(value)
+        for gap in inter_token_gaps:
+            series["inter_token_gap"].record(gap)
+
+    def summary(self) -> List[dict]:
+        return [
+            dict(model=model, agent=agent, metrics={name: h.summary() for name, h in series.items()})
+            for (model, agent), series in self._series.items()
+        ]
+
+    def clear(self):
+        self._series = {}
+
+
+_unmanaged_metrics: Optional[LLMMetrics] = None
+
+
+def get_metrics() -> LLMMetrics:
+    """
+    Get the machine's llm metrics. Outside a running machine metrics are recorded to a process wide default.
+    """
+    global _unmanaged_metrics
+    if AgentOS.llm_metrics is not ...:
+        return AgentOS.llm_metrics
+    if not _unmanaged_metrics:
+        _unmanaged_metrics = LLMMetrics(spec=LLMMetricsSpec())
+    return _unmanaged_metrics
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+
+from pydantic import BaseModel, Field
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.system.reference_model import Specable
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """
+    Canonical hash of a built llm request (messages, tools, model, temperature, response format, etc).
+    Transport only arguments (ie, stream) are ignored.
+    """
+    canonical = {k: v for k, v in request.items() if k != "stream"}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LLMResponseCache(ABC):
+    """
+    Stores the serialized event stream of completed llm responses keyed by the canonical request hash.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[List[dict]]:
+        pass
+
+    @abstractmethod
+    async def put(self, key: str, events: List[dict]):
+        pass
+
+
+class LLMResponseCacheSpec(BaseModel):
+    ttl_seconds: Optional[float] = Field(
+        default=3600, description="The number of seconds responses are cached. None to never expire."
+    )
+
+
+def _expired(created_at: float, ttl_seconds: Optional[float]) -> bool:
+    return ttl_seconds is not None and created_at + ttl_seconds < time.time()
+
+
+class InMemoryLLMResponseCacheSpec(LLMResponseCacheSpec):
+    max_entries: int = Field(default=1000, description="The maximum number of responses to cache.")
+
+
+class InMemoryLLMResponseCache(LLMResponseCache, Specable[InMemoryLLMResponseCacheSpec]):
+    """
+    Least recently used, in process cache. Entries are lost when the process stops.
+    """
+
+    _entries: OrderedDict[str, Tuple[float, List[dict]]]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries = OrderedDict()
+
+    async def get(self, key: str) -> Optional[List[dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if _expired(entry[0], self.spec.ttl_seconds):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def put(self, key: str, events: List[dict]):
+        self._entries[key] = (time.time(), events)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.spec.max_entries:
+            self._entries.popitem(last=False)
+
+
+class FileMemoryLLMResponseCacheSpec(LLMResponseCacheSpec):
+    directory: str = Field(default="llm_response_cache", description="The file memory directory to store responses in.")
+    max_entry_bytes: int = Field(default=1_000_000, description="Responses larger than this are not cached.")
+
+
+class FileMemoryLLMResponseCache(LLMResponseCache, Specable[FileMemoryLLMResponseCacheSpec]):
+    """
+    Stores responses in the machine's file memory so they survive restarts and are shared between workers.
+    """
+
+    def _path(self, key: str) -> str:
+        return f"{self.spec.directory}/{key}.json"
+
+    async def get(self, key: str) -> Optional[List[dict]]:
+        path = self._path(key)
+        if not await AgentOS.file_memory.exists(path):
+            return None
+        entry = json.loads(await AgentOS.file_memory.read_file(path))
+        if _expired(entry["created_at"], self.spec.ttl_seconds):
+            await AgentOS.file_memory.delete_file(path)
+            return None
+        return entry["events"]
+
+    async def put(self, key: str, events: List[dict]):
+        data = json.dumps(dict(created_at=time.time(), events=events)).encode()
+        if len(data) > self.spec.max_entry_bytes:
+            return
+        await AgentOS.file_memory.mkdir(self.spec.directory, exist_ok=True)
+        await AgentOS.file_memory.write_file(self._path(key), data)
+
+
+class SymbolicMemoryLLMResponseCacheSpec(LLMResponseCacheSpec):
+    collection: str = Field(default="llm_response_cache", description="The symbolic memory collection to use.")
+    max_entries: int = Field(default=10_000, description="The maximum number of responses to cache.")
+
+
+class SymbolicMemoryLLMResponseCache(LLMResponseCache, Specable[SymbolicMemoryLLMResponseCacheSpec]):
+    """
+    Stores responses in the machine's symbolic memory so they survive restarts and are shared between workers.
+    """
+
+    async def get(self, key: str) -> Optional[List[dict]]:
+        entry = await AgentOS.symbolic_memory.find_one(self.spec.collection, {"key": key})
+        if entry is None:
+            return None
+        if _expired(entry["created_at"], self.spec.ttl_seconds):
+            await AgentOS.symbolic_memory.delete(self.spec.collection, {"key": key})
+            return None
+        return entry["events"]
+
+    async def put(self, key: str, events: List[dict]):
+        document = dict(key=key, created_at=time.time(), events=events)
+        await AgentOS.symbolic_memory.upsert_one(self.spec.collection, document, {"key": key})
+        excess = await AgentOS.symbolic_memory.count(self.spec.collection, {}) - self.spec.max_entries
+        if excess > 0:
+            oldest = AgentOS.symbolic_memory.find(
+                self.spec.collection, {}, projection={"key": 1}, sort={"created_at": 1}
+            )
+            to_delete = []
+            async for doc in oldest:
+                if len(to_delete) >= excess:
+                    break
+                to_delete.append(doc["key"])
+            for old_key in to_delete:
+                await AgentOS.symbolic_memory.delete(self.spec.collection, {"key": old_key})
@@ -0,0 +1,253 @@
+import asyncio
+import heapq
+import itertools
+import random
+import re
+import time
+from collections import deque
+from typing import Dict, Optional, Callable, AsyncIterator, TypeVar, Deque, Tuple, List
+
+from openai import RateLimitError, APIConnectionError, InternalServerError, APIStatusError
+from pydantic import BaseModel, Field
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.system.reference_model import Specable
+from eidolon_ai_client.util.logger import logger as eidolon_logger
+
+logger = eidolon_logger.getChild("llm_scheduler")
+
+T = TypeVar("T")
+
+_WINDOW_SECONDS = 60.0
+_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class RateLimit(BaseModel):
+    requests_per_minute: Optional[int] = Field(default=None, description="Maximum requests per minute, if limited.")
+    tokens_per_minute: Optional[int] = Field(default=None, description="Maximum tokens per minute, if limited.")
+
+
+class LLMSchedulerSpec(BaseModel):
+    default_limits: RateLimit = Field(
+        default_factory=RateLimit, description="The rate limits applied to models without a specific entry."
+    )
+    limits: Dict[str, RateLimit] = Field(default={}, description="Rate limits keyed by model name.")
+    max_retries: int = Field(default=6, description="The number of times to retry a request before failing.")
+    initial_backoff: float = Field(default=1.0, description="The initial backoff in seconds between retries.")
+    max_backoff: float = Field(default=60.0, description="The maximum backoff in seconds between retries.")
+    jitter: float = Field(default=0.25, description="The fraction of each backoff that is randomized.")
+
+
+class QueueStats(BaseModel):
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class _Bucket:
+    """
+    Tracks the sliding window of requests and tokens sent for one model / endpoint and orders waiting requests.
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.window: Deque[Tuple[float, int]] = deque()
+        self.waiters: List[Tuple[int, int]] = []
+        self.condition = asyncio.Condition()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float, tokens: int) -> float:
+        while self.window and self.window[0][0] <= now - _WINDOW_SECONDS:
+            self.window.popleft()
+        delay = self.blocked_until - now
+        rpm = self.limit.requests_per_minute
+        if rpm and len(self.window) >= rpm:
+            delay = max(delay, self.window[len(self.window) - rpm][0] + _WINDOW_SECONDS - now)
+        tpm = self.limit.tokens_per_minute
+        if tpm and self.window:
+            excess = sum(t for _, t in self.window) + tokens - tpm
+            for ts, used in self.window:
+                if excess <= 0:
+                    break
+                excess -= used
+                delay = max(delay, ts + _WINDOW_SECONDS - now)
+        return delay
+
+    def remove_waiter(self, entry):
+        if entry in self.waiters:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+
+
+class LLMScheduler(Specable[LLMSchedulerSpec]):
+    """
+    Machine level scheduler for llm requests.
+
+    Requests are queued per model / endpoint, ordered by priority (higher first), and released once the tracked
+    requests per minute and tokens per minute allow. Rate limit, connection and server errors are retried with jittered
+    exponential backoff (honoring rate limit headers) as long as no part of the response has been streamed yet. A
+    retried request keeps its place in the queue ahead of requests of the same priority made after it.
+    """
+
+    stats: Dict[str, QueueStats]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._buckets: Dict[str, _Bucket] = {}
+        self._counter = itertools.count()
+        self.stats = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def _bucket(self, key: str, model: str) -> _Bucket:
+        if key not in self._buckets:
+            self._buckets[key] = _Bucket(self.spec.limits.get(model, self.spec.default_limits))
+        return self._buckets[key]
+
+    async def _acquire(self, bucket: _Bucket, tokens: int, priority: int, sequence: int):
+        entry = (-priority, sequence)
+        heapq.heappush(bucket.waiters, entry)
+        try:
+            async with bucket.condition:
+                while True:
+                    now = time.monotonic()
+                    timeout = None
+                    if bucket.waiters[0] == entry:
+                        timeout = bucket.delay(now, tokens)
+                        if timeout <= 0:
+                            break
+                    try:
+                        await asyncio.wait_for(bucket.condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                heapq.heappop(bucket.waiters)
+                bucket.window.append((now, tokens))
+                bucket.condition.notify_all()
+        except BaseException:
+            bucket.remove_waiter(entry)
+            # the next waiter may now be at the head of the queue
+            asyncio.ensure_future(self._notify(bucket))
+            raise
+
+    async def _notify(self, bucket: _Bucket):
+        async with bucket.condition:
+            bucket.condition.notify_all()
+
+    async def _block(self, bucket: _Bucket, seconds: float):
+        async with bucket.condition:
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + seconds)
+            bucket.condition.notify_all()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(self.spec.max_backoff, self.spec.initial_backoff * 2**attempt)
+        return delay * (1 + random.uniform(-self.spec.jitter, self.spec.jitter))
+
+    async def stream(
+        self,
+        model: str,
+        request_fn: Callable[[], AsyncIterator[T]],
+        endpoint: str = "default",
+        estimated_tokens: int = 0,
+        priority: int = 0,
+    ) -> AsyncIterator[T]:
+        """
+        Schedule a streaming llm request.
+
+        Args:
+            model: The model being called. Used to look up rate limits.
+            request_fn: Callable creating the response stream. Called again on each retry.
+            endpoint: The api endpoint being called. Requests are tracked per model and endpoint.
+            estimated_tokens: The number of tokens the request is expected to consume against the quota.
+            priority: Requests with higher priority are released first.
+        """
+        key = f"{endpoint}:{model}"
+        bucket = self._bucket(key, model)
+        stats = self.stats.setdefault(key, QueueStats())
+        attempt, sequence = 0, next(self._counter)
+        while True:
+            enqueued = time.monotonic()
+            await self._acquire(bucket, estimated_tokens, priority, sequence)
+            wait = time.monotonic() - enqueued
+            stats.requests += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            if wait > 0.1:
+                logger.info(f"llm request for {key} waited {wait:.2f}s in queue", extra=dict(queue_wait=wait, key=key))
+
+            started = False
+            try:
+                async for chunk in request_fn():
+                    started = True
+                    yield chunk
+                return
+            except _RETRYABLE_ERRORS as e:
+                if started or attempt >= self.spec.max_retries:
+                    stats.failures += 1
+                    raise
+                backoff = self._backoff(attempt, e)
+                attempt += 1
+                stats.retries += 1
+                logger.warning(
+                    f"llm request for {key} failed with {e.__class__.__name__}, retrying in {backoff:.2f}s "
+                    f"(attempt {attempt}/{self.spec.max_retries})"
+                )
+                if isinstance(e, RateLimitError):
+                    await self._block(bucket, backoff)
+                else:
+                    await asyncio.sleep(backoff)
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    delays = [
+        _parse_duration(headers[h])
+        for h in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if h in headers
+    ]
+    delays = [d for d in delays if d is not None]
+    return max(delays) if delays else None
+
+
+_unmanaged_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    """
+    Get the machine's llm scheduler. Outside a running machine a default (unlimited, retrying) scheduler is used.
+    """
+    global _unmanaged_scheduler
+    if AgentOS.llm_scheduler is not ...:
+        return AgentOS.llm_scheduler
+    if not _unmanaged_scheduler:
+        _unmanaged_scheduler = LLMScheduler(spec=LLMSchedulerSpec())
+    return _unmanaged_scheduler
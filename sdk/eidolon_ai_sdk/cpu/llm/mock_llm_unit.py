@@ -0,0 +1,123 @@
+import asyncio
+import fnmatch
+import json
+import random
+import re
+from typing import List, Optional, Union, Literal, Dict, Any, AsyncIterator
+
+from pydantic import BaseModel, Field
+
+from eidolon_ai_client.events import StringOutputEvent, ObjectOutputEvent, LLMToolCallRequestEvent, ToolCall, StreamEvent
+from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.llm_message import LLMMessage, UserMessage, AssistantMessage
+from eidolon_ai_sdk.cpu.llm_unit import LLMUnit, LLMCallFunction
+from eidolon_ai_sdk.system.reference_model import Specable
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+class MockToolCall(BaseModel):
+    name: str = Field(description="The tool to call. Supports wildcards (ie, convo_*) matched against offered tools.")
+    arguments: Dict[str, Any] = {}
+
+
+class MockLLMResponse(BaseModel):
+    content: str = Field(default="This is a mock response.", description="The text streamed for string outputs.")
+    object: Optional[Any] = Field(
+        default=None, description="The object returned for structured outputs. Generated from the schema if not set."
+    )
+    tool_calls: List[MockToolCall] = []
+
+
+class MockLLMUnitSpec(BaseModel):
+    script: List[MockLLMResponse] = Field(
+        default=[MockLLMResponse()],
+        description="Responses for each llm call within one user turn. Calls past the end repeat the last response.",
+    )
+    time_to_first_token: float = Field(default=0.0, description="Seconds before the first token is streamed.")
+    tokens_per_second: Optional[float] = Field(
+        default=None, description="The rate tokens are streamed at. Tokens are streamed without delay if not set."
+    )
+    jitter: float = Field(default=0.0, description="The fraction each delay is randomly varied by.")
+    seed: Optional[int] = Field(default=0, description="Seed for the jitter. Unseeded if None.")
+
+
+class MockLLMUnit(LLMUnit, Specable[MockLLMUnitSpec]):
+    """
+    Deterministic, offline LLMUnit for tests and benchmarks.
+
+    Each call plays back the scripted response for the current step of the turn (the number of llm calls since the
+    last user message), streaming its content word by word with the configured latency profile.
+    """
+
+    def __init__(self, **kwargs):
+        LLMUnit.__init__(self, **kwargs)
+        Specable.__init__(self, **kwargs)
+        self._random = random.Random(self.spec.seed)
+
+    async def execute_llm(
+        self,
+        call_context: CallContext,
+        messages: List[LLMMessage],
+        tools: List[LLMCallFunction],
+        output_format: Union[Literal["str"], Dict[str, Any]],
+    ) -> AsyncIterator[StreamEvent]:
+        step = 0
+        for message in reversed(messages):
+            if isinstance(message, UserMessage):
+                break
+            if isinstance(message, AssistantMessage):
+                step += 1
+        response = self.spec.script[min(step, len(self.spec.script) - 1)]
+
+        await self._sleep(self.spec.time_to_first_token)
+        tool_names = [tool.name for tool in tools]
+        for i, tool_call in enumerate(response.tool_calls):
+            matches = fnmatch.filter(tool_names, tool_call.name)
+            if not matches:
+                raise ValueError(f"Scripted tool call {tool_call.name} matches none of the offered tools {tool_names}")
+            arguments = json.dumps(tool_call.arguments)
+            await self._stream_delay(len(_TOKEN.findall(arguments)))
+            yield LLMToolCallRequestEvent(
+                tool_call=ToolCall(tool_call_id=f"call_{step}_{i}", name=matches[0], arguments=tool_call.arguments)
+            )
+
+        if output_format == "str" or output_format["type"] == "string":
+            for token in _TOKEN.findall(response.content):
+                yield StringOutputEvent(content=token)
+                await self._stream_delay(1)
+        else:
+            content = response.object if response.object is not None else example_for_schema(output_format)
+            await self._stream_delay(len(_TOKEN.findall(json.dumps(content))))
+            yield ObjectOutputEvent(content=content)
+
+    async def _stream_delay(self, tokens: int):
+        if self.spec.tokens_per_second:
+            await self._sleep(tokens / self.spec.tokens_per_second)
+
+    async def _sleep(self, seconds: float):
+        if seconds > 0:
+            await asyncio.sleep(seconds * (1 + self._random.uniform(-self.spec.jitter, self.spec.jitter)))
+
+
+def example_for_schema(schema: Dict[str, Any]) -> Any:
+    """
+    Build a minimal value satisfying a (simple) json schema.
+    """
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "default" in schema:
+        return schema["default"]
+    for key in ("anyOf", "oneOf", "allOf"):
+        if schema.get(key):
+            return example_for_schema(schema[key][0])
+    schema_type = schema.get("type", "object")
+    if isinstance(schema_type, list):
+        schema_type = schema_type[0]
+    if schema_type == "object":
+        return {k: example_for_schema(v) for k, v in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [example_for_schema(schema["items"])] * schema.get("minItems", 0) if "items" in schema else []
+    return {"string": "mock", "integer": 0, "number": 0.0, "boolean": False, "null": None}.get(schema_type)
@@ -1,6 +1,10 @@
+import asyncio
 import base64
+import hashlib
 import json
 import logging
+import time
+from collections import OrderedDict
 from io import BytesIO
 from typing import List, Optional, Union, Literal, Dict, Any, AsyncIterator, cast
 
@@ -15,11 +19,19 @@ from pydantic import Field, BaseModel
 from eidolon_ai_client.events import (
     StringOutputEvent,
     ObjectOutputEvent,
+    PartialObjectOutputEvent,
     LLMToolCallRequestEvent, ToolCall,
+    BaseStreamEvent,
+    StreamEvent,
+    LLMMetricsEvent,
 )
 from eidolon_ai_client.util.logger import logger as eidolon_logger
+from eidolon_ai_client.util.request_context import RequestContext
 from eidolon_ai_sdk.agent_os import AgentOS
 from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.llm.llm_metrics import LLMCallMetrics, LLMCallTimer, get_metrics
+from eidolon_ai_sdk.cpu.llm.llm_response_cache import LLMResponseCache, request_key
+from eidolon_ai_sdk.cpu.llm.llm_scheduler import get_scheduler
 from eidolon_ai_sdk.cpu.llm_message import (
     LLMMessage,
     AssistantMessage,
@@ -28,8 +40,12 @@ from eidolon_ai_sdk.cpu.llm_message import (
     SystemMessage,
 )
 from eidolon_ai_sdk.cpu.llm_unit import LLMUnit, LLMCallFunction
-from eidolon_ai_sdk.system.reference_model import Specable, AnnotatedReference
+from eidolon_ai_sdk.system.client_registry import get_client
+from eidolon_ai_sdk.system.reference_model import Specable, AnnotatedReference, Reference
+from eidolon_ai_sdk.util.async_wrapper import make_async
+from eidolon_ai_sdk.util.partial_json import PartialJsonParser
 from eidolon_ai_sdk.util.replay import replayable
+from eidolon_ai_sdk.util.single_flight import SingleFlight
 
 logger = eidolon_logger.getChild("llm_unit")
 
@@ -58,7 +74,7 @@ def scale_dimensions(width, height, max_size=2048, min_size=768):
     return width, height
 
 
-def scale_image(image_bytes):
+def scale_image(image_bytes, max_size=2048, min_size=768):
     # Load the image from bytes
     image = Image.open(BytesIO(image_bytes))
 
@@ -66,7 +82,7 @@ def scale_image(image_bytes):
     width, height = image.size
 
     logger.info(f"Original image size: {width}x{height}")
-    new_width, new_height = scale_dimensions(width, height)
+    new_width, new_height = scale_dimensions(width, height, max_size=max_size, min_size=min_size)
     logger.info(f"New image size: {new_width}x{new_height}")
 
     # Resize and return the image
@@ -76,6 +92,51 @@ def scale_image(image_bytes):
     return output.getvalue()
 
 
+@make_async
+def _scale_and_encode(image_bytes, max_size, min_size) -> str:
+    return base64.b64encode(scale_image(image_bytes, max_size=max_size, min_size=min_size)).decode("utf-8")
+
+
+class ImageCache:
+    """
+    Content addressed cache of scaled, base64 encoded images.
+
+    Images in the conversation history are re-sent on every llm call, so we key the final payload on the hash of the
+    image contents and the scaling parameters. Misses are scaled in a worker thread so the event loop is not blocked,
+    and concurrent misses for the same image share a single conversion.
+    """
+
+    def __init__(self, max_entries: int = 256, max_size: int = 2048, min_size: int = 768):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.min_size = min_size
+        self._entries: OrderedDict[tuple, asyncio.Future] = OrderedDict()
+
+    async def encode(self, image_bytes: bytes) -> str:
+        key = (hashlib.sha256(image_bytes).hexdigest(), self.max_size, self.min_size)
+        future = self._entries.get(key)
+        if future is not None:
+            self._entries.move_to_end(key)
+        else:
+            future = asyncio.ensure_future(_scale_and_encode(image_bytes, self.max_size, self.min_size))
+            self._entries[key] = future
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self._entries.get(key) is future:
+                del self._entries[key]
+            raise
+
+    def clear(self):
+        self._entries.clear()
+
+
+image_cache = ImageCache()
+_in_flight = SingleFlight()
+
+
 async def convert_to_openai(message: LLMMessage):
     if isinstance(message, SystemMessage):
         return {"role": "system", "content": message.content}
@@ -89,10 +150,8 @@ async def convert_to_openai(message: LLMMessage):
                 else:
                     # retrieve the image from the file system
                     data = await AgentOS.file_memory.read_file(part.image_url)
-                    # scale the image such that the max size of the shortest size is at most 768px
-                    data = scale_image(data)
-                    # base64 encode the data
-                    base64_image = base64.b64encode(data).decode("utf-8")
+                    # scale the image such that the max size of the shortest size is at most 768px and base64 encode
+                    base64_image = await image_cache.encode(data)
                     content.append(
                         {
                             "type": "image_url",
@@ -134,11 +193,28 @@ class OpenAiGPTSpec(BaseModel):
     max_tokens: Optional[int] = None
     client: AnnotatedReference[AsyncOpenAI]
     client_args: dict = {}
+    priority: int = Field(
+        default=0, description="The scheduling priority of requests when queued behind rate limits. Higher is sooner."
+    )
+    stream_partial_objects: bool = Field(
+        default=False,
+        description="Stream snapshots of object responses as their fields complete, before the final object event.",
+    )
+    emit_metrics_event: bool = Field(
+        default=False, description="Emit a diagnostic event with the latency and throughput metrics of each call."
+    )
+    coalesce_requests: bool = Field(
+        default=True, description="Share one upstream call between identical requests that are in flight concurrently."
+    )
+    response_cache: Optional[Reference[LLMResponseCache]] = Field(
+        default=None, description="Cache for exact repeats of a request. Responses are not cached unless configured."
+    )
 
 
 class OpenAIGPT(LLMUnit, Specable[OpenAiGPTSpec]):
     model: str
     temperature: float
+    response_cache: Optional[LLMResponseCache]
 
     def __init__(self, **kwargs):
         LLMUnit.__init__(self, **kwargs)
@@ -146,6 +222,7 @@ class OpenAIGPT(LLMUnit, Specable[OpenAiGPTSpec]):
 
         self.model = self.spec.model
         self.temperature = self.spec.temperature
+        self.response_cache = self.spec.response_cache.instantiate() if self.spec.response_cache else None
 
     async def execute_llm(
         self,
@@ -154,17 +231,92 @@ class OpenAIGPT(LLMUnit, Specable[OpenAiGPTSpec]):
         tools: List[LLMCallFunction],
         output_format: Union[Literal["str"], Dict[str, Any]],
     ) -> AsyncIterator[AssistantMessage]:
+        started = time.perf_counter()
         can_stream_message, request = await self._build_request(messages, tools, output_format)
         request["stream"] = True
+        metrics = LLMCallMetrics(
+            model=self.model, agent=RequestContext.get("agent_name"), build_time=time.perf_counter() - started
+        )
+        timer = LLMCallTimer(metrics, started)
 
         logger.info("executing open ai llm request", extra=request)
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug("request content:\n" + yaml.dump(request))
+
+        key = request_key(request)
+        if self.response_cache:
+            cached = await self.response_cache.get(key)
+            if cached is not None:
+                logger.info("open ai llm response cache hit", extra=dict(cache_key=key))
+                for event in cached:
+                    yield BaseStreamEvent.from_dict(dict(event))
+                return
+
+        if self.spec.coalesce_requests:
+            flight_key = (self._flight_namespace(), key)
+            response = _in_flight.stream(flight_key, lambda: self._complete(key, request, can_stream_message, timer))
+        else:
+            response = self._complete(key, request, can_stream_message, timer)
+        async for event in response:
+            if isinstance(event, LLMMetricsEvent):
+                call_metrics = self._record_metrics(event, metrics, timer, started)
+                if self.spec.emit_metrics_event:
+                    yield LLMMetricsEvent(metrics=call_metrics.model_dump())
+            else:
+                # events are shared between coalesced callers, so hand each caller its own copy
+                yield event.model_copy()
+
+    @staticmethod
+    def _record_metrics(
+        event: LLMMetricsEvent, metrics: LLMCallMetrics, timer: LLMCallTimer, started: float
+    ) -> LLMCallMetrics:
+        """
+        Record the metrics of a caller. Callers coalesced onto another caller's call share its timings, with their
+        own agent, build time and total time.
+        """
+        if timer.finished:
+            call_metrics, gaps = timer.metrics, timer.gaps
+        else:
+            own = dict(agent=metrics.agent, build_time=metrics.build_time, total_time=time.perf_counter() - started)
+            # the gaps between tokens are of the shared stream, recorded once by the caller that made the call
+            call_metrics, gaps = LLMCallMetrics.model_validate(event.metrics).model_copy(update=own), []
+        get_metrics().record(call_metrics, gaps)
+        logger.info("open ai llm call metrics", extra=call_metrics.model_dump())
+        return call_metrics
+
+    async def _complete(
+        self, key: str, request: dict, can_stream_message: bool, timer: LLMCallTimer
+    ) -> AsyncIterator[StreamEvent]:
+        events = []
+        async for event in self._stream_response(request, can_stream_message, timer):
+            if not isinstance(event, LLMMetricsEvent):
+                events.append(event)
+            yield event
+        if self.response_cache:
+            await self.response_cache.put(key, [event.model_dump(mode="json") for event in events])
+
+    async def _stream_response(
+        self, request: dict, can_stream_message: bool, timer: LLMCallTimer
+    ) -> AsyncIterator[StreamEvent]:
         llm_request = replayable(fn=_openai_completion(self.spec.client), name_override="openai_completion", parser=_raw_parser)
         complete_message = ""
         tools_to_call = []
+        partial_parser = PartialJsonParser() if self.spec.stream_partial_objects and not can_stream_message else None
+
+        def dispatch():
+            timer.dispatched()
+            return llm_request(client_args=self.spec.client_args, **request)
+
+        timer.scheduled()
+        scheduled_request = get_scheduler().stream(
+            self.model,
+            dispatch,
+            endpoint=self._endpoint(),
+            estimated_tokens=_estimate_tokens(request),
+            priority=self.spec.priority,
+        )
         try:
-            async for m_chunk in llm_request(client_args=self.spec.client_args, **request):
+            async for m_chunk in scheduled_request:
                 chunk = cast(ChatCompletionChunk, m_chunk)
                 if not chunk.choices:
                     logger.info("open ai llm chunk has no choices, skipping")
@@ -176,6 +328,9 @@ class OpenAIGPT(LLMUnit, Specable[OpenAiGPTSpec]):
                     extra=dict(content=message.content, tool_calls=message.tool_calls),
                 )
 
+                if message.content or message.tool_calls:
+                    timer.token()
+
                 for tool_call in message.tool_calls or []:
                     index = tool_call.index
                     if index == len(tools_to_call):
@@ -194,28 +349,63 @@ class OpenAIGPT(LLMUnit, Specable[OpenAiGPTSpec]):
                         yield StringOutputEvent(content=message.content)
                     else:
                         complete_message += message.content
+                        if partial_parser and self._feed_partial(partial_parser, message.content):
+                            yield PartialObjectOutputEvent(content=partial_parser.snapshot())
 
             logger.info(f"open ai llm tool calls: {json.dumps(tools_to_call)}", extra=dict(tool_calls=tools_to_call))
-            if len(tools_to_call) > 0:
-                for tool in tools_to_call:
-                    tool_call = _convert_tool_call(tool)
-                    yield LLMToolCallRequestEvent(tool_call=tool_call)
+            parse_started = time.perf_counter()
+            events = [LLMToolCallRequestEvent(tool_call=_convert_tool_call(tool)) for tool in tools_to_call]
+            parse_error = None
             if not can_stream_message:
                 logger.debug(f"open ai llm object response: {complete_message}", extra=dict(content=complete_message))
                 if not self.spec.force_json:
                     # message format looks like json```{...}```, parse content and pull out the json
                     complete_message = complete_message[complete_message.find("{") : complete_message.rfind("}") + 1]
 
-                content = json.loads(complete_message) if complete_message else {}
-                yield ObjectOutputEvent(content=content)
-        except APIConnectionError | InternalServerError as e:
+                try:
+                    content = json.loads(complete_message) if complete_message else {}
+                    events.append(ObjectOutputEvent(content=content))
+                except json.JSONDecodeError as e:
+                    parse_error = e
+            metrics = timer.finish(parse_time=time.perf_counter() - parse_started)
+
+            # tool calls are handed out even when the content fails to parse
+            for event in events:
+                yield event
+            if parse_error:
+                raise parse_error
+            # recorded (and emitted) by each caller, see _record_metrics
+            yield LLMMetricsEvent(metrics=metrics.model_dump())
+        except (APIConnectionError, InternalServerError) as e:
             raise HTTPException(502, f"OpenAI Error: {e.message}") from e
         except RateLimitError as e:
             raise HTTPException(429, "OpenAI Rate Limit Exceeded") from e
 
+    @staticmethod
+    def _feed_partial(parser: PartialJsonParser, content: str) -> bool:
+        try:
+            return parser.feed(content) and not parser.complete
+        except json.JSONDecodeError:
+            # stop streaming partials, the complete message is still parsed (and reported) once it has arrived
+            logger.debug("unable to incrementally parse llm object response", exc_info=True)
+            parser.complete = True
+            return False
+
+    def _flight_namespace(self) -> str:
+        """
+        Requests are only coalesced between units with the same spec, so callers never share a call made with another
+        unit's client credentials, or receive events their unit does not emit.
+        """
+        spec = self.spec.model_dump(mode="json", exclude={"coalesce_requests"})
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _endpoint(self) -> str:
+        args = self.spec.client_args
+        return args.get("base_url") or args.get("azure_endpoint") or self.spec.client.implementation
+
     async def _build_request(self, inMessages, inTools, output_format):
         tools = await self._build_tools(inTools)
-        messages = [await convert_to_openai(message) for message in inMessages]
+        messages = list(await asyncio.gather(*(convert_to_openai(message) for message in inMessages)))
         request = {
             "messages": messages,
             "model": self.model,
@@ -263,6 +453,20 @@ class OpenAIGPT(LLMUnit, Specable[OpenAiGPTSpec]):
         return tools
 
 
+def _estimate_tokens(request: dict) -> int:
+    # rough estimate (~4 characters per token) of the quota a request consumes, max_tokens counts against the quota
+    chars = len(json.dumps(request.get("tools", [])))
+    images = 0
+    for message in request["messages"]:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(part.get("text", "")) for part in content)
+            images += sum(1 for part in content if part["type"] == "image_url")
+    return chars // 4 + images * 765 + (request.get("max_tokens") or 0)
+
+
 def _convert_tool_call(tool: Dict[str, any]) -> ToolCall:
     name = tool["name"]
     try:
@@ -274,7 +478,8 @@ def _convert_tool_call(tool: Dict[str, any]) -> ToolCall:
 
 def _openai_completion(client_ref):
     async def fn(client_args: dict = None, **kwargs):
-        client: AsyncOpenAI = client_ref.instantiate(**(client_args or {}))
+        # requests are retried by the llm scheduler
+        client: AsyncOpenAI = get_client(client_ref, client_args, scheduled=True)
         async for e in await client.chat.completions.create(**kwargs):
             yield e
     return fn
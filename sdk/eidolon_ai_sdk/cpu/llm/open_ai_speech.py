@@ -3,7 +3,8 @@ from typing import Optional, Literal
 from openai import AsyncOpenAI
 from pydantic import Field, BaseModel
 
-from eidolon_ai_sdk.system.reference_model import Specable
+from eidolon_ai_sdk.system.client_registry import get_client
+from eidolon_ai_sdk.system.reference_model import Specable, AnnotatedReference
 
 
 class OpenAiSpeechSpec(BaseModel):
@@ -20,16 +21,21 @@ class OpenAiSpeechSpec(BaseModel):
         default=0.3,
         description="The sampling temperature, between 0 and 1. Higher values like 0.8 will make the output more random, while lower values like 0.2 will make it more focused and deterministic. If set to 0, the model will use log probability to automatically increase the temperature until certain thresholds are hit.",
     )
+    client: AnnotatedReference[AsyncOpenAI]
+    client_args: dict = {}
 
 
 class OpenAiSpeech(Specable[OpenAiSpeechSpec]):
     model: str
     temperature: float
-    llm: AsyncOpenAI = None
 
     def __init__(self, spec: OpenAiSpeechSpec, **kwargs):
         super().__init__(spec, **kwargs)
 
+    @property
+    def llm(self) -> AsyncOpenAI:
+        return get_client(self.spec.client, self.spec.client_args)
+
     async def text_to_speech(self, text: str) -> bytes:
         """
         Converts text to speech.
@@ -40,9 +46,6 @@ class OpenAiSpeech(Specable[OpenAiSpeechSpec]):
         Returns:
             bytes: The audio data.
         """
-        if not self.llm:
-            self.llm = AsyncOpenAI()
-
         response = await self.llm.audio.speech.create(
             model=self.spec.text_to_speech_model,
             voice=self.spec.text_to_speech_voice,
@@ -62,9 +65,6 @@ class OpenAiSpeech(Specable[OpenAiSpeechSpec]):
         Returns:
             str: The text.
         """
-        if not self.llm:
-            self.llm = AsyncOpenAI()
-
         request = {
             "file": audio,
             "model": self.spec.speech_to_text_model,
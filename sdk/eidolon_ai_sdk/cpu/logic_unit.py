@@ -3,9 +3,11 @@ from __future__ import annotations
 import logging
 import typing
 from abc import ABC
+from collections import OrderedDict
 from dataclasses import dataclass
+from functools import cached_property
 from pydantic import BaseModel, TypeAdapter
-from typing import Dict, List, AsyncIterator, Coroutine
+from typing import Dict, List, AsyncIterator, Coroutine, Hashable, Optional
 
 from eidolon_ai_sdk.cpu.call_context import CallContext
 from eidolon_ai_sdk.cpu.llm_unit import LLMCallFunction
@@ -15,19 +17,40 @@ from eidolon_ai_sdk.system.fn_handler import register_handler, FnHandler, get_ha
 from eidolon_ai_client.util.logger import logger
 
 
+STATIC_TOOLS = "static"
+
+
+@dataclass
+class ToolDefinition:
+    """
+    The llm facing definition of one of a logic unit's tools, computed once per tools version.
+    """
+
+    handler: FnHandler
+    description: str
+    input_model: typing.Type[BaseModel]
+    parameters: dict
+    output_model: typing.Any
+
+    @cached_property
+    def output_adapter(self) -> TypeAdapter:
+        return TypeAdapter(self.output_model)
+
+
 @dataclass
 class LLMToolWrapper:
     logic_unit: LogicUnit
     llm_message: LLMCallFunction
     eidolon_handler: FnHandler
     input_model: typing.Type[BaseModel]
+    definition: Optional[ToolDefinition] = None
 
     async def execute(self, tool_call: ToolCall) -> AsyncIterator[BaseStreamEvent]:
         logger.info("calling tool " + self.eidolon_handler.name)
         logger.debug("args: " + str(tool_call.arguments) + " | fn: " + str(self.eidolon_handler.fn))
         try:
             # if this is a sync tool call just call execute, if it is not we need to store the state of the conversation and call in memory
-            input_model = self.eidolon_handler.input_model_fn(self.logic_unit, self.eidolon_handler)
+            input_model = self.input_model
             result = self.eidolon_handler.fn(self.logic_unit, **dict(input_model.model_validate(tool_call.arguments)))
             if isinstance(result, Coroutine):
                 result = await result
@@ -36,8 +59,10 @@ class LLMToolWrapper:
                 async for event in result:
                     yield event
             else:
-                ret_type = self.eidolon_handler.output_model_fn(self.logic_unit, self.eidolon_handler)
-                model = TypeAdapter(ret_type)
+                if self.definition:
+                    model = self.definition.output_adapter
+                else:
+                    model = TypeAdapter(self.eidolon_handler.output_model_fn(self.logic_unit, self.eidolon_handler))
                 result = model.dump_python(result)
                 if isinstance(result, str):
                     yield StringOutputEvent(content=result)
@@ -54,22 +79,23 @@ class LLMToolWrapper:
     ) -> Dict[str, LLMToolWrapper]:
         acc = {}
         for logic_unit in logic_units:
-            for handler in await logic_unit.build_tools(call_context):
+            for definition in await logic_unit.tool_definitions(call_context):
+                handler = definition.handler
                 new_name = logic_unit.__class__.__name__ + "_" + handler.name
                 i = 0
                 while new_name in acc:
                     new_name = logic_unit.__class__.__name__ + "_" + handler.name + "_" + str(i)
                     i += 1
-                input_model = handler.input_model_fn(logic_unit, handler)
                 acc[new_name] = LLMToolWrapper(
                     logic_unit=logic_unit,
                     llm_message=LLMCallFunction(
                         name=new_name,
-                        description=handler.description(logic_unit, handler),
-                        parameters=input_model.model_json_schema(),
+                        description=definition.description,
+                        parameters=definition.parameters,
                     ),
                     eidolon_handler=handler,
-                    input_model=input_model,
+                    input_model=definition.input_model,
+                    definition=definition,
                 )
         return acc
 
@@ -84,6 +110,10 @@ def llm_function(
 
 
 class LogicUnit(ProcessingUnit, ABC):
+    # tool definitions by tools version, most recently used last
+    _tool_definitions: Optional[OrderedDict[Hashable, List[ToolDefinition]]] = None
+    max_tool_versions: int = 128
+
     async def build_tools(self, call_context: CallContext) -> List[FnHandler]:
         handlers = get_handlers(self)
         for handler in handlers:
@@ -91,4 +121,39 @@ class LogicUnit(ProcessingUnit, ABC):
             handler.extra["sub_title"] = handler.fn.__name__
             handler.extra["agent_call"] = False
 
-            return handlers
+        return handlers
+
+    async def tools_version(self, call_context: CallContext) -> Optional[Hashable]:
+        """
+        Identifies the tools build_tools returns for a call context so their definitions are only rebuilt when it
+        changes. Returns STATIC_TOOLS when the tools are the same for every call, or None to rebuild on every llm call.
+
+        Handlers registered with llm_function are static. Units overriding build_tools are assumed to depend on the
+        call context unless they override this as well.
+        """
+        return STATIC_TOOLS if type(self).build_tools is LogicUnit.build_tools else None
+
+    async def tool_definitions(self, call_context: CallContext) -> List[ToolDefinition]:
+        version = await self.tools_version(call_context)
+        if self._tool_definitions is None:
+            self._tool_definitions = OrderedDict()
+        if version is not None and version in self._tool_definitions:
+            self._tool_definitions.move_to_end(version)
+            return self._tool_definitions[version]
+        definitions = []
+        for handler in await self.build_tools(call_context):
+            input_model = handler.input_model_fn(self, handler)
+            definitions.append(
+                ToolDefinition(
+                    handler=handler,
+                    description=handler.description(self, handler),
+                    input_model=input_model,
+                    parameters=input_model.model_json_schema(),
+                    output_model=handler.output_model_fn(self, handler),
+                )
+            )
+        if version is not None:
+            self._tool_definitions[version] = definitions
+            while len(self._tool_definitions) > self.max_tool_versions:
+                self._tool_definitions.popitem(last=False)
+        return definitions
@@ -18,7 +18,8 @@ from eidolon_ai_sdk.cpu.call_context import CallContext
 from eidolon_ai_sdk.cpu.llm_message import ToolResponseMessage, LLMMessage
 from eidolon_ai_sdk.cpu.logic_unit import LogicUnit, LLMToolWrapper
 from eidolon_ai_sdk.cpu.processing_unit import ProcessingUnitLocator, PU_T
-from eidolon_ai_sdk.system.reference_model import Specable, Reference
+from eidolon_ai_sdk.system.client_registry import get_client
+from eidolon_ai_sdk.system.reference_model import Specable, Reference, AnnotatedReference
 from eidolon_ai_client.util.logger import logger
 
 
@@ -30,10 +31,11 @@ class OpenAIAssistantsCPUSpec(AgentCPUSpec):
     llm_poll_interval_ms: int = 500
     enable_retrieval: bool = True
     enable_code_interpreter: bool = True
+    client: AnnotatedReference[AsyncOpenAI]
+    client_args: dict = {}
 
 
 class OpenAIAssistantsCPU(AgentCPU, Specable[OpenAIAssistantsCPUSpec], ProcessingUnitLocator):
-    llm: AsyncOpenAI = None
     logic_units: List[LogicUnit] = None
 
     def __init__(self, spec: OpenAIAssistantsCPUSpec = None):
@@ -52,10 +54,8 @@ class OpenAIAssistantsCPU(AgentCPU, Specable[OpenAIAssistantsCPUSpec], Processin
                 return unit
         raise ValueError(f"Could not locate {unit_type}")
 
-    def _getLLM(self):
-        if not self.llm:
-            self.llm = AsyncOpenAI()
-        return self.llm
+    def _getLLM(self) -> AsyncOpenAI:
+        return get_client(self.spec.client, self.spec.client_args)
 
     async def processFile(self, prompt: CPUMessageTypes) -> str:
         # rip out the image messages, store them in the file system, and replace them file Ids
@@ -70,8 +70,9 @@ class OpenAIAssistantsCPU(AgentCPU, Specable[OpenAIAssistantsCPUSpec], Processin
     @classmethod
     async def delete_process(cls, process_id: str):
         existing_conversations = AgentOS.symbolic_memory.find("open_ai_conversations", {"process_id": process_id})
+        llm: AsyncOpenAI = get_client(Reference[AsyncOpenAI]())
         async for conversation in existing_conversations:
-            await AsyncOpenAI().beta.assistants.delete(conversation["assistant_id"])
+            await llm.beta.assistants.delete(conversation["assistant_id"])
             logger.info("deleted assistant " + conversation["assistant_id"])
         await AgentOS.symbolic_memory.delete_many("open_ai_conversations", {"process_id": process_id})
         await AgentOS.symbolic_memory.delete_many("open_ai_conversation_data", {"process_id": process_id})
@@ -0,0 +1,96 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import jsonref
+
+from eidolon_ai_client.client import Agent
+from eidolon_ai_client.util.aiohttp import get_content_if_modified
+from eidolon_ai_sdk.util.single_flight import SingleFlight
+
+
+@dataclass
+class _Document:
+    content: Any
+    etag: Optional[str]
+    expires_at: float
+
+
+class RemoteAgentCache:
+    """
+    Caches the openapi documents and program lists of remote machines.
+
+    Documents are reused for ttl_seconds and then revalidated with their ETag, so an unchanged document is neither
+    downloaded nor reprocessed. Endpoint schemas are dereferenced lazily, one path at a time, rather than expanding the
+    whole machine schema. Concurrent fetches of the same document share one request.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._documents: Dict[str, _Document] = {}
+        self._endpoints: Dict[Tuple[str, str, str], Tuple[Any, dict]] = {}
+        self._in_flight = SingleFlight()
+
+    async def programs(self, agent: Agent) -> List[str]:
+        return (await self._get(urljoin(agent.machine, f"agents/{agent.agent}/programs"))).content
+
+    async def endpoint_schema(self, machine: str, path: str, method: str = "post") -> dict:
+        """
+        The dereferenced schema of one endpoint. Raises a KeyError if the machine does not expose it.
+        """
+        openapi = (await self._get(urljoin(machine, "openapi.json"))).content
+        key = (machine, path, method)
+        cached = self._endpoints.get(key)
+        # endpoints are rebuilt only when a revalidation downloaded a new document
+        if not cached or cached[0] is not openapi:
+            endpoint = openapi["paths"][path][method]
+            cached = self._endpoints[key] = (openapi, jsonref.replace_refs(_scoped_document(openapi, endpoint))["node"])
+        return cached[1]
+
+    def clear(self):
+        self._documents = {}
+        self._endpoints = {}
+
+    async def _get(self, url: str) -> _Document:
+        document = self._documents.get(url)
+        if document and time.monotonic() < document.expires_at:
+            return document
+        return await self._in_flight.do(url, lambda: self._fetch(url))
+
+    async def _fetch(self, url: str) -> _Document:
+        document = self._documents.get(url)
+        modified, content, etag = await get_content_if_modified(url, document.etag if document else None)
+        expires_at = time.monotonic() + self.ttl_seconds
+        if modified:
+            document = _Document(content=content, etag=etag, expires_at=expires_at)
+            self._documents[url] = document
+        else:
+            document.expires_at = expires_at
+        return document
+
+
+def _scoped_document(document: dict, node: Any) -> dict:
+    """
+    A document holding node under "node" along with only the parts of document that node (transitively) references.
+    """
+    scoped = {"node": node}
+    seen = set()
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if isinstance(current, dict):
+            ref = current.get("$ref")
+            if isinstance(ref, str) and ref.startswith("#/") and ref not in seen:
+                seen.add(ref)
+                parts = [p.replace("~1", "/").replace("~0", "~") for p in ref[2:].split("/")]
+                source, dest = document, scoped
+                for part in parts[:-1]:
+                    source = source[part]
+                    dest = dest.setdefault(part, {})
+                dest[parts[-1]] = source[parts[-1]]
+                pending.append(source[parts[-1]])
+            pending.extend(current.values())
+        elif isinstance(current, list):
+            pending.extend(current)
+    return scoped
@@ -5,20 +5,29 @@ try:
     sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
 except ImportError:
     pass
+import asyncio
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import chromadb
 from chromadb import Include, QueryResult
 from chromadb.api.models.Collection import Collection
 from pathlib import Path
 from pydantic import Field, field_validator
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, TypeVar, Set, Iterable, Tuple
 from urllib.parse import urlparse, parse_qs
 
+from eidolon_ai_sdk.agent_os import AgentOS
 from eidolon_ai_sdk.memory.document import EmbeddedDocument
 from eidolon_ai_sdk.memory.file_system_vector_store import FileSystemVectorStore, FileSystemVectorStoreSpec
+from eidolon_ai_sdk.memory.metadata_index import with_prefix
 from eidolon_ai_sdk.memory.vector_store import QueryItem
 from eidolon_ai_sdk.system.reference_model import Specable
 from eidolon_ai_sdk.util.str_utils import replace_env_var_in_string
 
+T = TypeVar("T")
+
 
 class ChromaVectorStoreConfig(FileSystemVectorStoreSpec):
     url: str = Field(
@@ -28,6 +37,21 @@ class ChromaVectorStoreConfig(FileSystemVectorStoreSpec):
         + "Use file://$PATH to use a local file database.",
         validate_default=True,
     )
+    max_workers: int = Field(default=4, description="The number of threads calls to chroma run on.")
+    max_batch_size: Optional[int] = Field(
+        default=None,
+        description="The number of embeddings upserted per call to chroma. Defaults to the largest batch the chroma "
+        "client accepts.",
+    )
+    metadata_values_collection: str = Field(
+        default="chroma_metadata_values",
+        description="The symbolic memory collection the values of indexed metadata keys are recorded in.",
+    )
+    metadata_values_ttl: float = Field(
+        default=60.0,
+        description="How long the recorded values of indexed metadata keys are cached before they are read again, so "
+        "$prefix conditions match values other workers recorded within this many seconds.",
+    )
 
     # noinspection PyMethodParameters,HttpUrlsUsage
     @field_validator("url")
@@ -54,7 +78,40 @@ class ChromaVectorStoreConfig(FileSystemVectorStoreSpec):
             raise ValueError("url must start with file://, http://, or https://")
 
 
+def _no_stop_iteration(fn: Callable[..., T], *args, **kwargs) -> T:
+    # a StopIteration can not be set on an asyncio future, the awaiting task would never be woken
+    try:
+        return fn(*args, **kwargs)
+    except StopIteration as e:
+        raise RuntimeError("chroma call raised StopIteration") from e
+
+
+def _has_prefix(where: Dict[str, Any]) -> bool:
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if any(_has_prefix(c) for c in condition):
+                return True
+        elif isinstance(condition, dict) and "$prefix" in condition:
+            return True
+    return False
+
+
 class ChromaVectorStore(FileSystemVectorStore, Specable[ChromaVectorStoreConfig]):
+    """
+    A vector store backed by chroma.
+
+    The chromadb client is synchronous, so every call to it runs on a dedicated thread pool rather than the event
+    loop. Collection handles are cached until a call using them fails, and large upserts are split into batches
+    upserted concurrently.
+
+    Chroma filters queries with its own metadata index, but has no prefix operator. The values of the indexed metadata
+    keys are recorded in symbolic memory as documents are added, so every worker sharing the database sees the values
+    of documents any of them added, and $prefix conditions are rewritten as $in conditions over the values starting
+    with the prefix. The sorted values are cached per collection, including those this worker records, and read from
+    symbolic memory again once metadata_values_ttl passes. Collections written before values were recorded are read
+    once to record theirs.
+    """
+
     spec: ChromaVectorStoreConfig
     client: chromadb.Client
 
@@ -62,9 +119,18 @@ class ChromaVectorStore(FileSystemVectorStore, Specable[ChromaVectorStoreConfig]
         super().__init__(spec)
         self.spec = spec
         self.client = None
+        self._collections: Dict[str, Collection] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._collections_lock = asyncio.Lock()
+        # collection -> the (key, value) pairs this worker recorded, so they are not written again
+        self._recorded: Dict[str, Set[Tuple[str, str]]] = {}
+        self._backfilled: Set[str] = set()
+        # collection -> when its values were read, and the sorted values of each indexed key
+        self._values: Dict[str, Tuple[float, Dict[str, List[str]]]] = {}
+        self._batch_size: Optional[int] = None
 
     async def start(self):
-        self.connect()
+        await self._run(self.connect)
 
     def connect(self):
         url = urlparse(self.spec.url)
@@ -80,11 +146,23 @@ class ChromaVectorStore(FileSystemVectorStore, Specable[ChromaVectorStoreConfig]
             else:
                 headers = None
             self.client = chromadb.HttpClient(host=host, port=port, ssl=ssl, headers=headers)
+        self._collections = {}
+        self._batch_size = None
 
     async def stop(self):
-        pass
+        await super().stop()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
-    def _get_collection(self, name: str) -> Collection:
+    async def _run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(self.spec.max_workers, thread_name_prefix="chroma")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(_no_stop_iteration, fn, *args, **kwargs)
+        )
+
+    def _get_or_create_collection(self, name: str) -> Collection:
         if not self.client:
             self.connect()
 
@@ -93,20 +171,68 @@ class ChromaVectorStore(FileSystemVectorStore, Specable[ChromaVectorStoreConfig]
         except BaseException as e:
             raise RuntimeError(f"Failed to get collection {name}") from e
 
+    async def _get_collection(self, name: str) -> Collection:
+        collection = self._collections.get(name)
+        if collection is None:
+            # chroma does not handle concurrent creation of a collection, its segments may not exist yet when used
+            async with self._collections_lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = await self._run(self._get_or_create_collection, name)
+                    self._collections[name] = collection
+        return collection
+
+    async def _call(self, name: str, fn: Callable[[Collection], T]) -> T:
+        collection = await self._get_collection(name)
+        try:
+            return await self._run(fn, collection)
+        except Exception:
+            # the collection may have been deleted or recreated, so look it up again on the next call
+            if self._collections.get(name) is collection:
+                del self._collections[name]
+            raise
+
+    async def _max_batch_size(self) -> int:
+        if self.spec.max_batch_size:
+            return self.spec.max_batch_size
+        if self._batch_size is None:
+            # the http client asks the server, so it is not called on the event loop
+            self._batch_size = await self._run(lambda: self.client.max_batch_size)
+        return self._batch_size
+
     async def add_embedding(self, collection: str, docs: List[EmbeddedDocument], **add_kwargs: Any):
-        collection = self._get_collection(name=collection)
-        doc_ids = [doc.id for doc in docs]
-        embeddings = [doc.embedding for doc in docs]
-        metadata = [doc.metadata for doc in docs]
-        collection.upsert(embeddings=embeddings, ids=doc_ids, metadatas=metadata, **add_kwargs)
+        if not docs:
+            return
+        # resolve the collection once, rather than in every batch
+        await self._get_collection(collection)
+        await self._record_values(collection, [doc.metadata for doc in docs])
+        batch_size = await self._max_batch_size()
+
+        def upsert(batch: List[EmbeddedDocument]):
+            def fn(chroma_collection: Collection):
+                chroma_collection.upsert(
+                    embeddings=[doc.embedding for doc in batch],
+                    ids=[doc.id for doc in batch],
+                    metadatas=[doc.metadata for doc in batch],
+                    **add_kwargs,
+                )
+
+            return self._call(collection, fn)
+
+        batches = [docs[i : i + batch_size] for i in range(0, len(docs), batch_size)]
+        if len(batches) == 1 or len({doc.id for doc in docs}) == len(docs):
+            await asyncio.gather(*(upsert(batch) for batch in batches))
+        else:
+            # batches sharing an id are upserted in order, so the last document with an id wins
+            for batch in batches:
+                await upsert(batch)
 
     async def delete_embedding(self, collection: str, doc_ids: List[str], **delete_kwargs: Any):
-        collection = self._get_collection(name=collection)
-        collection.delete(ids=doc_ids, **delete_kwargs)
+        await self._call(collection, lambda c: c.delete(ids=doc_ids, **delete_kwargs))
 
     async def get_metadata(self, collection: str, doc_ids: List[str]):
-        collection = self._get_collection(name=collection)
-        return collection.get(ids=doc_ids, include=["metadatas"])["metadatas"]
+        result = await self._call(collection, lambda c: c.get(ids=doc_ids, include=["metadatas"]))
+        return result["metadatas"]
 
     async def query_embedding(
         self,
@@ -116,28 +242,131 @@ class ChromaVectorStore(FileSystemVectorStore, Specable[ChromaVectorStoreConfig]
         metadata_where: Optional[Dict[str, str]] = None,
         include_embeddings=False,
     ) -> List[QueryItem]:
-        collection = self._get_collection(name=collection)
+        results = await self.query_embedding_batch(collection, [query], num_results, metadata_where, include_embeddings)
+        return results[0]
+
+    async def query_embedding_batch(
+        self,
+        collection: str,
+        queries: List[List[float]],
+        num_results: int,
+        metadata_where: Optional[Dict[str, str]] = None,
+        include_embeddings: bool = False,
+    ) -> List[List[QueryItem]]:
+        if not queries:
+            return []
         thingsToInclude: Include = ["metadatas", "distances"]
         if include_embeddings:
             thingsToInclude.append("embeddings")
 
-        results: QueryResult = collection.query(
-            query_embeddings=[query],
-            n_results=num_results,
-            where=metadata_where,
-            include=thingsToInclude,
+        where = await self._where(collection, metadata_where) if metadata_where else None
+        if metadata_where and where is None:
+            return [[] for _ in queries]
+        results: QueryResult = await self._call(
+            collection,
+            lambda c: c.query(
+                query_embeddings=queries,
+                n_results=num_results,
+                where=where,
+                include=thingsToInclude,
+            ),
         )
 
         ret = []
-        for i, doc_id in enumerate(results["ids"][0]):
-            embedding = results["embeddings"][0][i] if include_embeddings else None
-            ret.append(
-                QueryItem(
-                    id=doc_id,
-                    score=results["distances"][0][i],
-                    embedding=embedding,
-                    metadata=results["metadatas"][0][i],
+        for q, ids in enumerate(results["ids"]):
+            items = []
+            for i, doc_id in enumerate(ids):
+                embedding = results["embeddings"][q][i] if include_embeddings else None
+                items.append(
+                    QueryItem(
+                        id=doc_id,
+                        score=results["distances"][q][i],
+                        embedding=embedding,
+                        metadata=results["metadatas"][q][i],
+                    )
                 )
-            )
+            ret.append(items)
 
         return ret
+
+    async def _record_values(self, collection: str, metadata: Iterable[Optional[dict]]):
+        recorded = self._recorded.setdefault(collection, set())
+        values = set()
+        for m in metadata:
+            for key in self.spec.indexed_metadata:
+                value = (m or {}).get(key)
+                if isinstance(value, str) and (key, value) not in recorded:
+                    values.add((key, value))
+        if not values:
+            return
+
+        async def record(key: str, value: str):
+            _id = f"{collection}\0{key}\0{value}"
+            document = dict(_id=_id, collection=collection, key=key, value=value)
+            await AgentOS.symbolic_memory.upsert_one(self.spec.metadata_values_collection, document, {"_id": _id})
+
+        await asyncio.gather(*(record(key, value) for key, value in values))
+        recorded.update(values)
+        cached = self._values.get(collection)
+        for key, value in values if cached else ():
+            key_values = cached[1][key]
+            i = bisect_left(key_values, value)
+            if i == len(key_values) or key_values[i] != value:
+                key_values.insert(i, value)
+
+    async def _prefix_values(self, collection: str) -> Dict[str, List[str]]:
+        """The sorted values of each indexed key any worker added documents with, including those since deleted."""
+        if collection not in self._backfilled:
+            marker = f"{collection}\0"
+            values_collection = self.spec.metadata_values_collection
+            if not await AgentOS.symbolic_memory.find_one(values_collection, {"_id": marker}):
+                result = await self._call(collection, lambda c: c.get(include=["metadatas"]))
+                await self._record_values(collection, result["metadatas"])
+                await AgentOS.symbolic_memory.upsert_one(values_collection, dict(_id=marker), {"_id": marker})
+            self._backfilled.add(collection)
+        cached = self._values.get(collection)
+        if cached and time.monotonic() - cached[0] < self.spec.metadata_values_ttl:
+            return cached[1]
+        read = time.monotonic()
+        values = {key: [] for key in self.spec.indexed_metadata}
+        query = {"collection": collection}
+        async for doc in AgentOS.symbolic_memory.find(self.spec.metadata_values_collection, query):
+            if doc["key"] in values:
+                values[doc["key"]].append(doc["value"])
+        values = {key: sorted(key_values) for key, key_values in values.items()}
+        self._values[collection] = (read, values)
+        return values
+
+    async def _where(self, collection: str, where: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Where as chroma accepts it, or None when it matches no documents."""
+        values = await self._prefix_values(collection) if _has_prefix(where) else {}
+        return _translate(where, values)
+
+
+def _translate(where: Dict[str, Any], prefix_values: Dict[str, List[str]]) -> Optional[Dict[str, Any]]:
+    # chroma accepts one condition per clause, so conditions are combined with $and
+    clauses = []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            translated = [_translate(c, prefix_values) for c in condition]
+            if key == "$and" and None in translated:
+                return None
+            translated = [c for c in translated if c is not None]
+            if not translated:
+                return None
+            clauses.append(translated[0] if len(translated) == 1 else {key: translated})
+        elif isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op == "$prefix":
+                    values = prefix_values.get(key)
+                    if values is None:
+                        raise ValueError(f"$prefix is only supported on indexed metadata, not {key}")
+                    values = with_prefix(values, operand)
+                    if not values:
+                        return None
+                    clauses.append({key: {"$in": values}})
+                else:
+                    clauses.append({key: {op: operand}})
+        else:
+            clauses.append({key: condition})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import io
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from eidolon_ai_client.util.logger import logger
+from eidolon_ai_sdk.agent_os import AgentOS
+
+# segments with fewer embeddings than this are merged once there are _MERGE_SEGMENTS of them
+_SMALL_SEGMENT = 1024
+_MERGE_SEGMENTS = 16
+
+
+class EmbeddingCache:
+    """
+    Caches embeddings by the model that created them and a hash of the embedded text.
+
+    Recently used embeddings are kept in memory as float32 arrays. When a directory is set and the machine has file
+    memory, embeddings are also stored there, so unchanged text is not embedded again after a restart. Each batch of
+    embeddings put together is written as one segment of two files:
+
+    - {segment}.vectors: the float32 embeddings of the batch concatenated, with the offset of each (npz).
+    - {segment}.keys: the keys of the batch, a line each, written last so a segment without keys is ignored.
+
+    Every write rewrites the CHANGED file of the directory. The keys of every segment are held in memory, and the
+    directory is listed again for new segments (such as those other workers wrote) when a lookup misses and CHANGED
+    has changed since it was last listed. The vectors of a segment are read when one of its embeddings is looked up.
+    Small segments, such as those of single embeddings, are merged into one once there are enough of them.
+    """
+
+    def __init__(self, namespace: str, max_size: int, directory: Optional[str] = None):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.directory = directory
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._created_in = None
+        # the segment each persisted key is in, and the number of keys of each segment that has been read
+        self._segments: Dict[str, str] = {}
+        self._sizes: Dict[str, int] = {}
+        self._read_in = None
+        # the CHANGED file when the directory was last listed, ... before it is
+        self._listed = ...
+        self._merging = False
+
+    def key(self, text: str, kwargs: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(self.namespace.encode())
+        digest.update(b"\0" + text.encode())
+        if kwargs:
+            digest.update(b"\0" + repr(sorted(kwargs.items())).encode())
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[List[float]]]:
+        found = [self._entries.get(key) for key in keys]
+        for key, embedding in zip(keys, found):
+            if embedding is not None:
+                self._entries.move_to_end(key)
+        missing = [i for i, embedding in enumerate(found) if embedding is None]
+        file_memory = self._file_memory()
+        if missing and file_memory:
+            await self._read_keys(file_memory)
+            by_segment = defaultdict(list)
+            for i in missing:
+                segment = self._segments.get(keys[i])
+                if segment is not None:
+                    by_segment[segment].append(i)
+            segments = list(by_segment)
+            for segment, embeddings in zip(segments, await asyncio.gather(*map(self._read_vectors, segments))):
+                for i in by_segment[segment]:
+                    embedding = embeddings.get(keys[i]) if embeddings else None
+                    if embedding is not None:
+                        found[i] = embedding
+                        self._remember(keys[i], embedding)
+        return [None if embedding is None else embedding.tolist() for embedding in found]
+
+    async def put(self, key: str, embedding: List[float]):
+        await self.put_many({key: embedding})
+
+    async def put_many(self, embeddings: Dict[str, List[float]]):
+        embeddings = {key: np.asarray(embedding, dtype=np.float32) for key, embedding in embeddings.items()}
+        for key, embedding in embeddings.items():
+            self._remember(key, embedding)
+        file_memory = self._file_memory()
+        if not file_memory or not embeddings:
+            return
+        if self._created_in is not file_memory:
+            await file_memory.mkdir(self._namespace_directory(), exist_ok=True)
+            self._created_in = file_memory
+        self._add_segment(await self._write_segment(file_memory, embeddings), embeddings)
+        await self._mark_changed(file_memory)
+        small = [segment for segment, size in self._sizes.items() if size < _SMALL_SEGMENT]
+        if len(small) >= _MERGE_SEGMENTS and not self._merging:
+            self._merging = True
+            try:
+                await self._merge(file_memory, small)
+            finally:
+                self._merging = False
+
+    def clear(self):
+        self._entries = OrderedDict()
+
+    def _remember(self, key: str, embedding: np.ndarray):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _add_segment(self, segment: str, keys):
+        self._sizes[segment] = len(keys)
+        self._segments.update((key, segment) for key in keys)
+
+    async def _write_segment(self, file_memory, embeddings: Dict[str, np.ndarray]) -> str:
+        vectors = list(embeddings.values())
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            vectors=np.concatenate(vectors) if vectors else np.zeros(0, dtype=np.float32),
+            offsets=np.cumsum([0] + [len(v) for v in vectors]),
+        )
+        segment = uuid.uuid4().hex
+        await file_memory.write_file(self._path(segment, "vectors"), buffer.getvalue())
+        await file_memory.write_file(self._path(segment, "keys"), "\n".join(embeddings).encode())
+        return segment
+
+    async def _merge(self, file_memory, segments: List[str]):
+        """Write the embeddings of segments as one segment, then delete them."""
+        read = await asyncio.gather(*map(self._read_vectors, segments))
+        merged = {}
+        for embeddings in read:
+            merged.update(embeddings or {})
+        if not merged:
+            return
+        self._add_segment(await self._write_segment(file_memory, merged), merged)
+        for segment, embeddings in zip(segments, read):
+            if embeddings is None:
+                continue
+            self._sizes.pop(segment, None)
+            # keys first, a segment without keys is ignored
+            for suffix in ("keys", "vectors"):
+                try:
+                    await file_memory.delete_file(self._path(segment, suffix))
+                except Exception:
+                    # merged by another worker too
+                    logger.debug(f"unable to delete cached embeddings {segment}.{suffix}", exc_info=True)
+        await self._mark_changed(file_memory)
+
+    async def _mark_changed(self, file_memory):
+        changed = uuid.uuid4().hex.encode()
+        listed = self._listed is not ... and self._listed == await self._read_changed(file_memory)
+        await file_memory.write_file(f"{self._namespace_directory()}/CHANGED", changed)
+        if listed:
+            # only this worker wrote since the directory was listed, and its segments are known
+            self._listed = changed
+
+    async def _read_changed(self, file_memory) -> Optional[bytes]:
+        try:
+            return await file_memory.read_file(f"{self._namespace_directory()}/CHANGED")
+        except Exception:
+            return None
+
+    async def _read_keys(self, file_memory):
+        if self._read_in is not file_memory:
+            self._segments, self._sizes, self._read_in, self._listed = {}, {}, file_memory, ...
+        changed = await self._read_changed(file_memory)
+        if changed == self._listed:
+            return
+        self._listed = changed
+        paths = await file_memory.glob(f"{self._namespace_directory()}/*.keys")
+        present = {path.rsplit("/", 1)[-1][: -len(".keys")]: path for path in map(str, paths)}
+        if any(segment not in present for segment in self._sizes):
+            # merged into another segment
+            self._sizes = {segment: size for segment, size in self._sizes.items() if segment in present}
+            self._segments = {key: segment for key, segment in self._segments.items() if segment in self._sizes}
+        new = {segment: path for segment, path in present.items() if segment not in self._sizes}
+        for segment, data in zip(new, await asyncio.gather(*map(file_memory.read_file, new.values()))):
+            self._add_segment(segment, [key for key in data.decode().split("\n") if key])
+
+    async def _read_vectors(self, segment: str) -> Optional[Dict[str, np.ndarray]]:
+        file_memory = self._file_memory()
+        try:
+            keys, data = await asyncio.gather(
+                file_memory.read_file(self._path(segment, "keys")), file_memory.read_file(self._path(segment, "vectors"))
+            )
+            with np.load(io.BytesIO(data)) as npz:
+                vectors, offsets = npz["vectors"], npz["offsets"]
+        except Exception:
+            logger.warning(f"unable to read cached embeddings {segment}", exc_info=True)
+            return None
+        keys = [key for key in keys.decode().split("\n") if key]
+        # copied, so an embedding held in memory does not hold the vectors of its whole segment
+        return {key: vectors[offsets[i] : offsets[i + 1]].copy() for i, key in enumerate(keys)}
+
+    def _file_memory(self):
+        if self.directory is None or AgentOS.file_memory is ...:
+            return None
+        return AgentOS.file_memory
+
+    def _namespace_directory(self) -> str:
+        namespace = "".join(c if c.isalnum() or c in "-_." else "_" for c in self.namespace)
+        return f"{self.directory}/{namespace}"
+
+    def _path(self, segment: str, suffix: str) -> str:
+        return f"{self._namespace_directory()}/{segment}.{suffix}"
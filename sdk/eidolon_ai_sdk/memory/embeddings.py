@@ -1,49 +1,188 @@
-from abc import ABC, abstractmethod
-from typing import Sequence, Any, AsyncGenerator, Optional, List
+import asyncio
+import re
+import zlib
+from abc import ABC
+from collections import deque
+from typing import Sequence, Any, AsyncGenerator, List, Iterator, Optional
 
+import numpy as np
 from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
 
+from eidolon_ai_sdk.cpu.llm.llm_scheduler import get_scheduler
+from eidolon_ai_sdk.system.client_registry import get_client
 from eidolon_ai_sdk.system.reference_model import Specable, AnnotatedReference
+from eidolon_ai_sdk.util.async_wrapper import make_async
 from eidolon_ai_sdk.memory.document import Document, EmbeddedDocument
+from eidolon_ai_sdk.memory.embedding_cache import EmbeddingCache
+from eidolon_ai_sdk.util.class_utils import fqn
+from eidolon_ai_sdk.util.single_flight import SingleFlight
 
 
 class EmbeddingSpec(BaseModel):
-    pass
+    max_batch_inputs: int = Field(default=100, description="The maximum number of texts embedded in one request.")
+    max_batch_tokens: int = Field(
+        default=100_000, description="The maximum (estimated) number of tokens embedded in one request."
+    )
+    max_concurrent_batches: int = Field(default=4, description="The number of batch requests made concurrently.")
+    cache_size: int = Field(
+        default=10_000, description="The number of embeddings kept in memory. Set to 0 to disable the in memory cache."
+    )
+    cache_directory: Optional[str] = Field(
+        default=None,
+        description="The file memory directory embeddings are stored in so unchanged text is not embedded again after "
+        "a restart, such as embedding_cache. Unset by default, which only caches embeddings in memory.",
+    )
 
 
 class Embedding(ABC, Specable[EmbeddingSpec]):
+    _in_flight: SingleFlight
+    _cache: EmbeddingCache
+
     def __init__(self, spec: EmbeddingSpec):
         super().__init__(spec)
         self.spec = spec
+        self._in_flight = SingleFlight()
+        self._cache = EmbeddingCache(self.cache_namespace(), spec.cache_size, spec.cache_directory)
+
+    def cache_namespace(self) -> str:
+        """The name embeddings are cached under. Embedders should include anything that changes their embeddings."""
+        return fqn(self.__class__)
+
+    async def create_embedding(self, text: str, **kwargs: Any) -> List[float]:
+        """Call the underlying model to create an embedding for a single piece of text.
+
+        Embedders that override embed_text instead, as they did before create_embedding was added, are called through
+        it.
+
+        Args:
+            text: The text to be encoded.
+
+        Returns:
+            An embedding for the text.
+        """
+        if type(self).embed_text is Embedding.embed_text:
+            raise NotImplementedError(f"{fqn(self.__class__)} must implement create_embedding")
+        return await self.embed_text(text, **kwargs)
+
+    async def create_embeddings(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        """Call the underlying model to create embeddings for a batch of texts.
+
+        Models without a batch api embed each text in turn.
+
+        Args:
+            texts: The texts to be encoded.
+
+        Returns:
+            An embedding for each text, in order.
+        """
+        return [await self.create_embedding(text, **kwargs) for text in texts]
 
-    @abstractmethod
     async def embed_text(self, text: str, **kwargs: Any) -> List[float]:
         """Create an embedding for a single piece of text.
 
+        Embeddings are cached by the hash of the text, and identical texts embedded concurrently share one call to
+        the underlying model.
+
         Args:
             text: The text to be encoded.
 
         Returns:
             An embedding for the text.
         """
+        key = self._cache.key(text, kwargs)
+        embedding = await self._cache.get(key)
+        if embedding is None:
+            embedding = await self._in_flight.do(key, lambda: self._create_and_cache(key, text, **kwargs))
+        return embedding
+
+    async def embed_texts(self, texts: Sequence[str], **kwargs: Any) -> List[List[float]]:
+        """Create embeddings for several pieces of text, such as the variants of a query.
+
+        Texts are batched and cached as with embed, so a handful of texts takes one call to the underlying model.
+
+        Args:
+            texts: The texts to be encoded.
+
+        Returns:
+            An embedding for each text, in order.
+        """
+        documents = [Document(id=str(i), page_content=text) for i, text in enumerate(texts)]
+        return [document.embedding async for document in self.embed(documents, **kwargs)]
+
+    async def _create_and_cache(self, key: str, text: str, **kwargs: Any) -> List[float]:
+        embedding = await self.create_embedding(text, **kwargs)
+        await self._cache.put(key, embedding)
+        return embedding
 
     async def embed(self, documents: Sequence[Document], **kwargs: Any) -> AsyncGenerator[EmbeddedDocument, None]:
         """Create embeddings for a list of documents.
 
+        Documents are grouped into batches bounded by max_batch_inputs and max_batch_tokens. Up to
+        max_concurrent_batches batches are embedded at once, and results are yielded in the order of the documents.
+        Documents whose text has already been embedded are served from the cache.
+
         Args:
             documents: A sequence of Documents to be encoded.
 
         Returns:
             A sequence of EmbeddedDocuments.
         """
-        for document in documents:
-            text = await self.embed_text(document.page_content, **kwargs)
-            yield EmbeddedDocument(
-                id=document.id,
-                embedding=text,
-                metadata=document.metadata,
+        pending = deque()
+        try:
+            for batch in self._batches(documents):
+                pending.append((batch, asyncio.ensure_future(self._embed_batch(batch, **kwargs))))
+                if len(pending) >= self.spec.max_concurrent_batches:
+                    for embedded in await self._next_batch(pending):
+                        yield embedded
+            while pending:
+                for embedded in await self._next_batch(pending):
+                    yield embedded
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def _next_batch(pending: deque) -> List[EmbeddedDocument]:
+        batch, task = pending.popleft()
+        embeddings = await task
+        return [
+            EmbeddedDocument(id=document.id, embedding=embedding, metadata=document.metadata)
+            for document, embedding in zip(batch, embeddings)
+        ]
+
+    async def _embed_batch(self, batch: List[Document], **kwargs: Any) -> List[List[float]]:
+        keys = [self._cache.key(document.page_content, kwargs) for document in batch]
+        embeddings = await self._cache.get_many(keys)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if len(missing) == 1:
+            i = missing[0]
+            embeddings[i] = await self._in_flight.do(
+                keys[i], lambda: self._create_and_cache(keys[i], batch[i].page_content, **kwargs)
             )
+        elif missing:
+            # identical texts in a batch are embedded once
+            unique = list(dict.fromkeys(keys[i] for i in missing))
+            texts = {keys[i]: batch[i].page_content for i in missing}
+            created = dict(zip(unique, await self.create_embeddings([texts[key] for key in unique], **kwargs)))
+            await self._cache.put_many(created)
+            for i in missing:
+                embeddings[i] = created[keys[i]]
+        return embeddings
+
+    def _batches(self, documents: Sequence[Document]) -> Iterator[List[Document]]:
+        batch, tokens = [], 0
+        for document in documents:
+            document_tokens = estimate_tokens(document.page_content)
+            if batch and (
+                len(batch) >= self.spec.max_batch_inputs or tokens + document_tokens > self.spec.max_batch_tokens
+            ):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(document)
+            tokens += document_tokens
+        if batch:
+            yield batch
 
     async def start(self):
         pass
@@ -53,10 +192,70 @@ class Embedding(ABC, Specable[EmbeddingSpec]):
 
 
 class NoopEmbedding(Embedding, Specable[EmbeddingSpec]):
-    async def embed_text(self, text: str, **kwargs: Any) -> Sequence[float]:
+    async def create_embedding(self, text: str, **kwargs: Any) -> Sequence[float]:
         return []
 
 
+class HashingEmbeddingSpec(EmbeddingSpec):
+    dimensions: int = Field(default=512, description="The number of dimensions of the embeddings.")
+    word_ngrams: int = Field(default=2, description="Word n-grams up to this length are used as features.")
+    char_ngrams: int = Field(default=3, description="The length of the character n-grams used as features, 0 for none.")
+
+
+class HashingEmbedding(Embedding, Specable[HashingEmbeddingSpec]):
+    """
+    A local embedder hashing the words, word n-grams and character n-grams of a text into a fixed number of dimensions.
+
+    Embeddings are deterministic and need no model or network access, which makes them suitable for air-gapped
+    deployments and offline benchmarks. Similarity is lexical rather than semantic. Batches are embedded in a thread.
+    """
+
+    _words = re.compile(r"\w+")
+
+    def __init__(self, spec: HashingEmbeddingSpec):
+        super().__init__(spec)
+        self.spec = spec
+
+    def cache_namespace(self) -> str:
+        return f"hashing-{self.spec.dimensions}-{self.spec.word_ngrams}-{self.spec.char_ngrams}"
+
+    async def create_embedding(self, text: str, **kwargs: Any) -> List[float]:
+        # a single text is quicker to embed than to hand to a thread
+        return self.vectorize([text])[0].tolist()
+
+    async def create_embeddings(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        return (await make_async(self.vectorize)(texts)).tolist()
+
+    def vectorize(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.spec.dimensions), dtype=np.float32)
+        for row, text in zip(matrix, texts):
+            hashes = np.fromiter((zlib.crc32(f.encode()) for f in self._features(text)), dtype=np.uint32)
+            # the high bit of the hash picks the sign, so colliding features tend to cancel out
+            signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+            np.add.at(row, hashes % self.spec.dimensions, signs)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def _features(self, text: str) -> Iterator[str]:
+        words = self._words.findall(text.lower())
+        yield from words
+        for n in range(2, self.spec.word_ngrams + 1):
+            for i in range(len(words) - n + 1):
+                yield " ".join(words[i : i + n])
+        n = self.spec.char_ngrams
+        if n:
+            for word in words:
+                padded = f"<{word}>"
+                for i in range(len(padded) - n + 1):
+                    yield "#" + padded[i : i + n]
+
+
+def estimate_tokens(text: str) -> int:
+    # rough estimate (~4 characters per token)
+    return len(text) // 4 + 1
+
+
 class OpenAIEmbeddingSpec(EmbeddingSpec):
     model: str = Field(default="text-embedding-ada-002", description="The name of the model to use.")
     client: AnnotatedReference[AsyncOpenAI]
@@ -64,26 +263,31 @@ class OpenAIEmbeddingSpec(EmbeddingSpec):
 
 
 class OpenAIEmbedding(Embedding, Specable[OpenAIEmbeddingSpec]):
-    llm: Optional[AsyncOpenAI] = None
-
     def __init__(self, spec: OpenAIEmbeddingSpec):
         super().__init__(spec)
         self.spec = spec
 
-    async def start(self):
-        await super().start()
-        self.llm = self.spec.client.instantiate(**self.spec.client_args)
+    def cache_namespace(self) -> str:
+        return self.spec.model
 
-    async def stop(self):
-        await super().stop()
-        await self.llm.close()
-        self.llm = None
-
-    async def embed_text(self, text: str, **kwargs: Any) -> Sequence[float]:
-        response = await self.llm.embeddings.create(
-            input=text,
-            model=self.spec.model,  # Choose the model as per your requirement
-        )
+    @property
+    def llm(self) -> AsyncOpenAI:
+        return get_client(self.spec.client, self.spec.client_args, scheduled=True)
 
-        embedding_vector = response.data[0].embedding
-        return embedding_vector
+    async def create_embedding(self, text: str, **kwargs: Any) -> Sequence[float]:
+        return (await self.create_embeddings([text]))[0]
+
+    async def create_embeddings(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        async def request():
+            # a single text is sent as a string, matching requests made before batching
+            yield await self.llm.embeddings.create(input=texts[0] if len(texts) == 1 else texts, model=self.spec.model)
+
+        # the scheduler applies the machine's rate limits and retries rate limited requests
+        stream = get_scheduler().stream(
+            self.spec.model,
+            request,
+            endpoint="embeddings",
+            estimated_tokens=sum(estimate_tokens(text) for text in texts),
+        )
+        [response] = [r async for r in stream]
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
@@ -1,9 +1,11 @@
+import asyncio
 from abc import abstractmethod
 from pydantic import Field, BaseModel
 from typing import List, Dict, Optional, Sequence, Any, Iterable
 
 from eidolon_ai_sdk.agent_os import AgentOS
 from eidolon_ai_sdk.memory.document import Document, EmbeddedDocument
+from eidolon_ai_sdk.memory.packed_text import PackedTextSpec, PackedTextStore
 from eidolon_ai_sdk.memory.vector_store import QueryItem, VectorStore
 from eidolon_ai_sdk.system.reference_model import Specable
 
@@ -13,18 +15,30 @@ class FileSystemVectorStoreSpec(BaseModel):
         default="vector_memory",
         description="The root directory where the vector memory will store documents.",
     )
+    packed_text: Optional[PackedTextSpec] = Field(
+        default=None,
+        description="Store the text of documents in packed segment files on local disk, rather than a file per "
+        "document in file memory. Text stored in file memory before this is enabled is not migrated.",
+    )
+    indexed_metadata: List[str] = Field(
+        default=["source", "mime_type"],
+        description="The metadata keys indexed for filtering queries. Equality, $in and $prefix conditions on these "
+        "keys narrow the rows searched before they are scored.",
+    )
 
 
 class FileSystemVectorStore(VectorStore, Specable[FileSystemVectorStoreSpec]):
     def __init__(self, spec: FileSystemVectorStoreSpec):
         super().__init__(spec)
         self.spec = spec
+        self._packed_text = PackedTextStore(spec.packed_text) if spec.packed_text else None
 
     async def start(self):
         await AgentOS.file_memory.mkdir(self.spec.root_document_directory, exist_ok=True)
 
     async def stop(self):
-        pass
+        if self._packed_text:
+            await self._packed_text.stop()
 
     @abstractmethod
     async def add_embedding(self, collection: str, docs: List[EmbeddedDocument], **add_kwargs: Any):
@@ -49,23 +63,54 @@ class FileSystemVectorStore(VectorStore, Specable[FileSystemVectorStoreSpec]):
     ) -> List[QueryItem]:
         pass
 
+    def _document_path(self, collection: str, doc_id: str) -> str:
+        return self.spec.root_document_directory + "/" + collection + "/" + doc_id
+
+    async def query_embedding_batch(
+        self,
+        collection: str,
+        queries: List[List[float]],
+        num_results: int,
+        metadata_where: Optional[Dict[str, str]] = None,
+        include_embeddings: bool = False,
+    ) -> List[List[QueryItem]]:
+        return list(
+            await asyncio.gather(
+                *(self.query_embedding(collection, q, num_results, metadata_where, include_embeddings) for q in queries)
+            )
+        )
+
     async def add(self, collection: str, docs: Sequence[Document]):
-        await AgentOS.file_memory.mkdir(self.spec.root_document_directory + "/" + collection, exist_ok=True)
         # Asynchronously collect embedded documents
         embeddedDocs = []
         async for embeddedDoc in AgentOS.similarity_memory.embedder.embed(docs):
             embeddedDocs.append(embeddedDoc)
-        await self.add_embedding(collection, embeddedDocs)
+        await self.add_embedded(collection, docs, embeddedDocs)
+
+    async def add_embedded(self, collection: str, docs: Sequence[Document], embedded: Sequence[EmbeddedDocument]):
+        if not self._packed_text:
+            await AgentOS.file_memory.mkdir(self.spec.root_document_directory + "/" + collection, exist_ok=True)
+        await self.add_embedding(collection, list(embedded))
+        if self._packed_text:
+            await self._packed_text.add(collection, docs)
+            return
         for doc in docs:
-            await AgentOS.file_memory.write_file(
-                self.spec.root_document_directory + "/" + collection + "/" + doc.id,
-                doc.page_content.encode(),
-            )
+            await AgentOS.file_memory.write_file(self._document_path(collection, doc.id), doc.page_content.encode())
 
     async def delete(self, collection: str, doc_ids: List[str]):
         await self.delete_embedding(collection, doc_ids)
+        if self._packed_text:
+            await self._packed_text.delete(collection, doc_ids)
+            return
         for doc_id in doc_ids:
-            await AgentOS.file_memory.delete_file(self.spec.root_document_directory + "/" + collection + "/" + doc_id)
+            await AgentOS.file_memory.delete_file(self._document_path(collection, doc_id))
+
+    async def _read_texts(self, collection: str, doc_ids: List[str]) -> List[Optional[str]]:
+        if self._packed_text:
+            return await self._packed_text.read(collection, doc_ids)
+        return [
+            (await AgentOS.file_memory.read_file(self._document_path(collection, doc_id))).decode() for doc_id in doc_ids
+        ]
 
     async def query(
         self,
@@ -76,18 +121,12 @@ class FileSystemVectorStore(VectorStore, Specable[FileSystemVectorStoreSpec]):
     ) -> List[Document]:
         text = await AgentOS.similarity_memory.embedder.embed_text(query)
         results = await self.query_embedding(collection, text, num_results, metadata_where, False)
-        returnDocuments = []
-        for result in results:
-            returnDocuments.append(
-                Document(
-                    id=result.id,
-                    metadata=result.metadata,
-                    page_content=await AgentOS.file_memory.read_file(
-                        self.spec.root_document_directory + "/" + collection + "/" + result.id
-                    ).decode(),
-                )
-            )
-        return returnDocuments
+        texts = await self._read_texts(collection, [result.id for result in results])
+        return [
+            Document(id=result.id, metadata=result.metadata, page_content=page_content)
+            for result, page_content in zip(results, texts)
+            if page_content is not None
+        ]
 
     async def raw_query(
         self,
@@ -99,14 +138,19 @@ class FileSystemVectorStore(VectorStore, Specable[FileSystemVectorStoreSpec]):
     ) -> List[QueryItem]:
         return await self.query_embedding(collection, query, num_results, metadata_where, include_embeddings)
 
+    async def raw_query_batch(
+        self,
+        collection: str,
+        queries: List[List[float]],
+        num_results: int,
+        metadata_where: Optional[Dict[str, str]] = None,
+        include_embeddings: bool = False,
+    ) -> List[List[QueryItem]]:
+        return await self.query_embedding_batch(collection, queries, num_results, metadata_where, include_embeddings)
+
     async def get_docs(self, collection: str, doc_ids: List[str]) -> Iterable[Document]:
         metadatas = await self.get_metadata(collection, doc_ids)
-        for i, doc_id in enumerate(doc_ids):
-            content = await AgentOS.file_memory.read_file(
-                self.spec.root_document_directory + "/" + collection + "/" + doc_id
-            )
-            yield Document(
-                id=doc_id,
-                metadata=metadatas[i],
-                page_content=content.decode(),
-            )
+        texts = await self._read_texts(collection, doc_ids)
+        for doc_id, metadata, page_content in zip(doc_ids, metadatas, texts):
+            if page_content is not None:
+                yield Document(id=doc_id, metadata=metadata, page_content=page_content)
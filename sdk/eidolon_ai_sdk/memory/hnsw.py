@@ -0,0 +1,454 @@
+import math
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# the rows inserted together, their candidates among each other are found exactly with one matrix product
+_BATCH_ROWS = 256
+# the number of float32 values of candidate vectors gathered at once while selecting neighbors
+_SELECT_BLOCK = 1 << 22
+
+
+class _Layer:
+    """
+    The links of the nodes on one level of the graph: a row of up to width neighbors per node, padded with -1, in node
+    order. Every node is on level 0, so its rows are indexed by node. Arrays grow by doubling and are replaced rather
+    than resized, so a search holding the previous arrays still reads complete rows.
+    """
+
+    def __init__(self, width: int, dense: bool, nodes: Optional[np.ndarray] = None, links: Optional[np.ndarray] = None):
+        self.width = width
+        self.dense = dense
+        self.nodes = np.zeros(0, dtype=np.int64) if nodes is None else nodes
+        self.links = np.full((0, width), -1, dtype=np.int32) if links is None else links
+        self.count = len(self.nodes) if nodes is not None else len(self.links)
+
+    def slots(self, nodes: np.ndarray) -> np.ndarray:
+        if self.dense:
+            return nodes
+        return np.searchsorted(self.nodes[: self.count], nodes)
+
+    def append(self, nodes: np.ndarray):
+        stop = self.count + len(nodes)
+        if stop > len(self.links):
+            capacity = max(stop, 2 * len(self.links), 64)
+            links = np.full((capacity, self.width), -1, dtype=np.int32)
+            links[: self.count] = self.links[: self.count]
+            if not self.dense:
+                grown = np.zeros(capacity, dtype=np.int64)
+                grown[: self.count] = self.nodes[: self.count]
+                self.nodes = grown
+            self.links = links
+        if not self.dense:
+            self.nodes[self.count : stop] = nodes
+        # the count is raised last, searches read it before the arrays
+        self.count = stop
+
+
+class HnswIndex:
+    """
+    A hierarchical navigable small world graph over the rows of a matrix of normalized vectors.
+
+    Nodes are row numbers. The index does not hold the vectors, they are passed to each call so the caller can keep
+    them memory mapped. Rows are never removed from the graph, searches take a mask of the rows they may return
+    instead, which covers both deleted rows and metadata filters. compacted drops the rows deleted from the matrix and
+    renumbers the rest, keeping the graph.
+
+    Links are numpy arrays, so the steps of inserting and searching work on blocks of nodes: searches expand the closest
+    unexpanded nodes they found together, and rows are inserted in batches whose neighbors are selected together.
+
+    Searches read the graph without locks, so a search running while rows are added only visits rows below the size
+    the index had when the search started.
+    """
+
+    def __init__(self, m: int = 16, ef_construction: int = 200, seed: int = 0):
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.layers: List[_Layer] = []
+        self.size = 0
+        # the level of each node, grown by doubling as the layers are
+        self._levels = np.zeros(0, dtype=np.int8)
+        # every entry point the index has had, as (node, level), the last is the current one
+        self.entry_points: List[Tuple[int, int]] = []
+        self._level_mult = 1 / math.log(max(m, 2))
+        self._random = np.random.default_rng(seed)
+        # flags of the nodes a search visited, per thread and cleared after each search
+        self._scratch = threading.local()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def levels(self) -> np.ndarray:
+        return self._levels[: self.size]
+
+    @property
+    def max_level(self) -> int:
+        return self.entry_points[-1][1] if self.entry_points else -1
+
+    def neighbors(self, node: int, level: int = 0) -> List[int]:
+        layer = self.layers[level]
+        links = layer.links[layer.slots(np.array([node]))[0]]
+        return links[links >= 0].tolist()
+
+    def add(self, matrix: np.ndarray, stop: int):
+        """Add the rows of matrix from len(self) up to stop."""
+        for start in range(self.size, stop, _BATCH_ROWS):
+            self._insert(matrix, start, min(start + _BATCH_ROWS, stop))
+
+    def search(
+        self, matrix: np.ndarray, query: np.ndarray, k: int, ef: int, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[float, int]]:
+        """
+        The k (approximately) closest rows to query as (distance, row) tuples, closest first. Only rows set in mask
+        are returned.
+        """
+        limit = min(self.size, len(matrix), len(mask) if mask is not None else self.size)
+        entry_point = next((e for e in reversed(self.entry_points) if e[0] < limit), None)
+        if entry_point is None or k <= 0:
+            return []
+        entry_points = np.array([entry_point[0]])
+        for level in range(entry_point[1], 0, -1):
+            entry_points = self._search_level(matrix, query, entry_points, 1, level, limit)[1]
+        distances, nodes = self._search_level(matrix, query, entry_points, max(ef, k), 0, limit, mask)
+        return list(zip(distances[:k].tolist(), nodes[:k].tolist()))
+
+    def _insert(self, matrix: np.ndarray, start: int, stop: int):
+        nodes = np.arange(start, stop)
+        vectors = np.asarray(matrix[start:stop], dtype=np.float32)
+        levels = (-np.log(1 - self._random.random(len(nodes))) * self._level_mult).astype(np.int8)
+        top = int(levels.max())
+        if len(self._levels) < stop:
+            grown = np.zeros(max(stop, 2 * len(self._levels)), dtype=np.int8)
+            grown[:start] = self._levels[:start]
+            self._levels = grown
+        self._levels[start:stop] = levels
+        while len(self.layers) <= top:
+            level = len(self.layers)
+            self.layers.append(_Layer(self.m0 if level == 0 else self.m, dense=level == 0))
+
+        # the candidates of each new node on each of its levels, found in the graph before the batch
+        found = [[] for _ in range(top + 1)]
+        for i, level in enumerate(levels.tolist()):
+            entry_points = np.array([self.entry_points[-1][0]]) if self.entry_points else np.zeros(0, dtype=np.int64)
+            for lc in range(self.max_level, level, -1):
+                entry_points = self._search_level(matrix, vectors[i], entry_points, 1, lc, start)[1]
+            for lc in range(min(level, self.max_level), -1, -1):
+                distances, entry_points = self._search_level(
+                    matrix, vectors[i], entry_points, self.ef_construction, lc, start
+                )
+                found[lc].append((i, distances, entry_points))
+        # and among the batch, exactly
+        batch_distances = 1 - vectors @ vectors.T
+        np.fill_diagonal(batch_distances, np.inf)
+
+        incoming = []
+        for lc in range(top + 1):
+            on_level = np.flatnonzero(levels >= lc)
+            layer = self.layers[lc]
+            layer.append(nodes[on_level])
+            ids, distances = self._candidates(found[lc], on_level, batch_distances, start)
+            selected = self._select(matrix, ids, distances, self.m)
+            layer.links[layer.slots(nodes[on_level])] = np.pad(
+                selected, ((0, 0), (0, layer.width - self.m)), constant_values=-1
+            )
+            incoming.append((lc, nodes[on_level], selected))
+        for lc, sources, selected in incoming:
+            self._link_back(matrix, lc, sources, selected)
+
+        for node, level in zip(nodes.tolist(), levels.tolist()):
+            if level > self.max_level:
+                self.entry_points.append((node, level))
+        # raised last, so searches only visit nodes whose links are complete
+        self.size = stop
+
+    def _candidates(
+        self, found: list, on_level: np.ndarray, batch_distances: np.ndarray, start: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The candidates of the batch nodes on a level, as rows of ids and distances sorted closest first."""
+        peers = batch_distances[np.ix_(on_level, on_level)]
+        width = min(self.ef_construction, len(on_level) - 1)
+        if width > 0:
+            closest = np.argpartition(peers, width - 1, axis=1)[:, :width]
+            peer_ids = on_level[closest] + start
+            peer_distances = np.take_along_axis(peers, closest, axis=1)
+        else:
+            peer_ids = np.zeros((len(on_level), 0), dtype=np.int64)
+            peer_distances = np.zeros((len(on_level), 0), dtype=np.float32)
+        graph = max((len(nodes) for _, _, nodes in found), default=0)
+        graph_ids = np.full((len(on_level), graph), -1, dtype=np.int64)
+        graph_distances = np.full((len(on_level), graph), np.inf, dtype=np.float32)
+        slot = {int(i): s for s, i in enumerate(on_level)}
+        for i, distances, nodes in found:
+            graph_ids[slot[i], : len(nodes)] = nodes
+            graph_distances[slot[i], : len(nodes)] = distances
+        ids = np.concatenate([graph_ids, peer_ids], axis=1)
+        distances = np.concatenate([graph_distances, peer_distances], axis=1)
+        order = np.argsort(distances, axis=1, kind="stable")[:, : self.ef_construction]
+        return np.take_along_axis(ids, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+    def _link_back(self, matrix: np.ndarray, level: int, sources: np.ndarray, selected: np.ndarray):
+        """Add links back from the neighbors selected for sources, pruning neighbors that then have too many."""
+        layer = self.layers[level]
+        targets = selected.ravel()
+        sources = np.repeat(sources, selected.shape[1])
+        keep = targets >= 0
+        targets, sources = targets[keep], sources[keep]
+        if not len(targets):
+            return
+        order = np.argsort(targets, kind="stable")
+        targets, sources = targets[order], sources[order]
+        unique, first, counts = np.unique(targets, return_index=True, return_counts=True)
+        # the current links of each target followed by the sources linking to it
+        position = np.arange(len(targets)) - np.repeat(first, counts)
+        added = np.full((len(unique), int(counts.max())), -1, dtype=np.int64)
+        added[np.repeat(np.arange(len(unique)), counts), position] = sources
+        slots = layer.slots(unique)
+        current = layer.links[slots].astype(np.int64)
+        # sources already linked from the target are not added again
+        added[(added[:, :, None] == current[:, None, :]).any(axis=2)] = -1
+        candidates = np.concatenate([current, added], axis=1)
+        valid = candidates >= 0
+        fits = valid.sum(axis=1) <= layer.width
+
+        # targets with room keep their links and the new ones, packed to the front
+        order = np.argsort(~valid[fits], axis=1, kind="stable")[:, : layer.width]
+        layer.links[slots[fits]] = np.take_along_axis(candidates[fits], order, axis=1)
+
+        full = np.flatnonzero(~fits)
+        for block in self._blocks(len(full), candidates.shape[1], matrix.shape[1]):
+            rows = full[block]
+            ids = candidates[rows]
+            vectors = matrix[np.maximum(ids, 0)]
+            distances = 1 - np.einsum("rcd,rd->rc", vectors, np.asarray(matrix[unique[rows]]))
+            distances[ids < 0] = np.inf
+            order = np.argsort(distances, axis=1, kind="stable")
+            layer.links[slots[rows]] = self._select(
+                matrix,
+                np.take_along_axis(ids, order, axis=1),
+                np.take_along_axis(distances, order, axis=1),
+                layer.width,
+                np.take_along_axis(vectors, order[:, :, None], axis=1),
+            )
+
+    @staticmethod
+    def _blocks(rows: int, candidates: int, dimensions: int):
+        size = max(1, _SELECT_BLOCK // max(1, candidates * dimensions))
+        for start in range(0, rows, size):
+            yield slice(start, min(start + size, rows))
+
+    def _select(
+        self,
+        matrix: np.ndarray,
+        ids: np.ndarray,
+        distances: np.ndarray,
+        m: int,
+        vectors: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Select up to m neighbors for each row of candidates (sorted closest first, padded with -1), keeping candidates
+        closer to the node than to any neighbor already selected, spreading links in all directions, then filling any
+        remaining slots with the closest of the rest. Rows are selected together, a block of rows at a time.
+        """
+        selected = np.full((len(ids), m), -1, dtype=np.int32)
+        for block in self._blocks(len(ids), ids.shape[1], matrix.shape[1]):
+            block_ids = ids[block]
+            block_vectors = matrix[np.maximum(block_ids, 0)] if vectors is None else vectors[block]
+            selected[block] = self._select_block(block_ids, distances[block], block_vectors, m)
+        return selected
+
+    @staticmethod
+    def _select_block(ids: np.ndarray, distances: np.ndarray, vectors: np.ndarray, m: int) -> np.ndarray:
+        rows, width = ids.shape
+        selected = np.full((rows, m), -1, dtype=np.int32)
+        valid = ids >= 0
+        blocked = ~valid
+        chosen = np.zeros_like(valid)
+        counts = np.zeros(rows, dtype=np.int64)
+        last = np.full(rows, -1)
+        columns = np.arange(width)
+        for _ in range(m):
+            available = ~blocked & (columns > last[:, None])
+            open_rows = np.flatnonzero(available.any(axis=1))
+            if not len(open_rows):
+                break
+            picks = available.argmax(axis=1)
+            selected[open_rows, counts[open_rows]] = ids[open_rows, picks[open_rows]]
+            chosen[open_rows, picks[open_rows]] = True
+            counts[open_rows] += 1
+            last[open_rows] = picks[open_rows]
+            # candidates at least as close to the chosen neighbor as to the node are reached through it. Every row is
+            # scored, gathering the vectors of the open rows would copy the block
+            similarities = np.einsum("rcd,rd->rc", vectors, vectors[np.arange(rows), picks])
+            blocked[open_rows] |= 1 - similarities[open_rows] <= distances[open_rows]
+        rest = valid & ~chosen
+        fill = rest & (np.cumsum(rest, axis=1) <= (m - counts)[:, None])
+        row, column = np.nonzero(fill)
+        slot = counts[row] + np.cumsum(fill, axis=1)[row, column] - 1
+        selected[row, slot] = ids[row, column]
+        return selected
+
+    def _search_level(
+        self,
+        matrix: np.ndarray,
+        query: np.ndarray,
+        entry_points: np.ndarray,
+        ef: int,
+        level: int,
+        limit: int,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The distances and nodes of the ef closest accepted nodes found, closest first."""
+        layer = self.layers[level] if level < len(self.layers) else None
+        visited = np.unique(entry_points[entry_points < limit])
+        if layer is None or not len(visited):
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        seen = getattr(self._scratch, "seen", None)
+        if seen is None or len(seen) < limit:
+            seen = self._scratch.seen = np.zeros(max(limit, 2 * (0 if seen is None else len(seen))), dtype=bool)
+        seen[visited] = True
+        try:
+            visited, distances = self._expand(matrix, query, visited, ef, layer, limit, mask, seen)
+        except BaseException:
+            seen[:] = False
+            raise
+        seen[visited] = False
+        if mask is not None:
+            accepted = mask[visited]
+            visited, distances = visited[accepted], distances[accepted]
+        closest = np.argsort(distances, kind="stable")[:ef]
+        return distances[closest], visited[closest]
+
+    @staticmethod
+    def _expand(
+        matrix: np.ndarray,
+        query: np.ndarray,
+        visited: np.ndarray,
+        ef: int,
+        layer: _Layer,
+        limit: int,
+        mask: Optional[np.ndarray],
+        seen: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # read before the arrays, see _Layer.append
+        count = layer.count
+        nodes, links = layer.nodes[:count], layer.links
+        distances = 1 - matrix[visited] @ query
+        expanded = np.zeros(len(visited), dtype=bool)
+        while True:
+            accepted = distances if mask is None else distances[mask[visited]]
+            # only nodes closer than the ef-th closest accepted node are expanded
+            bound = np.partition(accepted, ef - 1)[ef - 1] if len(accepted) >= ef else np.inf
+            frontier = np.flatnonzero(~expanded & (distances <= bound))
+            if not len(frontier):
+                return visited, distances
+            if len(frontier) > ef:
+                # rejected nodes are still expanded, the graph is navigated through them
+                frontier = frontier[np.argpartition(distances[frontier], ef - 1)[:ef]]
+            expanded[frontier] = True
+            slots = visited[frontier]
+            if not layer.dense:
+                slots = np.searchsorted(nodes, slots)
+            neighbors = links[slots].ravel()
+            neighbors = neighbors[(neighbors >= 0) & (neighbors < limit)]
+            neighbors = np.unique(neighbors[~seen[neighbors]])
+            if len(neighbors):
+                seen[neighbors] = True
+                visited = np.concatenate([visited, neighbors])
+                distances = np.concatenate([distances, 1 - matrix[neighbors] @ query])
+                expanded = np.concatenate([expanded, np.zeros(len(neighbors), dtype=bool)])
+
+    def compacted(self, keep: np.ndarray, matrix: np.ndarray) -> "HnswIndex":
+        """
+        The index without the rows not set in keep, the rest renumbered by their order among the kept rows, as a
+        compaction renumbers the rows of a matrix. Links to dropped rows are removed, and nodes left with fewer than
+        m links are linked again through the neighbors of the dropped rows. matrix holds the kept rows.
+        """
+        keep = np.asarray(keep[: self.size], dtype=bool)
+        renumbered = np.cumsum(keep) - 1
+        index = HnswIndex(m=self.m, ef_construction=self.ef_construction)
+        index._random = self._random
+        index._levels = self.levels[keep]
+        index.size = len(index._levels)
+        for level, layer in enumerate(self.layers):
+            old_nodes = np.arange(self.size) if layer.dense else layer.nodes[: layer.count]
+            kept = keep[old_nodes]
+            links = layer.links[: layer.count][kept].astype(np.int64)
+            valid = links >= 0
+            dropped = valid & ~keep[np.maximum(links, 0)]
+            nodes = renumbered[old_nodes[kept]]
+            # the neighbors of dropped neighbors, two hops from the node
+            repair = np.flatnonzero(((valid & ~dropped).sum(axis=1) < self.m) & dropped.any(axis=1))
+            links = np.where(valid & ~dropped, renumbered[np.maximum(links, 0)], -1)
+            new_layer = _Layer(layer.width, layer.dense, None if layer.dense else nodes, links.astype(np.int32))
+            index.layers.append(new_layer)
+            if len(repair):
+                old = layer.links[: layer.count][kept][repair].astype(np.int64)
+                # the first m links of each dropped neighbor, which are the first it selected, bound the candidates
+                second = layer.links[layer.slots(np.maximum(old, 0))][:, :, : self.m]
+                second = np.where(dropped[repair][:, :, None], second, -1)
+                second = second.reshape(len(repair), -1).astype(np.int64)
+                second = np.where((second >= 0) & keep[np.maximum(second, 0)], renumbered[np.maximum(second, 0)], -1)
+                candidates = np.concatenate([links[repair], second], axis=1)
+                candidates[candidates == nodes[repair][:, None]] = -1
+                # drop repeated candidates
+                candidates = np.sort(candidates, axis=1)
+                candidates[:, 1:][candidates[:, 1:] == candidates[:, :-1]] = -1
+                new_layer.links[repair] = index._reselect(matrix, nodes[repair], candidates, layer.width)
+            if not len(nodes):
+                break
+        index.layers = [layer for layer in index.layers if layer.count]
+        # the prefix maxima of the levels, the entry points the index would have had adding the kept rows in order
+        highest = np.maximum.accumulate(index.levels.astype(np.int64)) if index.size else np.zeros(0, dtype=np.int64)
+        raised = np.flatnonzero(np.diff(highest, prepend=-1) > 0)
+        index.entry_points = [(int(node), int(index.levels[node])) for node in raised]
+        return index
+
+    def _reselect(self, matrix: np.ndarray, nodes: np.ndarray, candidates: np.ndarray, m: int) -> np.ndarray:
+        selected = np.full((len(nodes), m), -1, dtype=np.int32)
+        for block in self._blocks(len(nodes), candidates.shape[1], matrix.shape[1]):
+            ids = candidates[block]
+            vectors = matrix[np.maximum(ids, 0)]
+            distances = 1 - np.einsum("rcd,rd->rc", vectors, np.asarray(matrix[nodes[block]]))
+            distances[ids < 0] = np.inf
+            order = np.argsort(distances, axis=1, kind="stable")
+            selected[block] = self._select_block(
+                np.take_along_axis(ids, order, axis=1),
+                np.take_along_axis(distances, order, axis=1),
+                np.take_along_axis(vectors, order[:, :, None], axis=1),
+                m,
+            )
+        return selected
+
+    def save(self) -> dict:
+        """The index as numpy arrays, for np.savez."""
+        state = dict(
+            params=np.array([self.m, self.ef_construction]),
+            entry_points=np.array(self.entry_points, dtype=np.int64).reshape(-1, 2),
+            levels=self.levels,
+        )
+        for level, layer in enumerate(self.layers):
+            count = self.size if layer.dense else np.searchsorted(layer.nodes[: layer.count], self.size)
+            state[f"links_{level}"] = layer.links[:count]
+            if not layer.dense:
+                state[f"nodes_{level}"] = layer.nodes[:count]
+        return state
+
+    @classmethod
+    def load(cls, state: dict, seed: int = 0) -> "HnswIndex":
+        m, ef_construction = (int(v) for v in state["params"])
+        index = cls(m=m, ef_construction=ef_construction, seed=seed)
+        index._levels = np.array(state["levels"], dtype=np.int8)
+        index.size = len(index._levels)
+        index.entry_points = [(int(node), int(level)) for node, level in state["entry_points"]]
+        level = 0
+        while f"links_{level}" in state:
+            links = np.array(state[f"links_{level}"], dtype=np.int32)
+            nodes = None if level == 0 else np.array(state[f"nodes_{level}"], dtype=np.int64)
+            index.layers.append(_Layer(links.shape[1], level == 0, nodes, links))
+            level += 1
+        # continue with a different sequence of levels than the one that built the index
+        index._random = np.random.default_rng([seed, index.size])
+        return index
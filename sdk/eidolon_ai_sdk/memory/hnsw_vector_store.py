@@ -0,0 +1,317 @@
+import asyncio
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from eidolon_ai_client.util.logger import logger
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+from eidolon_ai_sdk.memory.hnsw import HnswIndex
+from eidolon_ai_sdk.memory.numpy_vector_store import (
+    CollectionSnapshot,
+    NumpyCollection,
+    NumpyVectorStore,
+    NumpyVectorStoreSpec,
+    normalize,
+)
+from eidolon_ai_sdk.memory.quantization import QuantizationSpec
+from eidolon_ai_sdk.memory.vector_store import QueryItem
+from eidolon_ai_sdk.system.reference_model import Specable
+from eidolon_ai_sdk.util.async_wrapper import make_async
+
+# the rows indexed per call to a worker thread, a compaction waits for the chunk being indexed
+_INDEX_CHUNK_ROWS = 256
+
+
+class HnswParams(BaseModel):
+    m: int = Field(default=16, description="The number of links each node has per layer (twice this on the bottom).")
+    ef_construction: int = Field(
+        default=200,
+        description="The number of candidates considered when linking a new node. Higher is slower to "
+        "build but gives better recall.",
+    )
+    ef_search: int = Field(
+        default=64, description="The number of candidates considered per query. Higher is slower but more accurate."
+    )
+
+
+class HnswVectorStoreSpec(NumpyVectorStoreSpec):
+    root_dir: str = Field(
+        default="/tmp/eidolon/hnsw_vector_store", description="The directory collections are stored in."
+    )
+    index: HnswParams = Field(default_factory=HnswParams, description="The index parameters of collections.")
+    collections: Dict[str, HnswParams] = Field(
+        default={}, description="Index parameters for individual collections, by collection name."
+    )
+    exact_search_limit: int = Field(
+        default=10_000,
+        description="Collections of at most this many rows, and queries whose metadata filter matches at most this "
+        "many rows, are searched exactly.",
+    )
+    checkpoint_rows: int = Field(
+        default=10_000,
+        description="The index is saved once this many rows have been added since it was last saved (and on stop). "
+        "Rows added after the last save are indexed again on load.",
+    )
+
+
+class _HnswCollection(NumpyCollection):
+    """
+    A collection with an HNSW index over its rows, saved next to its segment as {generation}.hnsw.
+
+    Rows are indexed in chunks by index_rows, which the store calls on a worker thread, so neither writes nor the
+    collection lock wait for the graph. Rows the index does not cover yet, those added since the indexer last ran, are
+    searched exactly. A compaction keeps the graph, renumbering its rows as it renumbers the segment.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        params: HnswParams,
+        checkpoint_rows: int,
+        quantization: Optional[QuantizationSpec],
+        indexed_metadata: Sequence[str] = (),
+    ):
+        super().__init__(directory, quantization, indexed_metadata)
+        self.params = params
+        self.checkpoint_rows = checkpoint_rows
+        # the generation an index was built for, replaced as a pair so searches see a matching one
+        self.indexed: Tuple[int, HnswIndex] = (0, self._new_index())
+        # the rows of the index that are fully linked, the last row added may not be reachable yet
+        self.covered = 0
+        self.saved = 0
+        # held while the index is extended or saved, and while a compaction replaces it
+        self._index_lock = threading.Lock()
+
+    def _new_index(self) -> HnswIndex:
+        return HnswIndex(m=self.params.m, ef_construction=self.params.ef_construction)
+
+    def load(self):
+        super().load()
+        path = self._path("hnsw")
+        if path.exists():
+            try:
+                with open(path, "rb") as f:
+                    index = HnswIndex.load(dict(np.load(f)))
+                if len(index) <= self.size:
+                    self.indexed, self.saved = (self.generation, index), len(index)
+            except Exception:
+                logger.warning(f"unable to load {path}, rebuilding the index", exc_info=True)
+        self.indexed = (self.generation, self.indexed[1])
+        self.covered = len(self.indexed[1])
+
+    def unindexed(self) -> int:
+        generation, index = self.indexed
+        return self.size - self.covered if generation == self.snapshot.generation else 0
+
+    def index_rows(self, rows: int):
+        """Index up to rows more rows of the current snapshot, saving the index every checkpoint_rows rows."""
+        with self._index_lock:
+            generation, index = self.indexed
+            snapshot = self.snapshot
+            if generation != snapshot.generation:
+                # a compaction is about to replace the index
+                return
+            index.add(snapshot.matrix, min(len(snapshot.live), len(index) + rows))
+            self.covered = len(index)
+            if len(index) - self.saved >= self.checkpoint_rows:
+                self._save(generation, index)
+
+    def compact(self):
+        old_generation, live = self.generation, self.snapshot.live
+        super().compact()
+        with self._index_lock:
+            generation, index = self.indexed
+            if generation == old_generation:
+                # the live rows keep their order, so the rows the index covered are the first rows of the new segment
+                index = index.compacted(live[: len(index)], self.snapshot.matrix)
+            else:
+                index = self._new_index()
+            self.covered, self.saved = len(index), 0
+            self.indexed = (self.generation, index)
+            self._save(self.generation, index)
+            self._path("hnsw", old_generation).unlink(missing_ok=True)
+
+    def checkpoint(self):
+        with self._index_lock:
+            generation, index = self.indexed
+            if generation == self.generation:
+                self._save(generation, index)
+
+    def _save(self, generation: int, index: HnswIndex):
+        if self.dimensions is None or len(index) == self.saved:
+            return
+        tmp = self._path("hnsw.tmp", generation)
+        with open(tmp, "wb") as f:
+            np.savez(f, **index.save())
+        os.replace(tmp, self._path("hnsw", generation))
+        self.saved = len(index)
+
+    def query(
+        self,
+        query: List[float],
+        num_results: int,
+        where: Optional[Dict[str, Any]],
+        include_embeddings: bool,
+        ef_search: Optional[int] = None,
+        exact_search_limit: int = 0,
+    ) -> List[QueryItem]:
+        generation, index = self.indexed
+        # covered is reset before a new index is swapped in, so bounding it by the index keeps the pair consistent
+        covered = min(self.covered, len(index))
+        snapshot = self.snapshot
+        if generation != snapshot.generation or not covered or len(snapshot.live) <= exact_search_limit:
+            return super().query(query, num_results, where, include_embeddings)
+        if not len(snapshot.live) or num_results <= 0:
+            return []
+        query = normalize(np.asarray([query], dtype=np.float32))[0]
+        mask = self._mask(snapshot, where)
+        allowed = int(np.count_nonzero(mask))
+        k = min(num_results, allowed)
+        if not k:
+            return []
+        if allowed <= exact_search_limit:
+            # a selective filter leaves too few rows for the graph to find, and few enough to score them all
+            return self._exact(snapshot, np.flatnonzero(mask), query, k, include_embeddings)
+
+        found = index.search(snapshot.matrix, query, k, ef_search or self.params.ef_search, mask)
+        found = [(distance, row) for distance, row in found if row < covered]
+        rows = np.array([row for _, row in found], dtype=np.int64)
+        similarities = np.array([1 - distance for distance, _ in found], dtype=np.float32)
+        covered = min(covered, len(snapshot.live))
+        tail = np.flatnonzero(mask[covered:]) + covered
+        if len(tail):
+            rows = np.concatenate([rows, tail])
+            similarities = np.concatenate([similarities, snapshot.matrix[tail] @ query])
+        top = np.argpartition(-similarities, k - 1)[:k] if len(rows) > k else np.arange(len(rows))
+        return self._results(snapshot, rows[top], similarities[top], include_embeddings)
+
+    def query_batch(
+        self,
+        queries: List[List[float]],
+        num_results: int,
+        where: Optional[Dict[str, Any]],
+        include_embeddings: bool,
+        ef_search: Optional[int] = None,
+        exact_search_limit: int = 0,
+    ) -> List[List[QueryItem]]:
+        generation, _ = self.indexed
+        snapshot = self.snapshot
+        if generation != snapshot.generation or not self.covered or len(snapshot.live) <= exact_search_limit:
+            return super().query_batch(queries, num_results, where, include_embeddings)
+        # the graph is searched one query at a time
+        return [self.query(q, num_results, where, include_embeddings, ef_search, exact_search_limit) for q in queries]
+
+    def _exact(
+        self, snapshot: CollectionSnapshot, rows: np.ndarray, query: np.ndarray, k: int, include_embeddings: bool
+    ) -> List[QueryItem]:
+        similarities = snapshot.matrix[rows] @ query
+        top = np.argpartition(-similarities, k - 1)[:k]
+        return self._results(snapshot, rows[top], similarities[top], include_embeddings)
+
+
+class HnswVectorStore(NumpyVectorStore, Specable[HnswVectorStoreSpec]):
+    """
+    A NumpyVectorStore searching large collections with an approximate nearest neighbor (HNSW) index.
+
+    The index is persisted alongside the collection and extended by a background task per collection, which indexes
+    the rows added since it last ran a chunk at a time on a worker thread. Rows are inserted in batches with numpy, some
+    hundreds of rows per second for 1536 dimension embeddings (more with fewer dimensions), so indexing a collection of
+    millions of rows takes hours. Collections of tens of millions of rows are better served by a dedicated vector
+    database, such as chroma. Rows the indexer has not reached yet are searched exactly, so they are found as soon as
+    they are added. Deleted rows stay in the graph, masked out of results, until the collection is compacted, which
+    drops them from the graph and renumbers the rest rather than rebuilding it. Metadata filters are applied while
+    traversing the graph, and filters matching few rows are searched exactly.
+    """
+
+    spec: HnswVectorStoreSpec
+
+    def __init__(self, spec: HnswVectorStoreSpec):
+        super().__init__(spec)
+        self.spec = spec
+        self._indexers: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+
+    def _params(self, collection: str) -> HnswParams:
+        return self.spec.collections.get(collection, self.spec.index)
+
+    def _new_collection(self, name: str) -> _HnswCollection:
+        return _HnswCollection(
+            self.root_dir / name,
+            self._params(name),
+            self.spec.checkpoint_rows,
+            self.spec.quantization,
+            self.spec.indexed_metadata,
+        )
+
+    async def start(self):
+        self._stopping = False
+        await super().start()
+
+    async def stop(self):
+        # indexers finish the chunk they are on, the rows after it are indexed again when the collection is loaded
+        self._stopping = True
+        await super().stop()
+        await asyncio.gather(*self._indexers.values())
+        for collection in self._collections.values():
+            await make_async(collection.checkpoint)()
+
+    async def _get_collection(self, name: str) -> _HnswCollection:
+        collection = await super()._get_collection(name)
+        self._schedule_indexing(collection)
+        return collection
+
+    async def add_embedding(self, collection: str, docs: List[EmbeddedDocument], **add_kwargs: Any):
+        await super().add_embedding(collection, docs, **add_kwargs)
+        if docs:
+            self._schedule_indexing(await self._get_collection(collection))
+
+    async def _compact(self, collection: _HnswCollection):
+        await super()._compact(collection)
+        self._schedule_indexing(collection)
+
+    def _schedule_indexing(self, collection: _HnswCollection):
+        name = collection.directory.name
+        task = self._indexers.get(name)
+        if not self._stopping and collection.unindexed() and (task is None or task.done()):
+            self._indexers[name] = asyncio.create_task(self._index(collection))
+
+    async def _index(self, collection: _HnswCollection):
+        # checked on the event loop, so rows added while a chunk is indexed are not missed by a finishing indexer
+        while not self._stopping and collection.unindexed():
+            try:
+                await make_async(collection.index_rows)(_INDEX_CHUNK_ROWS)
+            except Exception:
+                logger.exception(f"Failed to index {collection.directory}")
+                return
+
+    async def query_embedding(
+        self,
+        collection: str,
+        query: List[float],
+        num_results: int,
+        metadata_where: Optional[Dict[str, Any]] = None,
+        include_embeddings: bool = False,
+        ef_search: Optional[int] = None,
+    ) -> List[QueryItem]:
+        c = await self._get_collection(collection)
+        return await make_async(c.query)(
+            query, num_results, metadata_where, include_embeddings, ef_search, self.spec.exact_search_limit
+        )
+
+    async def query_embedding_batch(
+        self,
+        collection: str,
+        queries: List[List[float]],
+        num_results: int,
+        metadata_where: Optional[Dict[str, Any]] = None,
+        include_embeddings: bool = False,
+        ef_search: Optional[int] = None,
+    ) -> List[List[QueryItem]]:
+        c = await self._get_collection(collection)
+        return await make_async(c.query_batch)(
+            queries, num_results, metadata_where, include_embeddings, ef_search, self.spec.exact_search_limit
+        )
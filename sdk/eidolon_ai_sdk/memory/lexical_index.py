@@ -0,0 +1,372 @@
+import asyncio
+import json
+import math
+import re
+import struct
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from eidolon_ai_client.util.logger import logger
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.document import Document
+from eidolon_ai_sdk.memory.metadata_index import matches
+
+# a term's postings: the sorted numbers of the documents it occurs in, and how often it occurs in each
+Postings = Tuple[np.ndarray, np.ndarray]
+
+_words = re.compile(r"\w+")
+_camel_case = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower cased words. Identifiers are also split into their snake_case and camelCase parts, so `parseHttpRequest`
+    matches searches for both `parsehttprequest` and `http`.
+    """
+    tokens = []
+    for word in _words.findall(text):
+        tokens.append(word.lower())
+        parts = [p for piece in word.split("_") for p in _camel_case.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(p.lower() for p in parts)
+    return tokens
+
+
+class LexicalIndexSpec(BaseModel):
+    directory: str = Field(default="lexical_index", description="The file memory directory postings are stored in.")
+    shards: int = Field(
+        default=64, description="The number of files postings are split into. Updates rewrite the shards they touch."
+    )
+    cached_shards: int = Field(
+        default=64, description="The number of decoded shards kept in memory, so searches do not read them again."
+    )
+    k1: float = Field(default=1.2, description="The BM25 term frequency saturation.")
+    b: float = Field(default=0.75, description="The BM25 document length normalization.")
+
+
+class LexicalIndex:
+    """
+    A BM25 inverted index over the documents of a collection.
+
+    Postings are stored in file memory, split by the hash of their term into shards of compact binary arrays, and the
+    most recently used shards are kept decoded in memory. The vocabulary (each term's document frequency), the table of
+    documents and an array of document lengths are held in memory. Updates are applied in batches: concurrent adds and
+    removes are written together, rewriting each touched shard once.
+
+    The table of documents is stored as a snapshot (docs.json) followed by a log of the changes of each batch since
+    (docs/{batch}.json), which is folded into a new snapshot once it holds more entries than there are documents.
+    Before each search and update, the batches other workers logged since are applied and the cached shards they
+    rewrote are dropped. When the log was folded past the last batch applied, the index is loaded again.
+    """
+
+    def __init__(self, name: str, spec: LexicalIndexSpec):
+        self.spec = spec
+        self.directory = f"{spec.directory}/{name}"
+        # document number -> (document id, length in tokens, shards holding its postings, metadata)
+        self.docs: Dict[int, Tuple[str, int, List[int], dict]] = {}
+        self.numbers: Dict[str, int] = {}
+        self.vocabulary: Dict[str, int] = {}
+        self.next_number = 0
+        self.total_length = 0
+        # the length of each document by number, 0 for removed documents
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self._shards: OrderedDict[int, Dict[str, Postings]] = OrderedDict()
+        # the last batch written to the log, and the entries logged since the snapshot
+        self._batch = 0
+        self._logged = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._pending: List[Tuple[Sequence[Document], Sequence[str]]] = []
+
+    def _shard(self, term: str) -> int:
+        return zlib.crc32(term.encode()) % self.spec.shards
+
+    def _shard_path(self, shard: int) -> str:
+        return f"{self.directory}/postings/{shard}"
+
+    async def _load(self):
+        if self._loaded:
+            touched = await self._replay()
+            if touched is not None:
+                await self._refresh_shards(touched)
+                return
+            # the log was folded into a newer snapshot by another worker
+            self._reset()
+        file_memory = AgentOS.file_memory
+        await file_memory.mkdir(f"{self.directory}/postings", exist_ok=True)
+        await file_memory.mkdir(f"{self.directory}/docs", exist_ok=True)
+        while True:
+            if await file_memory.exists(f"{self.directory}/docs.json"):
+                state = json.loads(await file_memory.read_file(f"{self.directory}/docs.json"))
+                self.next_number, self._batch = state["next"], state.get("batch", 0)
+                for number, doc_id, length, shards, *metadata in state["docs"]:
+                    # indexes written before metadata was stored have none
+                    self._add_doc(number, doc_id, length, shards, metadata[0] if metadata else {})
+            if await self._replay() is not None:
+                break
+            self._reset()
+        shards = await asyncio.gather(*(self._read_shard(s) for s in range(self.spec.shards)))
+        for postings in shards:
+            for term, (numbers, _) in postings.items():
+                self.vocabulary[term] = len(numbers)
+        self._loaded = True
+
+    def _reset(self):
+        self.docs, self.numbers, self.vocabulary = {}, {}, {}
+        self.next_number = self.total_length = 0
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self._shards = OrderedDict()
+        self._batch = self._logged = 0
+        self._loaded = False
+
+    async def _replay(self) -> Optional[Set[int]]:
+        """
+        Apply the batches logged after the last one applied, such as those of other workers, returning the shards
+        they rewrote. Returns None when the log does not follow on from the last batch applied, because it was folded
+        into a newer snapshot.
+        """
+        paths = await AgentOS.file_memory.glob(f"{self.directory}/docs/*.json")
+        batches = sorted(int(str(path).rsplit("/", 1)[-1][: -len(".json")]) for path in paths)
+        batches = [b for b in batches if b > self._batch]
+        if batches and batches[0] != self._batch + 1:
+            return None
+        touched = set()
+        for batch in batches:
+            try:
+                entries = json.loads(await AgentOS.file_memory.read_file(self._log_path(batch)))
+            except Exception:
+                # deleted once folded into a snapshot
+                return None
+            for entry in entries:
+                if "remove" in entry:
+                    touched.update(self._remove_doc(entry["remove"]) or ())
+                else:
+                    self._add_doc(*entry["add"])
+                    touched.update(entry["add"][3])
+            self._batch, self._logged = batch, self._logged + len(entries)
+        return touched
+
+    async def _refresh_shards(self, shards: Set[int]):
+        """Drop the cached postings of shards rewritten by other workers, and read their terms again."""
+        for shard in shards:
+            self._shards.pop(shard, None)
+        # terms no longer in a shard are left in the vocabulary, searches skip the terms their shards do not hold
+        for postings in await asyncio.gather(*(self._read_shard(s) for s in shards)):
+            for term, (numbers, _) in postings.items():
+                self.vocabulary[term] = len(numbers)
+
+    def _add_doc(self, number: int, doc_id: str, length: int, shards: List[int], metadata: dict):
+        if number >= len(self.lengths):
+            lengths = np.zeros(max(number + 1, 2 * len(self.lengths)), dtype=np.float32)
+            lengths[: len(self.lengths)] = self.lengths
+            self.lengths = lengths
+        self.docs[number] = (doc_id, length, shards, metadata)
+        self.numbers[doc_id] = number
+        self.lengths[number] = length
+        self.total_length += length
+        self.next_number = max(self.next_number, number + 1)
+
+    def _remove_doc(self, number: int) -> Optional[List[int]]:
+        """Remove a document from the table, returning the shards holding its postings."""
+        doc = self.docs.pop(number, None)
+        if doc is None:
+            return None
+        doc_id, length, shards, _ = doc
+        if self.numbers.get(doc_id) == number:
+            del self.numbers[doc_id]
+        self.lengths[number] = 0
+        self.total_length -= length
+        return shards
+
+    def _log_path(self, batch: int) -> str:
+        return f"{self.directory}/docs/{batch}.json"
+
+    async def _read_shard(self, shard: int) -> Dict[str, Postings]:
+        postings = self._shards.get(shard)
+        if postings is not None:
+            self._shards.move_to_end(shard)
+            return postings
+        path = self._shard_path(shard)
+        if not await AgentOS.file_memory.exists(path):
+            return {}
+        try:
+            postings = _decode(await AgentOS.file_memory.read_file(path))
+        except Exception:
+            logger.warning(f"unable to read {path}, its terms will not be found", exc_info=True)
+            return {}
+        self._cache_shard(shard, postings)
+        return postings
+
+    def _cache_shard(self, shard: int, postings: Dict[str, Postings]):
+        if self.spec.cached_shards <= 0:
+            return
+        self._shards[shard] = postings
+        self._shards.move_to_end(shard)
+        while len(self._shards) > self.spec.cached_shards:
+            self._shards.popitem(last=False)
+
+    async def add(self, docs: Sequence[Document]):
+        """Index documents, replacing documents with the same ids."""
+        await self._update(docs, [])
+
+    async def remove(self, doc_ids: Sequence[str]):
+        await self._update([], doc_ids)
+
+    async def _update(self, docs: Sequence[Document], doc_ids: Sequence[str]):
+        self._pending.append((docs, doc_ids))
+        async with self._lock:
+            await self._load()
+            if not self._pending:
+                # applied along with the updates of an earlier caller
+                return
+            pending, self._pending = self._pending, []
+            await self._apply(pending)
+
+    async def _apply(self, pending: List[Tuple[Sequence[Document], Sequence[str]]]):
+        removed: Dict[int, Set[int]] = defaultdict(set)
+        added: Dict[int, Dict[str, List[Tuple[int, int]]]] = defaultdict(lambda: defaultdict(list))
+        log = []
+
+        def remove(doc_id: str):
+            number = self.numbers.get(doc_id)
+            if number is not None:
+                for shard in self._remove_doc(number):
+                    removed[shard].add(number)
+                log.append(dict(remove=number))
+
+        for docs, doc_ids in pending:
+            for doc_id in doc_ids:
+                remove(doc_id)
+            for doc in docs:
+                remove(doc.id)
+                number = self.next_number
+                tokens = tokenize(doc.page_content)
+                shards = set()
+                for term, count in Counter(tokens).items():
+                    shard = self._shard(term)
+                    added[shard][term].append((number, min(count, 65535)))
+                    shards.add(shard)
+                entry = [number, doc.id, len(tokens), sorted(shards), doc.metadata]
+                self._add_doc(*entry)
+                log.append(dict(add=entry))
+
+        touched = set(removed) | set(added)
+        await asyncio.gather(*(self._rewrite(s, removed.get(s, set()), added.get(s, {})) for s in touched))
+        if not log:
+            return
+        self._batch += 1
+        await AgentOS.file_memory.write_file(self._log_path(self._batch), json.dumps(log).encode())
+        self._logged += len(log)
+        if self._logged > max(len(self.docs), 1024):
+            await self._snapshot()
+
+    async def _snapshot(self):
+        """Fold the log into a new snapshot of the table of documents."""
+        state = dict(
+            next=self.next_number,
+            batch=self._batch,
+            docs=[[number, *doc] for number, doc in self.docs.items()],
+        )
+        await AgentOS.file_memory.write_file(f"{self.directory}/docs.json", json.dumps(state).encode())
+        paths = await AgentOS.file_memory.glob(f"{self.directory}/docs/*.json")
+        batches = [int(str(path).rsplit("/", 1)[-1][: -len(".json")]) for path in paths]
+        # the log of the last batch is kept, so other workers find that the log no longer follows on from theirs
+        await asyncio.gather(*(AgentOS.file_memory.delete_file(self._log_path(b)) for b in batches if b < self._batch))
+        self._logged = 0
+
+    async def _rewrite(self, shard: int, removed: Set[int], added: Dict[str, List[Tuple[int, int]]]):
+        # searches may hold the cached postings, so they are copied rather than changed
+        postings = dict(await self._read_shard(shard))
+        if removed:
+            removed_numbers = np.fromiter(removed, dtype=np.uint32)
+            for term, (numbers, counts) in list(postings.items()):
+                keep = ~np.isin(numbers, removed_numbers)
+                if not keep.all():
+                    postings[term] = (numbers[keep], counts[keep])
+        for term, entries in added.items():
+            new_numbers = np.array([number for number, _ in entries], dtype=np.uint32)
+            new_counts = np.array([count for _, count in entries], dtype=np.uint16)
+            numbers, counts = postings.get(term, (np.zeros(0, np.uint32), np.zeros(0, np.uint16)))
+            # numbers only grow, so appending keeps postings sorted
+            postings[term] = (np.concatenate([numbers, new_numbers]), np.concatenate([counts, new_counts]))
+        for term in list(postings):
+            if len(postings[term][0]):
+                self.vocabulary[term] = len(postings[term][0])
+            else:
+                del postings[term]
+                self.vocabulary.pop(term, None)
+        await AgentOS.file_memory.write_file(self._shard_path(shard), _encode(postings))
+        self._cache_shard(shard, postings)
+
+    async def search(
+        self, query: str, num_results: int, metadata_where: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        The ids and BM25 scores of the best matching documents, best first. Only documents whose metadata matches
+        metadata_where (a chroma style where clause) are returned.
+        """
+        async with self._lock:
+            await self._load()
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t in self.vocabulary]
+        if not terms or not self.docs or num_results <= 0:
+            return []
+        by_shard: Dict[int, List[str]] = defaultdict(list)
+        for term in terms:
+            by_shard[self._shard(term)].append(term)
+        shards = await asyncio.gather(*(self._read_shard(s) for s in by_shard))
+
+        docs, total = len(self.docs), self.next_number
+        lengths = self.lengths[:total]
+        norms = self.spec.k1 * (1 - self.spec.b + self.spec.b * lengths / max(self.total_length / docs, 1))
+        scores = np.zeros(total, dtype=np.float32)
+        for shard_terms, postings in zip(by_shard.values(), shards):
+            for term in shard_terms:
+                if term not in postings:
+                    continue
+                numbers, counts = postings[term]
+                numbers = numbers[numbers < total]
+                counts = counts[: len(numbers)].astype(np.float32)
+                df = len(numbers)
+                idf = math.log(1 + (docs - df + 0.5) / (df + 0.5))
+                scores[numbers] += idf * counts * (self.spec.k1 + 1) / (counts + norms[numbers])
+        matched = np.flatnonzero(scores)
+        top = matched[np.argsort(-scores[matched], kind="stable")]
+        results = []
+        for number in top:
+            doc = self.docs.get(int(number))
+            # postings of documents removed after the shard was read
+            if doc is not None and (not metadata_where or matches(doc[3], metadata_where)):
+                results.append((doc[0], float(scores[number])))
+                if len(results) == num_results:
+                    break
+        return results
+
+
+def _encode(postings: Dict[str, Postings]) -> bytes:
+    terms = sorted(postings)
+    header = json.dumps([[term, len(postings[term][0])] for term in terms]).encode()
+    numbers = _concatenate((postings[term][0] for term in terms), np.uint32)
+    counts = _concatenate((postings[term][1] for term in terms), np.uint16)
+    return struct.pack("<I", len(header)) + header + numbers.astype("<u4").tobytes() + counts.astype("<u2").tobytes()
+
+
+def _decode(data: bytes) -> Dict[str, Postings]:
+    (header_size,) = struct.unpack_from("<I", data)
+    header = json.loads(data[4 : 4 + header_size])
+    total = sum(size for _, size in header)
+    numbers = np.frombuffer(data, dtype="<u4", count=total, offset=4 + header_size)
+    counts = np.frombuffer(data, dtype="<u2", count=total, offset=4 + header_size + 4 * total)
+    postings, start = {}, 0
+    for term, size in header:
+        postings[term] = (numbers[start : start + size], counts[start : start + size])
+        start += size
+    return postings
+
+
+def _concatenate(arrays: Iterable[np.ndarray], dtype) -> np.ndarray:
+    arrays = list(arrays)
+    return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
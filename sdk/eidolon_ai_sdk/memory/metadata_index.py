@@ -0,0 +1,167 @@
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class MetadataIndex:
+    """
+    Posting lists of the rows holding each value of selected metadata keys, so a filter on those keys finds its
+    candidate rows without reading the metadata of every row.
+
+    Equality, $eq, $in and $prefix conditions on indexed keys are answered from postings, combined with $and and $or.
+    Values are keyed by their type as well, so True, 1 and 1.0 are different values, as they are to matches. The rest
+    of a filter is checked against the metadata of the candidates only. Postings only grow: rows deleted
+    after they were indexed stay in them, and callers mask them out.
+    """
+
+    def __init__(self, keys: Sequence[str]):
+        # key -> (type of value, value) -> rows
+        self.postings: Dict[str, Dict[Tuple[type, Any], List[int]]] = {key: {} for key in keys}
+        # the string values of each key in order, for prefix conditions. Dropped when a new value is indexed
+        self._sorted: Dict[str, List[str]] = {}
+
+    def add(self, rows: Iterable[int], metadata: Iterable[dict]):
+        for row, m in zip(rows, metadata):
+            for key, postings in self.postings.items():
+                value = m.get(key)
+                if _hashable(value):
+                    typed = (type(value), value)
+                    if typed not in postings:
+                        postings[typed] = []
+                        self._sorted.pop(key, None)
+                    postings[typed].append(row)
+
+    def values_with_prefix(self, key: str, prefix: str) -> List[str]:
+        values = self._sorted.get(key)
+        if values is None:
+            values = self._sorted[key] = sorted(v for t, v in list(self.postings[key]) if t is str)
+        return with_prefix(values, prefix)
+
+    def plan(self, where: Dict[str, Any]) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
+        """
+        The sorted rows that may match where, and the part of where they must still be checked against. Rows are None
+        when no condition of where is on an indexed key.
+        """
+        rows, rest = self._plan(where)
+        if not rest:
+            return rows, None
+        return rows, rest[0] if len(rest) == 1 else {"$and": rest}
+
+    def _plan(self, where: Dict[str, Any]) -> Tuple[Optional[np.ndarray], List[Dict[str, Any]]]:
+        rows, rest = None, []
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    clause_rows, clause_rest = self._plan(clause)
+                    rows = _intersect(rows, clause_rows)
+                    rest.extend(clause_rest)
+            elif key == "$or":
+                planned = [self._plan(clause) for clause in condition]
+                if planned and all(r is not None and not r_rest for r, r_rest in planned):
+                    rows = _intersect(rows, np.unique(np.concatenate([r for r, _ in planned])))
+                else:
+                    rest.append({key: condition})
+            else:
+                matched = self._rows(key, condition)
+                if matched is None:
+                    rest.append({key: condition})
+                else:
+                    rows = _intersect(rows, matched)
+        return rows, rest
+
+    def _rows(self, key: str, condition: Any) -> Optional[np.ndarray]:
+        postings = self.postings.get(key)
+        if postings is None:
+            return None
+        if isinstance(condition, dict):
+            if len(condition) != 1:
+                return None
+            ((op, operand),) = condition.items()
+            if op == "$eq":
+                values = [operand]
+            elif op == "$in":
+                values = list(operand)
+            elif op == "$prefix":
+                values = self.values_with_prefix(key, operand)
+            else:
+                return None
+        else:
+            values = [condition]
+        typed = [(type(v), v) for v in values if _hashable(v)]
+        found = [np.array(postings[t], dtype=np.int64) for t in typed if t in postings]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return found[0] if len(found) == 1 else np.unique(np.concatenate(found))
+
+
+def with_prefix(values: List[str], prefix: str) -> List[str]:
+    """The values starting with prefix, of sorted values."""
+    start, found = bisect_left(values, prefix), []
+    for value in values[start:]:
+        if not value.startswith(prefix):
+            break
+        found.append(value)
+    return found
+
+
+def _hashable(value: Any) -> bool:
+    return isinstance(value, (str, int, float, bool))
+
+
+def _intersect(rows: Optional[np.ndarray], other: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if rows is None:
+        return other
+    if other is None:
+        return rows
+    return np.intersect1d(rows, other, assume_unique=True)
+
+
+def matches(metadata: dict, where: Dict[str, Any]) -> bool:
+    """
+    Whether metadata matches a chroma style where clause. Supports field equality, $eq, $ne, $gt, $gte, $lt, $lte,
+    $in, $nin and $prefix operators, and combining clauses with $and and $or. Values of different types are not
+    equal, so True, 1 and 1.0 do not match each other.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if not _OPERATORS[op](value, operand):
+                    return False
+        elif not _equal(metadata.get(key), condition):
+            return False
+    return True
+
+
+def _equal(value, operand) -> bool:
+    return type(value) is type(operand) and value == operand
+
+
+def _compare(fn):
+    def compare(value, operand):
+        try:
+            return value is not None and fn(value, operand)
+        except TypeError:
+            return False
+
+    return compare
+
+
+_OPERATORS = {
+    "$eq": _equal,
+    "$ne": lambda value, operand: not _equal(value, operand),
+    "$gt": _compare(lambda value, operand: value > operand),
+    "$gte": _compare(lambda value, operand: value >= operand),
+    "$lt": _compare(lambda value, operand: value < operand),
+    "$lte": _compare(lambda value, operand: value <= operand),
+    "$in": lambda value, operand: any(_equal(value, o) for o in operand),
+    "$nin": lambda value, operand: not any(_equal(value, o) for o in operand),
+    "$prefix": lambda value, operand: isinstance(value, str) and value.startswith(operand),
+}
@@ -0,0 +1,497 @@
+import asyncio
+import json
+import os
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+from pydantic import Field
+
+from eidolon_ai_client.util.logger import logger
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+from eidolon_ai_sdk.memory.file_system_vector_store import FileSystemVectorStore, FileSystemVectorStoreSpec
+from eidolon_ai_sdk.memory.metadata_index import MetadataIndex, matches
+from eidolon_ai_sdk.memory.quantization import Codec, QuantizationSpec, load_codec, new_codec
+from eidolon_ai_sdk.memory.vector_store import QueryItem
+from eidolon_ai_sdk.system.reference_model import Specable
+from eidolon_ai_sdk.util.async_wrapper import make_async
+from eidolon_ai_sdk.util.str_utils import replace_env_var_in_string
+
+
+# filters matching less than this fraction of the rows of a collection score only the rows they match
+_GATHER_FRACTION = 0.25
+
+
+class NumpyVectorStoreSpec(FileSystemVectorStoreSpec):
+    root_dir: str = Field(
+        default="/tmp/eidolon/numpy_vector_store", description="The directory collections are stored in."
+    )
+    compaction_threshold: float = Field(
+        default=0.25,
+        description="The fraction of deleted rows in a collection that triggers a compaction in the background.",
+    )
+    quantization: Optional[QuantizationSpec] = Field(
+        default=None,
+        description="Search compressed copies of the embeddings held in memory, rather than the full precision "
+        "embeddings on disk.",
+    )
+
+
+class CollectionSnapshot(NamedTuple):
+    matrix: np.ndarray
+    live: np.ndarray
+    ids: List[str]
+    metadata: List[dict]
+    # the row of each live id
+    rows: Dict[str, int]
+    generation: int = 0
+    codes: Optional[np.ndarray] = None
+    index: Optional[MetadataIndex] = None
+
+
+class NumpyCollection:
+    """
+    One collection, stored as a segment of two files named after the segment's generation:
+
+    - {generation}.vectors: the normalized embeddings as a row major float32 matrix, memory mapped when loaded.
+    - {generation}.log: a json line per added row ({"id", "metadata"}) or deleted id ({"delete"}).
+
+    Both files are append only. Deletes leave tombstones that compaction removes by writing the next generation and
+    pointing the CURRENT file at it. Writes replace the snapshot queries read rather than mutating it, so queries do
+    not wait for writes.
+
+    With quantization, a codec is trained (and saved as codec.npz) once the collection is large enough, and the codes
+    of each row are appended to {generation}.codes. Codes are held in memory, so only the vectors of the best
+    candidates of a query are read from disk.
+
+    The rows holding each value of the indexed metadata keys are held in memory too (see MetadataIndex), so filters on
+    those keys only read and score their candidate rows.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        quantization: Optional[QuantizationSpec] = None,
+        indexed_metadata: Sequence[str] = (),
+    ):
+        self.directory = directory
+        self.quantization = quantization
+        self.indexed_metadata = indexed_metadata
+        self.generation = 0
+        self.dimensions: Optional[int] = None
+        self.snapshot = CollectionSnapshot(
+            np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=bool), [], [], {}, index=self._index_metadata([])
+        )
+        self.lock = asyncio.Lock()
+        self.codec: Optional[Codec] = None
+        # codes grow in place past the rows of the current snapshot, and are copied when they outgrow the buffer
+        self._codes = np.zeros((0, 0), dtype=np.uint8)
+
+    @property
+    def size(self) -> int:
+        return len(self.snapshot.live)
+
+    @property
+    def deleted(self) -> int:
+        return self.size - len(self.snapshot.rows)
+
+    def _path(self, suffix: str, generation: Optional[int] = None) -> Path:
+        return self.directory / f"{self.generation if generation is None else generation}.{suffix}"
+
+    def load(self):
+        current = self.directory / "CURRENT"
+        if not current.exists():
+            return
+        state = json.loads(current.read_text())
+        self.generation, self.dimensions = state["generation"], state["dimensions"]
+        ids, metadata, rows = [], [], {}
+        deleted = []
+        with open(self._path("log")) as log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a partially written entry from a crash
+                    logger.warning(f"ignoring corrupt entry in {self._path('log')}")
+                    continue
+                if "delete" in entry:
+                    if entry["delete"] in rows:
+                        deleted.append(rows.pop(entry["delete"]))
+                else:
+                    if entry["id"] in rows:
+                        deleted.append(rows[entry["id"]])
+                    rows[entry["id"]] = len(ids)
+                    ids.append(entry["id"])
+                    metadata.append(entry["metadata"])
+        # vectors are written before the log, so rows without a log entry were never added
+        with open(self._path("vectors"), "r+b") as f:
+            f.truncate(len(ids) * self.dimensions * 4)
+        live = np.ones(len(ids), dtype=bool)
+        live[deleted] = False
+        self.snapshot = CollectionSnapshot(
+            self._map(len(ids)), live, ids, metadata, rows, self.generation, index=self._index_metadata(metadata)
+        )
+        if self.quantization:
+            self._load_codes()
+
+    def _index_metadata(self, metadata: List[dict]) -> Optional[MetadataIndex]:
+        if not self.indexed_metadata:
+            return None
+        index = MetadataIndex(self.indexed_metadata)
+        index.add(range(len(metadata)), metadata)
+        return index
+
+    def _load_codes(self):
+        codec_path = self.directory / "codec.npz"
+        if not codec_path.exists():
+            self._maybe_train()
+            return
+        with open(codec_path, "rb") as f:
+            self.codec = load_codec(dict(np.load(f)))
+        codes_path = self._path("codes")
+        codes = np.fromfile(codes_path, dtype=np.uint8) if codes_path.exists() else np.zeros(0, dtype=np.uint8)
+        rows = min(len(codes) // self.codec.code_size, self.size)
+        # codes are written after the log, rows added without their codes are encoded again
+        if codes_path.exists():
+            os.truncate(codes_path, rows * self.codec.code_size)
+        else:
+            codes_path.touch()
+        self._codes = codes[: rows * self.codec.code_size].reshape(rows, self.codec.code_size)
+        self._encode_rows(self.snapshot.matrix, rows, self.size)
+        self.snapshot = self.snapshot._replace(codes=self._codes[: self.size])
+
+    def _maybe_train(self):
+        matrix, live = self.snapshot.matrix, self.snapshot.live
+        if self.codec or self.dimensions is None or np.count_nonzero(live) < self.quantization.train_rows:
+            return
+        rng = np.random.default_rng(0)
+        sample = rng.choice(np.flatnonzero(live), self.quantization.train_rows, replace=False)
+        codec = new_codec(self.quantization, self.dimensions)
+        codec.train(np.asarray(matrix[np.sort(sample)]))
+        tmp = self.directory / "codec.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **codec.state())
+        os.replace(tmp, self.directory / "codec.npz")
+        self.codec = codec
+        self._codes = np.zeros((0, codec.code_size), dtype=np.uint8)
+        self._path("codes").write_bytes(b"")
+        self._encode_rows(matrix, 0, self.size)
+        self.snapshot = self.snapshot._replace(codes=self._codes[: self.size])
+
+    def _encode_rows(self, matrix: np.ndarray, start: int, stop: int):
+        """Encode and store the codes of rows from start to stop, the codes of earlier rows must already be stored."""
+        if start >= stop:
+            return
+        if len(self._codes) < stop:
+            codes = np.zeros((max(stop, 2 * len(self._codes)), self.codec.code_size), dtype=np.uint8)
+            codes[:start] = self._codes[:start]
+            self._codes = codes
+        with open(self._path("codes"), "ab") as f:
+            for chunk in range(start, stop, 1 << 16):
+                end = min(chunk + (1 << 16), stop)
+                self._codes[chunk:end] = self.codec.encode(np.asarray(matrix[chunk:end]))
+                f.write(self._codes[chunk:end].tobytes())
+
+    def _map(self, rows: int) -> np.ndarray:
+        if not rows:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.memmap(self._path("vectors"), dtype=np.float32, mode="r", shape=(rows, self.dimensions))
+
+    def append(self, docs: List[EmbeddedDocument]):
+        embeddings = np.asarray([doc.embedding for doc in docs], dtype=np.float32)
+        if self.dimensions is None:
+            self.dimensions = embeddings.shape[1]
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._path("vectors").touch()
+            self._path("log").touch()
+            self._write_current()
+        if embeddings.shape[1] != self.dimensions:
+            raise ValueError(f"Expected embeddings with {self.dimensions} dimensions, got {embeddings.shape[1]}")
+        with open(self._path("vectors"), "ab") as f:
+            f.write(normalize(embeddings).tobytes())
+        with open(self._path("log"), "a") as f:
+            f.writelines(json.dumps(dict(id=doc.id, metadata=doc.metadata)) + "\n" for doc in docs)
+
+        start = self.size
+        # the last of several documents with the same id wins, as it would when added one at a time
+        last = {doc.id: i for i, doc in enumerate(docs)}
+        rows = self.snapshot.rows
+        replaced = [rows[doc_id] for doc_id in last if doc_id in rows]
+        live = np.concatenate([self.snapshot.live, [last[doc.id] == i for i, doc in enumerate(docs)]])
+        live[replaced] = False
+        # ids and metadata only grow, snapshots read no further than their live rows. They grow before rows are
+        # pointed at them, as get_metadata reads rows without the lock
+        self.snapshot.ids.extend(doc.id for doc in docs)
+        self.snapshot.metadata.extend(doc.metadata for doc in docs)
+        rows.update((doc_id, start + i) for doc_id, i in last.items())
+        if self.snapshot.index:
+            self.snapshot.index.add(range(start, start + len(docs)), (doc.metadata for doc in docs))
+        matrix = self._map(len(live))
+        if self.codec:
+            self._encode_rows(matrix, start, len(live))
+        codes = self._codes[: len(live)] if self.codec else None
+        self.snapshot = self.snapshot._replace(matrix=matrix, live=live, codes=codes)
+        if self.quantization and not self.codec:
+            self._maybe_train()
+
+    def delete(self, doc_ids: List[str]):
+        rows = self.snapshot.rows
+        doc_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id in rows]
+        if not doc_ids:
+            return
+        with open(self._path("log"), "a") as f:
+            f.writelines(json.dumps(dict(delete=doc_id)) + "\n" for doc_id in doc_ids)
+        live = self.snapshot.live.copy()
+        live[[rows.pop(doc_id) for doc_id in doc_ids]] = False
+        self.snapshot = self.snapshot._replace(live=live)
+
+    def compact(self):
+        matrix, live, ids, metadata, _, _, codes, _ = self.snapshot
+        rows = np.flatnonzero(live)
+        old_generation, generation = self.generation, self.generation + 1
+        with open(self._path("vectors", generation), "wb") as f:
+            f.write(np.ascontiguousarray(matrix[rows]).tobytes())
+        with open(self._path("log", generation), "w") as f:
+            f.writelines(json.dumps(dict(id=ids[r], metadata=metadata[r])) + "\n" for r in rows)
+        if codes is not None:
+            codes = self._codes = codes[rows]
+            self._path("codes", generation).write_bytes(codes.tobytes())
+        self.generation = generation
+        self._write_current()
+        ids, metadata = [ids[r] for r in rows], [metadata[r] for r in rows]
+        self.snapshot = CollectionSnapshot(
+            self._map(len(ids)),
+            np.ones(len(ids), dtype=bool),
+            ids,
+            metadata,
+            {doc_id: i for i, doc_id in enumerate(ids)},
+            generation,
+            codes,
+            self._index_metadata(metadata),
+        )
+        for suffix in ("vectors", "log", "codes"):
+            # queries may still hold the old mapping, which stays readable once the file is unlinked
+            self._path(suffix, old_generation).unlink(missing_ok=True)
+
+    def _write_current(self):
+        tmp = self.directory / "CURRENT.tmp"
+        tmp.write_text(json.dumps(dict(generation=self.generation, dimensions=self.dimensions)))
+        os.replace(tmp, self.directory / "CURRENT")
+
+    def get_metadata(self, doc_id: str) -> Optional[dict]:
+        # rows and metadata of one snapshot, a compaction replaces both together
+        snapshot = self.snapshot
+        row = snapshot.rows.get(doc_id)
+        return None if row is None else snapshot.metadata[row]
+
+    def query(
+        self, query: List[float], num_results: int, where: Optional[Dict[str, Any]], include_embeddings: bool
+    ) -> List[QueryItem]:
+        snapshot = self.snapshot
+        if not len(snapshot.live) or num_results <= 0:
+            return []
+        query = normalize(np.asarray([query], dtype=np.float32))[0]
+        mask = self._mask(snapshot, where)
+        allowed = int(np.count_nonzero(mask))
+        k = min(num_results, allowed)
+        if not k:
+            return []
+        if snapshot.codes is not None:
+            return self._quantized_query(snapshot, query, mask, allowed, k, include_embeddings)
+        if allowed < len(mask) * _GATHER_FRACTION:
+            rows = np.flatnonzero(mask)
+            similarities = snapshot.matrix[rows] @ query
+            top = np.argpartition(-similarities, k - 1)[:k]
+            return self._results(snapshot, rows[top], similarities[top], include_embeddings)
+        # scoring every row is cheaper than gathering the live rows into a new matrix
+        scores = np.where(mask, snapshot.matrix @ query, -np.inf)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return self._results(snapshot, top, scores[top], include_embeddings)
+
+    def query_batch(
+        self, queries: List[List[float]], num_results: int, where: Optional[Dict[str, Any]], include_embeddings: bool
+    ) -> List[List[QueryItem]]:
+        snapshot = self.snapshot
+        if not len(snapshot.live) or num_results <= 0 or not queries:
+            return [[] for _ in queries]
+        queries = normalize(np.asarray(queries, dtype=np.float32))
+        mask = self._mask(snapshot, where)
+        allowed = int(np.count_nonzero(mask))
+        k = min(num_results, allowed)
+        if not k:
+            return [[] for _ in queries]
+        if snapshot.codes is not None:
+            return [self._quantized_query(snapshot, q, mask, allowed, k, include_embeddings) for q in queries]
+        if allowed < len(mask) * _GATHER_FRACTION:
+            rows = np.flatnonzero(mask)
+            scores = snapshot.matrix[rows] @ queries.T
+        else:
+            # one matrix-matrix product reads the vectors once for all queries
+            rows = np.arange(len(mask))
+            scores = snapshot.matrix @ queries.T
+            scores[~mask] = -np.inf
+        results = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            results.append(self._results(snapshot, rows[top], column[top], include_embeddings))
+        return results
+
+    def _quantized_query(
+        self,
+        snapshot: CollectionSnapshot,
+        query: np.ndarray,
+        mask: np.ndarray,
+        allowed: int,
+        k: int,
+        include_embeddings: bool,
+    ) -> List[QueryItem]:
+        if allowed < len(mask) * _GATHER_FRACTION:
+            rows = np.flatnonzero(mask)
+            scores = self.codec.similarities(snapshot.codes[rows], query)
+        else:
+            rows = np.arange(len(mask))
+            scores = np.where(mask, self.codec.similarities(snapshot.codes, query), -np.inf)
+        candidates = min(allowed, max(k, self.quantization.rescore))
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top, scores = rows[top], scores[top]
+        if self.quantization.rescore:
+            top = np.sort(top)
+            scores = snapshot.matrix[top] @ query
+        best = np.argpartition(-scores, k - 1)[:k]
+        return self._results(snapshot, top[best], scores[best], include_embeddings)
+
+    @staticmethod
+    def _mask(snapshot: CollectionSnapshot, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        if not where:
+            return snapshot.live
+        rows, where = snapshot.index.plan(where) if snapshot.index else (None, where)
+        if rows is None:
+            matching = (matches(m, where) for m in islice(snapshot.metadata, len(snapshot.live)))
+            return snapshot.live & np.fromiter(matching, dtype=bool, count=len(snapshot.live))
+        # postings grow past the rows of the snapshot
+        rows = rows[rows < len(snapshot.live)]
+        rows = rows[snapshot.live[rows]]
+        if where:
+            matching = (matches(snapshot.metadata[r], where) for r in rows)
+            rows = rows[np.fromiter(matching, dtype=bool, count=len(rows))]
+        mask = np.zeros(len(snapshot.live), dtype=bool)
+        mask[rows] = True
+        return mask
+
+    @staticmethod
+    def _results(
+        snapshot: CollectionSnapshot, rows: np.ndarray, similarities: np.ndarray, include_embeddings: bool
+    ) -> List[QueryItem]:
+        order = np.argsort(-similarities, kind="stable")
+        return [
+            QueryItem(
+                id=snapshot.ids[rows[i]],
+                # cosine distance, so lower scores are closer as with other vector stores
+                score=float(1 - similarities[i]),
+                embedding=snapshot.matrix[rows[i]].tolist() if include_embeddings else None,
+                metadata=snapshot.metadata[rows[i]],
+            )
+            for i in order
+        ]
+
+
+class NumpyVectorStore(FileSystemVectorStore, Specable[NumpyVectorStoreSpec]):
+    """
+    An in process vector store keeping each collection as a memory mapped float32 matrix.
+
+    Queries are exact, scoring every live row of the collection with one matrix-vector product. Restarting maps the
+    existing files rather than loading them. Collections are only read when first used, so each worker should have a
+    store of its own.
+    """
+
+    process_local = True
+    spec: NumpyVectorStoreSpec
+    _collections: Dict[str, NumpyCollection]
+
+    def __init__(self, spec: NumpyVectorStoreSpec):
+        super().__init__(spec)
+        self.spec = spec
+        self.root_dir = Path(replace_env_var_in_string(spec.root_dir)).resolve()
+        self._collections = {}
+        self._compactions: Set[asyncio.Task] = set()
+
+    async def start(self):
+        await super().start()
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+
+    async def stop(self):
+        await super().stop()
+        if self._compactions:
+            await asyncio.wait(self._compactions)
+
+    async def _get_collection(self, name: str) -> NumpyCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._new_collection(name)
+            await make_async(collection.load)()
+            collection = self._collections.setdefault(name, collection)
+        return collection
+
+    def _new_collection(self, name: str) -> NumpyCollection:
+        return NumpyCollection(self.root_dir / name, self.spec.quantization, self.spec.indexed_metadata)
+
+    async def add_embedding(self, collection: str, docs: List[EmbeddedDocument], **add_kwargs: Any):
+        if not docs:
+            return
+        c = await self._get_collection(collection)
+        async with c.lock:
+            await make_async(c.append)(docs)
+        self._maybe_compact(c)
+
+    async def delete_embedding(self, collection: str, doc_ids: List[str], **delete_kwargs: Any):
+        c = await self._get_collection(collection)
+        async with c.lock:
+            await make_async(c.delete)(doc_ids)
+        self._maybe_compact(c)
+
+    async def get_metadata(self, collection: str, doc_ids: List[str]):
+        c = await self._get_collection(collection)
+        return [c.get_metadata(doc_id) for doc_id in doc_ids]
+
+    async def query_embedding(
+        self,
+        collection: str,
+        query: List[float],
+        num_results: int,
+        metadata_where: Optional[Dict[str, Any]] = None,
+        include_embeddings: bool = False,
+    ) -> List[QueryItem]:
+        c = await self._get_collection(collection)
+        return await make_async(c.query)(query, num_results, metadata_where, include_embeddings)
+
+    async def query_embedding_batch(
+        self,
+        collection: str,
+        queries: List[List[float]],
+        num_results: int,
+        metadata_where: Optional[Dict[str, Any]] = None,
+        include_embeddings: bool = False,
+    ) -> List[List[QueryItem]]:
+        c = await self._get_collection(collection)
+        return await make_async(c.query_batch)(queries, num_results, metadata_where, include_embeddings)
+
+    def _maybe_compact(self, collection: NumpyCollection):
+        if collection.size and collection.deleted / collection.size >= self.spec.compaction_threshold:
+            if not collection.lock.locked():
+                task = asyncio.create_task(self._compact(collection))
+                self._compactions.add(task)
+                task.add_done_callback(self._compactions.discard)
+
+    async def _compact(self, collection: NumpyCollection):
+        async with collection.lock:
+            if collection.deleted:
+                try:
+                    await make_async(collection.compact)()
+                except Exception:
+                    logger.exception(f"Failed to compact {collection.directory}")
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import os
+import threading
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Set, Tuple
+
+from pydantic import BaseModel, Field
+
+from eidolon_ai_client.util.logger import logger
+from eidolon_ai_sdk.memory.document import Document
+from eidolon_ai_sdk.util.async_wrapper import make_async
+from eidolon_ai_sdk.util.str_utils import replace_env_var_in_string
+
+# reads of entries closer than this in a segment are merged into a single pread
+_MAX_READ_GAP = 4096
+
+
+class PackedTextSpec(BaseModel):
+    root_dir: str = Field(
+        default="/tmp/eidolon/packed_text", description="The local directory the text of collections is stored in."
+    )
+    segment_bytes: int = Field(
+        default=64 * 1024 * 1024, description="The size a segment file grows to before a new segment is started."
+    )
+    compaction_threshold: float = Field(
+        default=0.5,
+        description="The fraction of deleted or replaced bytes in a collection that triggers a compaction in the "
+        "background.",
+    )
+
+
+# (segment, offset, length) of the utf-8 text of a document
+Location = Tuple[int, int, int]
+
+
+class _SegmentFiles:
+    """The segment files reads have opened, closed once they are replaced and the reads using them are done."""
+
+    def __init__(self):
+        self.files: Dict[int, BinaryIO] = {}
+        self.readers = 0
+        self.retired = False
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class PackedTextCollection:
+    """
+    The text of one collection, packed into append only segment files ({segment}.text) with an index.log holding a
+    json line per added ({"id", "segment", "offset", "length"}) or deleted ({"delete"}) document.
+
+    The index is held in memory, and the text of many documents is read with a pread per run of nearby entries.
+    Deletes leave tombstones that compaction removes by copying the live text into new segments and replacing the
+    index. Writes and compactions replace the index and open files reads use rather than mutating them, and the files
+    a compaction replaces are closed once the reads using them are done.
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index: Dict[str, Location] = {}
+        self.files = _SegmentFiles()
+        # guards files, which reads running on several threads share, and replacing it along with the index
+        self._files_lock = threading.Lock()
+        self.active = 0
+        self._active_size = 0
+        self.total_bytes = 0
+        self.dead_bytes = 0
+        self.lock = asyncio.Lock()
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment}.text"
+
+    def _open(self, files: _SegmentFiles, segment: int) -> BinaryIO:
+        with self._files_lock:
+            if segment not in files.files:
+                files.files[segment] = open(self._segment_path(segment), "rb")
+            return files.files[segment]
+
+    def load(self):
+        log_path = self.directory / "index.log"
+        if not log_path.exists():
+            return
+        index, total = {}, 0
+        with open(log_path) as log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a partially written entry from a crash
+                    logger.warning(f"ignoring corrupt entry in {log_path}")
+                    continue
+                if "delete" in entry:
+                    index.pop(entry["delete"], None)
+                else:
+                    index[entry["id"]] = (entry["segment"], entry["offset"], entry["length"])
+                    total += entry["length"]
+        segments = {location[0] for location in index.values()}
+        for path in self.directory.glob("*.text"):
+            # text is written before the index, segments without an index entry were never added (or compacted away)
+            if int(path.stem) not in segments:
+                path.unlink()
+        self.index = index
+        self.active = max(segments, default=0)
+        self.total_bytes = total
+        self.dead_bytes = total - sum(length for _, _, length in index.values())
+        active_path = self._segment_path(self.active)
+        self._active_size = active_path.stat().st_size if active_path.exists() else 0
+
+    def append(self, docs: Sequence[Document]):
+        if not docs:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries, chunk = [], []
+        for doc in docs:
+            text = doc.page_content.encode()
+            if self._active_size and self._active_size + len(text) > self.segment_bytes:
+                chunk = self._roll(chunk)
+            entries.append((doc.id, (self.active, self._active_size, len(text))))
+            chunk.append(text)
+            self._active_size += len(text)
+        self._write_segment(chunk)
+        with open(self.directory / "index.log", "a") as f:
+            f.writelines(
+                json.dumps(dict(id=doc_id, segment=s, offset=o, length=n)) + "\n" for doc_id, (s, o, n) in entries
+            )
+        index = dict(self.index)
+        for doc_id, location in entries:
+            replaced = index.get(doc_id)
+            if replaced:
+                self.dead_bytes += replaced[2]
+            index[doc_id] = location
+            self.total_bytes += location[2]
+        self.index = index
+
+    def _write_segment(self, chunk: List[bytes]):
+        with open(self._segment_path(self.active), "ab") as f:
+            f.write(b"".join(chunk))
+
+    def _roll(self, chunk: List[bytes]) -> List[bytes]:
+        """Write chunk to the active segment and start the next one."""
+        if chunk:
+            self._write_segment(chunk)
+        self.active += 1
+        self._active_size = 0
+        return []
+
+    def delete(self, doc_ids: List[str]):
+        doc_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id in self.index]
+        if not doc_ids:
+            return
+        with open(self.directory / "index.log", "a") as f:
+            f.writelines(json.dumps(dict(delete=doc_id)) + "\n" for doc_id in doc_ids)
+        index = dict(self.index)
+        for doc_id in doc_ids:
+            self.dead_bytes += index.pop(doc_id)[2]
+        self.index = index
+
+    def read(self, doc_ids: List[str]) -> List[Optional[str]]:
+        """The text of each document, or None for unknown ids."""
+        with self._files_lock:
+            index, files = self.index, self.files
+            files.readers += 1
+        try:
+            locations = sorted((location, i) for i, location in enumerate(map(index.get, doc_ids)) if location)
+            results: List[Optional[str]] = [None] * len(doc_ids)
+            run: List[Tuple[Location, int]] = []
+            for location, i in locations:
+                if run and (location[0] != run[0][0][0] or location[1] > _end(run[-1][0]) + _MAX_READ_GAP):
+                    self._read_run(files, run, results)
+                    run = []
+                run.append((location, i))
+            if run:
+                self._read_run(files, run, results)
+            return results
+        finally:
+            with self._files_lock:
+                files.readers -= 1
+                close = files.retired and not files.readers
+            if close:
+                files.close()
+
+    def _read_run(self, files: _SegmentFiles, run: List[Tuple[Location, int]], results: List[Optional[str]]):
+        segment, start, _ = run[0][0]
+        data = os.pread(self._open(files, segment).fileno(), _end(run[-1][0]) - start, start)
+        for (_, offset, length), i in run:
+            results[i] = data[offset - start : offset - start + length].decode()
+
+    def compact(self):
+        live = sorted(self.index.items(), key=lambda item: item[1])
+        first = self.active + 1
+        self.active, self._active_size = first, 0
+        compacted: Dict[str, Location] = {}
+        chunk = []
+        for start in range(0, len(live), 1024):
+            batch = live[start : start + 1024]
+            texts = self.read([doc_id for doc_id, _ in batch])
+            for (doc_id, _), text in zip(batch, texts):
+                data = text.encode()
+                if self._active_size and self._active_size + len(data) > self.segment_bytes:
+                    chunk = self._roll(chunk)
+                compacted[doc_id] = (self.active, self._active_size, len(data))
+                chunk.append(data)
+                self._active_size += len(data)
+        self._write_segment(chunk)
+        tmp = self.directory / "index.tmp"
+        with open(tmp, "w") as f:
+            f.writelines(
+                json.dumps(dict(id=doc_id, segment=s, offset=o, length=n)) + "\n"
+                for doc_id, (s, o, n) in compacted.items()
+            )
+        os.replace(tmp, self.directory / "index.log")
+        with self._files_lock:
+            retired, self.index, self.files = self.files, compacted, _SegmentFiles()
+            retired.retired = True
+            close = not retired.readers
+        if close:
+            retired.close()
+        self.total_bytes, self.dead_bytes = sum(length for _, _, length in compacted.values()), 0
+        for segment in range(first):
+            # reads may still hold the old files, which stay readable once unlinked
+            self._segment_path(segment).unlink(missing_ok=True)
+
+
+def _end(location: Location) -> int:
+    return location[1] + location[2]
+
+
+class PackedTextStore:
+    """The packed text of the collections of a vector store, see PackedTextCollection."""
+
+    def __init__(self, spec: PackedTextSpec):
+        self.spec = spec
+        self.root_dir = Path(replace_env_var_in_string(spec.root_dir)).resolve()
+        self._collections: Dict[str, PackedTextCollection] = {}
+        self._compactions: Set[asyncio.Task] = set()
+
+    async def stop(self):
+        if self._compactions:
+            await asyncio.wait(self._compactions)
+
+    async def _get_collection(self, name: str) -> PackedTextCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = PackedTextCollection(self.root_dir / name, self.spec.segment_bytes)
+            await make_async(collection.load)()
+            collection = self._collections.setdefault(name, collection)
+        return collection
+
+    async def add(self, collection: str, docs: Sequence[Document]):
+        c = await self._get_collection(collection)
+        async with c.lock:
+            await make_async(c.append)(docs)
+        self._maybe_compact(c)
+
+    async def delete(self, collection: str, doc_ids: List[str]):
+        c = await self._get_collection(collection)
+        async with c.lock:
+            await make_async(c.delete)(doc_ids)
+        self._maybe_compact(c)
+
+    async def read(self, collection: str, doc_ids: List[str]) -> List[Optional[str]]:
+        c = await self._get_collection(collection)
+        return await make_async(c.read)(doc_ids)
+
+    def _maybe_compact(self, collection: PackedTextCollection):
+        if collection.total_bytes and collection.dead_bytes / collection.total_bytes >= self.spec.compaction_threshold:
+            if not collection.lock.locked():
+                task = asyncio.create_task(self._compact(collection))
+                self._compactions.add(task)
+                task.add_done_callback(self._compactions.discard)
+
+    async def _compact(self, collection: PackedTextCollection):
+        async with collection.lock:
+            if collection.dead_bytes:
+                try:
+                    await make_async(collection.compact)()
+                except Exception:
+                    logger.exception(f"Failed to compact {collection.directory}")
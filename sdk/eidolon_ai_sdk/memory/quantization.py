@@ -0,0 +1,183 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Literal
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+# rows decoded at once when scoring, bounding the temporary memory a query needs
+_CHUNK_ROWS = 1 << 16
+
+
+class QuantizationSpec(BaseModel):
+    codec: Literal["int8", "pq"] = Field(
+        default="int8",
+        description="int8 stores one byte per dimension (4x smaller). pq (product quantization) stores one byte per "
+        "subvector (dimensions * 4 / pq_subvectors times smaller).",
+    )
+    pq_subvectors: int = Field(default=16, description="The number of subvectors embeddings are split into for pq.")
+    train_rows: int = Field(
+        default=10_000,
+        description="The codec is trained once a collection has this many rows, smaller collections are searched "
+        "with full precision vectors.",
+    )
+    rescore: int = Field(
+        default=100,
+        description="The number of best candidates re-scored with the full precision vectors on disk. 0 returns "
+        "approximate scores.",
+    )
+
+
+class Codec(ABC):
+    """
+    Compresses normalized vectors into byte codes, trained on a sample of a collection.
+
+    Queries are not compressed, similarities are computed between the full precision query and the codes (asymmetric
+    distance computation).
+    """
+
+    @abstractmethod
+    def train(self, vectors: np.ndarray):
+        pass
+
+    @abstractmethod
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """The uint8 codes of vectors, one row per vector."""
+
+    @abstractmethod
+    def similarities(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """The approximate dot product of query with the vector of each row of codes."""
+
+    @abstractmethod
+    def state(self) -> Dict[str, np.ndarray]:
+        pass
+
+    @property
+    @abstractmethod
+    def code_size(self) -> int:
+        pass
+
+
+class Int8Codec(Codec):
+    """Scalar quantization of each dimension to 256 levels between its trained minimum and maximum."""
+
+    def __init__(self, dimensions: int):
+        self.low = np.zeros(dimensions, dtype=np.float32)
+        self.scale = np.ones(dimensions, dtype=np.float32)
+
+    @property
+    def code_size(self) -> int:
+        return len(self.low)
+
+    def train(self, vectors: np.ndarray):
+        self.low = vectors.min(axis=0).astype(np.float32)
+        self.scale = np.maximum(vectors.max(axis=0) - self.low, 1e-9).astype(np.float32) / 255
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((vectors - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def similarities(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # (low + code * scale) . query == low . query + code . (scale * query)
+        scaled = (self.scale * query).astype(np.float32)
+        result = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _CHUNK_ROWS):
+            result[start : start + _CHUNK_ROWS] = codes[start : start + _CHUNK_ROWS].astype(np.float32) @ scaled
+        return result + float(self.low @ query)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return dict(low=self.low, scale=self.scale)
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "Int8Codec":
+        codec = cls(len(state["low"]))
+        codec.low, codec.scale = state["low"], state["scale"]
+        return codec
+
+
+class ProductCodec(Codec):
+    """
+    Product quantization: vectors are split into subvectors, and each subvector is stored as the index of the nearest
+    of (up to) 256 centroids trained with k-means for its subspace.
+    """
+
+    def __init__(self, dimensions: int, subvectors: int, iterations: int = 20, seed: int = 0):
+        self.dimensions = dimensions
+        self.subvectors = subvectors
+        # dimensions are zero padded to a multiple of the number of subvectors
+        self.sub_dimensions = -(-dimensions // subvectors)
+        self.centroids = np.zeros((subvectors, 1, self.sub_dimensions), dtype=np.float32)
+        self.iterations = iterations
+        self.seed = seed
+
+    @property
+    def code_size(self) -> int:
+        return self.subvectors
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        padded = np.zeros((len(vectors), self.subvectors * self.sub_dimensions), dtype=np.float32)
+        padded[:, : self.dimensions] = vectors
+        return padded.reshape(len(vectors), self.subvectors, self.sub_dimensions)
+
+    def train(self, vectors: np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        split = self._split(vectors)
+        k = min(256, len(vectors))
+        self.centroids = np.stack([_kmeans(split[:, s], k, self.iterations, rng) for s in range(self.subvectors)])
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        split = self._split(vectors)
+        return np.stack([_nearest(split[:, s], self.centroids[s]) for s in range(self.subvectors)], axis=1).astype(
+            np.uint8
+        )
+
+    def similarities(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # the dot product of each centroid with its part of the query, summed over the codes of each row
+        table = np.einsum("skd,sd->sk", self.centroids, self._split(query[None])[0])
+        result = np.empty(len(codes), dtype=np.float32)
+        subvectors = np.arange(self.subvectors)
+        for start in range(0, len(codes), _CHUNK_ROWS):
+            result[start : start + _CHUNK_ROWS] = table[subvectors, codes[start : start + _CHUNK_ROWS]].sum(axis=1)
+        return result
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return dict(dimensions=np.array(self.dimensions), centroids=self.centroids)
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ProductCodec":
+        centroids = state["centroids"]
+        codec = cls(int(state["dimensions"]), len(centroids))
+        codec.centroids = centroids
+        return codec
+
+
+def new_codec(spec: QuantizationSpec, dimensions: int) -> Codec:
+    if spec.codec == "pq":
+        return ProductCodec(dimensions, min(spec.pq_subvectors, dimensions))
+    return Int8Codec(dimensions)
+
+
+def load_codec(state: Dict[str, np.ndarray]) -> Codec:
+    return ProductCodec.from_state(state) if "centroids" in state else Int8Codec.from_state(state)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin of |v - c|^2 == argmin of |c|^2 - 2 v.c
+    norms = (centroids**2).sum(axis=1)
+    result = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _CHUNK_ROWS):
+        chunk = vectors[start : start + _CHUNK_ROWS]
+        result[start : start + _CHUNK_ROWS] = np.argmin(norms - 2 * chunk @ centroids.T, axis=1)
+    return result
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(vectors, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # restart empty clusters from random vectors
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids.astype(np.float32)
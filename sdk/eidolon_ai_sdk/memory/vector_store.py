@@ -1,8 +1,9 @@
+import asyncio
 from abc import ABC, abstractmethod
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Sequence, AsyncIterable
 
-from eidolon_ai_sdk.memory.document import Document
+from eidolon_ai_sdk.memory.document import Document, EmbeddedDocument
 
 
 class QueryItem(BaseModel):
@@ -13,6 +14,9 @@ class QueryItem(BaseModel):
 
 
 class VectorStore(ABC):
+    # held by the process that wrote it, so other workers do not see its writes (see DocumentSyncScheduler)
+    process_local: bool = False
+
     @abstractmethod
     async def start(self):
         pass
@@ -25,6 +29,13 @@ class VectorStore(ABC):
     async def add(self, collection: str, docs: Sequence[Document]):
         pass
 
+    async def add_embedded(self, collection: str, docs: Sequence[Document], embedded: Sequence[EmbeddedDocument]):
+        """
+        Add documents that were already embedded, with embedded in the order of docs. Stores that take embeddings
+        should override this, by default the documents are embedded again.
+        """
+        await self.add(collection, docs)
+
     @abstractmethod
     async def delete(self, collection: str, doc_ids: List[str]):
         pass
@@ -50,6 +61,24 @@ class VectorStore(ABC):
     ) -> List[QueryItem]:
         pass
 
+    async def raw_query_batch(
+        self,
+        collection: str,
+        queries: List[List[float]],
+        num_results: int,
+        metadata_where: Optional[Dict[str, str]] = None,
+        include_embeddings: bool = False,
+    ) -> List[List[QueryItem]]:
+        """
+        The results of several query embeddings, in order. Stores that can search for many embeddings at once should
+        override this, by default each query is searched for concurrently.
+        """
+        return list(
+            await asyncio.gather(
+                *(self.raw_query(collection, q, num_results, metadata_where, include_embeddings) for q in queries)
+            )
+        )
+
     @abstractmethod
     def get_docs(self, collection: str, doc_ids: List[str]) -> AsyncIterable[Document]:
         pass
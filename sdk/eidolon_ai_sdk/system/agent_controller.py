@@ -13,7 +13,7 @@ from fastapi.params import Body, Param
 from pydantic import BaseModel, Field, create_model
 from pydantic_core import PydanticUndefined, to_jsonable_python
 from sse_starlette import EventSourceResponse, ServerSentEvent
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
 from eidolon_ai_client.events import (
     StartAgentCallEvent,
@@ -26,9 +26,11 @@ from eidolon_ai_client.events import (
     StreamEvent,
     EndStreamEvent,
     ObjectOutputEvent,
+    PartialObjectOutputEvent,
     UserInputEvent,
     CanceledEvent,
 )
+from eidolon_ai_client.util.local_transport import EVENT_SINK
 from eidolon_ai_client.util.logger import logger
 from eidolon_ai_client.util.request_context import RequestContext
 from eidolon_ai_sdk.agent.agent import AgentState
@@ -183,6 +185,7 @@ class AgentController:
                 agent=self.name, record_id=process_id, state="processing", data=dict(action=handler.name)
             )
         RequestContext.set("process_id", process_id)
+        RequestContext.set("agent_name", self.name)
 
         if "process_id" in dict(inspect.signature(handler.fn).parameters):
             kwargs["process_id"] = process_id
@@ -200,7 +203,24 @@ class AgentController:
         except ValueError:
             app_json_idx = -1
 
-        if event_stream_idx != -1 and (app_json_idx == -1 or event_stream_idx < app_json_idx):
+        event_sink = request.scope.get(EVENT_SINK)
+        if event_stream_idx != -1 and event_sink:
+            # an in process caller receives the events as objects. They are copied since stored events are mutated
+            async def to_sink(stream: AsyncIterator[BaseStreamEvent]):
+                try:
+                    async for event in stream:
+                        await event_sink(event.model_copy())
+                except Exception as e:
+                    logger.exception(f"Server Error {e}")
+                    raise e
+                yield b""
+
+            return StreamingResponse(
+                to_sink(self.agent_event_stream(handler, process, last_state, **kwargs)),
+                status_code=202,
+                media_type="text/event-stream",
+            )
+        elif event_stream_idx != -1 and (app_json_idx == -1 or event_stream_idx < app_json_idx):
             # stream the results
             async def with_sse(stream: AsyncIterator[BaseStreamEvent]):
                 try:
@@ -273,7 +293,10 @@ class AgentController:
                 if not ended:
                     ended = event.is_root_end_event()
                     transitioned = event.is_root_and_type(AgentStateEvent)
-                    if (
+                    if isinstance(event, PartialObjectOutputEvent):
+                        # superseded by the final object event, so it is streamed but not stored
+                        pass
+                    elif (
                             isinstance(event, StringOutputEvent)
                             and events_to_store
                             and isinstance(events_to_store[-1], StringOutputEvent)
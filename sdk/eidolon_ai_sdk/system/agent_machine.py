@@ -3,12 +3,17 @@ from fastapi import FastAPI
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
+from eidolon_ai_client.util.local_transport import register_local_machine, unregister_local_machine
+from eidolon_ai_sdk.agent.doc_manager.sync_scheduler import DocumentSyncScheduler, find_document_managers
 from eidolon_ai_sdk.memory.agent_memory import AgentMemory
 from .agent_controller import AgentController
+from .client_registry import ClientRegistry
 from .reference_model import AnnotatedReference, Specable
 from .resources.agent_resource import AgentResource
 from .resources.resources_base import Resource
 from ..agent_os import AgentOS
+from ..cpu.llm.llm_metrics import LLMMetrics
+from ..cpu.llm.llm_scheduler import LLMScheduler
 from ..memory.file_memory import FileMemory
 from ..memory.semantic_memory import SymbolicMemory
 from ..memory.similarity_memory import SimilarityMemory
@@ -20,6 +25,22 @@ class MachineSpec(BaseModel):
     file_memory: AnnotatedReference[FileMemory] = Field(desciption="The File Memory implementation.")
     similarity_memory: AnnotatedReference[SimilarityMemory] = Field(description="The Vector Memory implementation.")
     security_manager: AnnotatedReference[SecurityManager] = Field(description="The Security Manager implementation.")
+    client_registry: AnnotatedReference[ClientRegistry] = Field(
+        description="The registry of pooled api clients shared by all agents on the machine."
+    )
+    llm_scheduler: AnnotatedReference[LLMScheduler] = Field(
+        description="The scheduler rate limiting and retrying llm requests for all agents on the machine."
+    )
+    llm_metrics: AnnotatedReference[LLMMetrics] = Field(
+        description="The histograms of llm call latency and throughput for all agents on the machine."
+    )
+    document_sync_scheduler: AnnotatedReference[DocumentSyncScheduler] = Field(
+        description="The scheduler syncing the documents of all document managers on the machine in the background."
+    )
+    in_process_transport: bool = Field(
+        default=True,
+        description="Dispatch calls between agents on this machine in process rather than over http.",
+    )
 
     def get_agent_memory(self):
         file_memory = self.file_memory.instantiate()
@@ -35,6 +56,10 @@ class MachineSpec(BaseModel):
 class AgentMachine(Specable[MachineSpec]):
     memory: AgentMemory
     security_manager: SecurityManager
+    client_registry: ClientRegistry
+    llm_scheduler: LLMScheduler
+    llm_metrics: LLMMetrics
+    document_sync_scheduler: DocumentSyncScheduler
     agent_controllers: List[AgentController]
     app: Optional[FastAPI]
 
@@ -49,6 +74,13 @@ class AgentMachine(Specable[MachineSpec]):
         self.agent_controllers = [AgentController(name, agent) for name, agent in agents.items()]
         self.app = None
         self.security_manager = self.spec.security_manager.instantiate()
+        self.client_registry = self.spec.client_registry.instantiate()
+        self.llm_scheduler = self.spec.llm_scheduler.instantiate()
+        self.llm_metrics = self.spec.llm_metrics.instantiate()
+        self.document_sync_scheduler = self.spec.document_sync_scheduler.instantiate()
+        for agent in agents.values():
+            for manager in find_document_managers(agent):
+                self.document_sync_scheduler.register(manager)
 
     async def start(self, app):
         if self.app:
@@ -56,13 +88,24 @@ class AgentMachine(Specable[MachineSpec]):
         for program in self.agent_controllers:
             await program.start(app)
         await self.memory.start()
+        await self.client_registry.start()
+        await self.llm_scheduler.start()
+        await self.llm_metrics.start()
+        await self.document_sync_scheduler.start()
         self.app = app
+        if self.spec.in_process_transport:
+            register_local_machine(app, AgentOS.current_machine_url)
 
     async def stop(self):
         if self.app:
+            unregister_local_machine(self.app)
             for program in self.agent_controllers:
                 await program.stop(self.app)
+            await self.document_sync_scheduler.stop()
             await self.memory.stop()
+            await self.llm_metrics.stop()
+            await self.llm_scheduler.stop()
+            await self.client_registry.stop()
             self.app = None
 
 
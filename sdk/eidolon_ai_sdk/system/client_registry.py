@@ -0,0 +1,93 @@
+import json
+from typing import Dict, Optional, Any
+
+import httpx
+from pydantic import BaseModel, Field
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.system.reference_model import Specable, Reference
+from eidolon_ai_client.util.logger import logger
+
+
+class ClientRegistrySpec(BaseModel):
+    max_connections: Optional[int] = Field(
+        default=100, description="The maximum number of concurrent connections per client."
+    )
+    max_keepalive_connections: Optional[int] = Field(
+        default=20, description="The maximum number of idle connections kept alive per client."
+    )
+    keepalive_expiry: Optional[float] = Field(
+        default=30.0, description="The number of seconds an idle connection is kept alive."
+    )
+    http2: bool = Field(default=False, description="Whether to use HTTP/2. Requires the h2 package.")
+    connect_timeout: float = Field(default=5.0, description="The number of seconds to wait for a connection.")
+    read_timeout: float = Field(default=600.0, description="The number of seconds to wait for a response chunk.")
+
+
+class ClientRegistry(Specable[ClientRegistrySpec]):
+    """
+    Machine level registry of long-lived api clients (ie, AsyncOpenAI).
+
+    Clients are keyed by their reference and arguments, so every unit configured with the same client shares one
+    connection pool rather than paying connection and TLS setup on every call. Clients are closed when the machine
+    stops.
+    """
+
+    _clients: Dict[str, Any]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._clients = {}
+
+    def get(self, client_ref: Reference, client_args: Optional[dict] = None, scheduled: bool = False):
+        """
+        Get the pooled client for the reference and arguments. Clients whose requests are retried by the llm
+        scheduler (scheduled) do not retry requests themselves, unless client_args set max_retries.
+        """
+        client_args = _client_args(client_args, scheduled)
+        key = json.dumps([client_ref.model_dump(), client_args], sort_keys=True, default=str)
+        if key not in self._clients:
+            logger.debug(f"Creating pooled client for {client_ref.implementation}")
+            self._clients[key] = client_ref.instantiate(**{"http_client": self._http_client(), **client_args})
+        return self._clients[key]
+
+    def _http_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=self.spec.http2,
+            limits=httpx.Limits(
+                max_connections=self.spec.max_connections,
+                max_keepalive_connections=self.spec.max_keepalive_connections,
+                keepalive_expiry=self.spec.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.spec.read_timeout, connect=self.spec.connect_timeout),
+            follow_redirects=True,
+        )
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            try:
+                await client.close()
+            except Exception:
+                logger.warning("Error closing pooled client", exc_info=True)
+
+
+def _client_args(client_args: Optional[dict], scheduled: bool) -> dict:
+    client_args = client_args or {}
+    if scheduled:
+        # the scheduler already retries, retrying in the client as well would multiply the attempts
+        client_args = {"max_retries": 0, **client_args}
+    return client_args
+
+
+def get_client(client_ref: Reference, client_args: Optional[dict] = None, scheduled: bool = False):
+    """
+    Get a pooled client from the machine's registry. Outside a running machine (ie, replaying a recorded call) the
+    client is instantiated directly and is owned by the caller.
+    """
+    if AgentOS.client_registry is ...:
+        return client_ref.instantiate(**_client_args(client_args, scheduled))
+    return AgentOS.client_registry.get(client_ref, client_args, scheduled)
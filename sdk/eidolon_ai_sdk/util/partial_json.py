@@ -0,0 +1,105 @@
+import copy
+import json
+from typing import Any, List, Optional
+
+_WHITESPACE = " \t\n\r"
+
+
+class PartialJsonParser:
+    """
+    Incrementally parses a streamed json object.
+
+    Text is fed in chunks as it arrives. Values are added to the snapshot as soon as they are complete (strings,
+    numbers and literals are never partially included), so the snapshot only grows and every value in it is final.
+    Anything before the first '{' or '[' and after the root value closes is ignored, which allows parsing objects
+    wrapped in a markdown json section.
+    """
+
+    def __init__(self):
+        self.root: Any = None
+        self.complete = False
+        self._stack: List[Any] = []
+        self._key: Optional[str] = None
+        self._expecting_key = False
+        self._in_string = False
+        self._escaped = False
+        self._buffer: List[str] = []
+        self._literal: List[str] = []
+
+    def feed(self, text: str) -> bool:
+        """
+        Feed the next chunk of text. Returns True if any value completed while parsing the chunk.
+        """
+        changed = False
+        for char in text:
+            if self.complete:
+                break
+            if self._in_string:
+                changed |= self._string_char(char)
+            elif not self._stack:
+                if char in "{[":
+                    self._open({} if char == "{" else [])
+            elif char == '"':
+                self._in_string = True
+                self._buffer = ['"']
+            elif char in "{[":
+                changed |= self._finish_literal()
+                self._open({} if char == "{" else [])
+            elif char in "}]":
+                changed |= self._finish_literal()
+                self._stack.pop()
+                self._expecting_key = False
+                self.complete = not self._stack
+                changed = True
+            elif char == ",":
+                changed |= self._finish_literal()
+                self._expecting_key = isinstance(self._stack[-1], dict)
+            elif char == ":":
+                self._expecting_key = False
+            elif char in _WHITESPACE:
+                changed |= self._finish_literal()
+            else:
+                self._literal.append(char)
+        return changed
+
+    def snapshot(self) -> Any:
+        return copy.deepcopy(self.root)
+
+    def _string_char(self, char: str) -> bool:
+        self._buffer.append(char)
+        if self._escaped:
+            self._escaped = False
+        elif char == "\\":
+            self._escaped = True
+        elif char == '"':
+            self._in_string = False
+            value = json.loads("".join(self._buffer))
+            if self._expecting_key:
+                self._key = value
+                return False
+            self._add(value)
+            return True
+        return False
+
+    def _finish_literal(self) -> bool:
+        if not self._literal:
+            return False
+        value = json.loads("".join(self._literal))
+        self._literal = []
+        self._add(value)
+        return True
+
+    def _open(self, container):
+        if self._stack:
+            self._add(container)
+        else:
+            self.root = container
+        self._stack.append(container)
+        self._expecting_key = isinstance(container, dict)
+
+    def _add(self, value):
+        parent = self._stack[-1]
+        if isinstance(parent, dict):
+            parent[self._key] = value
+        else:
+            parent.append(value)
@@ -0,0 +1,93 @@
+import asyncio
+from contextlib import aclosing
+from typing import Dict, Hashable, List, Optional, Callable, AsyncIterator, Awaitable, TypeVar, Generic
+
+from eidolon_ai_client.util.logger import logger
+
+T = TypeVar("T")
+
+
+class _Flight(Generic[T]):
+    def __init__(self):
+        self.items: List[T] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls so they share one upstream call.
+
+    The first caller for a key starts the call in a background task, later callers with the same key subscribe to it
+    while it is in flight and receive every streamed item (including those produced before they joined). The upstream
+    call is only cancelled once every subscriber has cancelled or stopped consuming.
+    """
+
+    _flights: Dict[Hashable, _Flight]
+
+    def __init__(self):
+        self._flights = {}
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(key, flight, fn))
+        else:
+            logger.debug("coalescing identical in flight request")
+        flight.waiters += 1
+        try:
+            i = 0
+            while True:
+                if i < len(flight.items):
+                    yield flight.items[i]
+                    i += 1
+                elif flight.done:
+                    if flight.error:
+                        raise flight.error
+                    return
+                else:
+                    await flight.wait()
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done:
+                self._remove(key, flight)
+                flight.task.cancel()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        async def single():
+            yield await fn()
+
+        async with aclosing(self.stream(key, single)) as results:
+            async for result in results:
+                return result
+
+    async def _produce(self, key: Hashable, flight: _Flight, fn: Callable[[], AsyncIterator[T]]):
+        try:
+            async for item in fn():
+                flight.items.append(item)
+                flight.notify()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._remove(key, flight)
+            flight.notify()
+
+    def _remove(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def __len__(self):
+        return len(self._flights)
@@ -6,6 +6,7 @@ from eidolon_ai_client.events import (
     BaseStreamEvent,
     StringOutputEvent,
     ObjectOutputEvent,
+    PartialObjectOutputEvent,
     ErrorEvent,
     StreamEvent,
     StartStreamContextEvent,
@@ -28,6 +29,7 @@ class StreamCollector(AsyncIterator[StreamEvent]):
         self.stream = stream
         self._context_level = context_level
         self._last_seen_event = None
+        self._partial_content = None
 
     def process_event(self, event: BaseStreamEvent):
         if event.stream_context == self._context_level:
@@ -39,7 +41,11 @@ class StreamCollector(AsyncIterator[StreamEvent]):
                 self._last_seen_event = event
             elif isinstance(event, ObjectOutputEvent):
                 self._content.append(event.content)
+                self._partial_content = None
                 self._last_seen_event = event
+            elif isinstance(event, PartialObjectOutputEvent):
+                # partial objects are superseded by the final object, so they do not contribute to the content
+                self._partial_content = event.content
             elif isinstance(event, ErrorEvent):
                 self._content.append(event.reason)
                 self._last_seen_event = event
@@ -52,6 +58,12 @@ class StreamCollector(AsyncIterator[StreamEvent]):
         else:
             return self._content
 
+    def get_partial_content(self):
+        """
+        The latest snapshot of an object output that is still being generated, if any.
+        """
+        return self._partial_content
+
     def get_content_as_string(self):
         pass
 
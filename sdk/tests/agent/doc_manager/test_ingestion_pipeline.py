@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from eidolon_ai_sdk.agent.doc_manager.ingestion_pipeline import IngestionPipeline, IngestionPipelineSpec, ParsePool
+from eidolon_ai_sdk.agent.doc_manager.loaders.base_loader import AddedFile, FileInfo, ModifiedFile, RemovedFile
+from eidolon_ai_sdk.agent.doc_manager.parsers.auto_parser import AutoParser
+from eidolon_ai_sdk.agent.doc_manager.parsers.base_parser import DataBlob, DocumentParserSpec
+from eidolon_ai_sdk.agent.doc_manager.transformer.auto_transformer import AutoTransformer
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.embeddings import HashingEmbedding, HashingEmbeddingSpec
+from eidolon_ai_sdk.system.reference_model import Reference
+
+
+class SlowParser(AutoParser):
+    def parse(self, blob):
+        time.sleep(0.3)
+        return super().parse(blob)
+
+
+def file(path, text, mimetype="text/plain"):
+    return FileInfo(path, {"version": text}, DataBlob.from_bytes(text.encode(), path=path, mimetype=mimetype))
+
+
+async def changes(*items):
+    for item in items:
+        yield item
+
+
+@pytest.fixture
+def pipeline_fn(machine, monkeypatch, request):
+    monkeypatch.setattr(AgentOS.similarity_memory, "embedder", HashingEmbedding(HashingEmbeddingSpec(dimensions=32)))
+
+    def fn(parser=None, pool=None, **kwargs):
+        return IngestionPipeline(
+            IngestionPipelineSpec(**kwargs),
+            parser or AutoParser(DocumentParserSpec()),
+            Reference[AutoTransformer]().instantiate(),
+            f"records_{request.node.name}",
+            f"contents_{request.node.name}",
+            pool=pool,
+        )
+
+    return fn
+
+
+async def records(pipeline):
+    found = {}
+    async for record in AgentOS.symbolic_memory.find(pipeline.records_collection, {}):
+        found[record["file_path"]] = record
+    return found
+
+
+async def texts(pipeline, record):
+    docs = AgentOS.similarity_memory.vector_store.get_docs(pipeline.contents_collection, record["doc_ids"])
+    return [doc.page_content async for doc in docs]
+
+
+async def test_files_are_parsed_embedded_and_written(pipeline_fn):
+    pipeline = pipeline_fn(parse_processes=2, write_batch_size=2)
+    stats = await pipeline.run(changes(*(AddedFile(file(f"{i}.txt", f"file number {i}")) for i in range(5))))
+    found = await records(pipeline)
+    assert set(found) == {f"{i}.txt" for i in range(5)}
+    assert await texts(pipeline, found["3.txt"]) == ["file number 3"]
+    assert [(s.name, s.files, s.failed) for s in stats] == [(n, 5, 0) for n in ("load", "parse", "embed", "write")]
+    assert stats[1].chunks == 5 and stats[1].files_per_second > 0
+
+
+async def test_modified_and_removed_files_replace_their_chunks(pipeline_fn):
+    await pipeline_fn().run(changes(AddedFile(file("a.txt", "old a")), AddedFile(file("b.txt", "old b"))))
+    pipeline = pipeline_fn()
+    await pipeline.run(changes(ModifiedFile(file("a.txt", "new a")), RemovedFile("b.txt")))
+    found = await records(pipeline)
+    assert list(found) == ["a.txt"]
+    assert found["a.txt"]["data"] == {"version": "new a"}
+    assert await texts(pipeline, found["a.txt"]) == ["new a"]
+
+
+async def test_failed_files_are_not_recorded(pipeline_fn):
+    pipeline = pipeline_fn(parse_processes=0)
+    stats = await pipeline.run(
+        changes(AddedFile(file("a.bin", "?", mimetype="application/octet-stream")), AddedFile(file("b.txt", "b")))
+    )
+    assert list(await records(pipeline)) == ["b.txt"]
+    assert (stats[1].files, stats[1].failed) == (1, 1)
+
+
+async def test_parsing_does_not_block_the_event_loop(pipeline_fn):
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    await pipeline_fn(SlowParser(DocumentParserSpec()), parse_processes=1).run(changes(AddedFile(file("a.txt", "a"))))
+    ticker.cancel()
+    assert ticks >= 10
+
+
+async def test_a_shared_pool_is_kept_between_syncs(pipeline_fn):
+    pool = ParsePool(1)
+    await pipeline_fn(pool=pool).run(changes(AddedFile(file("a.txt", "a"))))
+    executor = pool.executor()
+    await pipeline_fn(pool=pool).run(changes(AddedFile(file("b.txt", "b"))))
+    assert pool.executor() is executor
+    # parse processes are not forked from the worker
+    assert executor._mp_context.get_start_method() in ("forkserver", "spawn")
+    pool.shutdown()
+    assert list(await records(pipeline_fn())) == ["a.txt", "b.txt"]
+
+
+def test_document_managers_share_the_pool_of_the_worker():
+    assert ParsePool.shared(2) is ParsePool.shared(2)
+    assert ParsePool.shared(None) is ParsePool.shared(os.cpu_count() or 1)
+    assert ParsePool.shared(1) is not ParsePool.shared(2)
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from eidolon_ai_sdk.agent.doc_manager.sync_scheduler import DocumentSyncScheduler, DocumentSyncSchedulerSpec
+from eidolon_ai_sdk.agent_os import AgentOS
+
+
+class FakeManager:
+    def __init__(self, name, recheck_frequency=60, duration=0.0, fail=False):
+        self.spec = SimpleNamespace(name=name, recheck_frequency=recheck_frequency)
+        self.duration = duration
+        self.fail = fail
+        self.syncs = 0
+        self.stopped = False
+
+    async def stop(self):
+        self.stopped = True
+
+    async def sync_docs(self, force: bool = False):
+        assert force
+        await asyncio.sleep(self.duration)
+        if self.fail:
+            raise ValueError("boom")
+        self.syncs += 1
+
+
+@pytest.fixture
+async def scheduler_fn(machine, request):
+    schedulers = []
+    # leases are shared by the tests of a module
+    lease_collection = f"leases_{request.node.name}"
+
+    async def fn(**kwargs):
+        scheduler = DocumentSyncScheduler(spec=DocumentSyncSchedulerSpec(lease_collection=lease_collection, **kwargs))
+        await scheduler.start()
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield fn
+    for scheduler in schedulers:
+        await scheduler.stop()
+
+
+async def test_first_search_waits_for_the_first_sync_only(scheduler_fn):
+    scheduler = await scheduler_fn()
+    manager = FakeManager("docs", duration=0.05)
+    await scheduler.ensure_synced(manager)
+    assert manager.syncs == 1
+
+    manager.duration = 10
+    scheduler.trigger("docs")
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    await scheduler.ensure_synced(manager)
+    assert time.perf_counter() - started < 1
+    (status,) = scheduler.status()
+    assert (status.name, status.state, status.runs) == ("docs", "syncing", 1)
+    assert scheduler.trigger("missing") is None
+    await scheduler.stop()
+    assert manager.stopped
+
+
+async def test_syncs_run_periodically(scheduler_fn):
+    scheduler = await scheduler_fn(jitter=0.5)
+    manager = FakeManager("docs", recheck_frequency=0.02)
+    await scheduler.ensure_synced(manager)
+    await asyncio.sleep(0.3)
+    assert manager.syncs >= 4
+    status = scheduler.status()[0]
+    assert status.last_error is None and status.next_run > status.last_finished
+
+
+async def test_one_worker_syncs_a_collection_at_a_time(scheduler_fn):
+    workers = [await scheduler_fn() for _ in range(3)]
+    managers = [FakeManager("docs", duration=0.1) for _ in workers]
+    await asyncio.gather(*(w.ensure_synced(m) for w, m in zip(workers, managers)))
+    assert sum(m.syncs for m in managers) == 1
+    assert sum(w.status()[0].skipped for w in workers) == 2
+
+    # once released, the lease can be taken again
+    idle = next(w for w, m in zip(workers, managers) if not m.syncs)
+    idle.trigger("docs")
+    await asyncio.sleep(0.2)
+    assert sum(m.syncs for m in managers) == 2
+
+
+async def test_workers_with_process_local_stores_sync_without_the_lease(scheduler_fn, monkeypatch):
+    monkeypatch.setattr(AgentOS, "similarity_memory", SimpleNamespace(vector_store=SimpleNamespace(process_local=True)))
+    workers = [await scheduler_fn() for _ in range(3)]
+    managers = [FakeManager("docs", duration=0.05) for _ in workers]
+    await asyncio.gather(*(w.ensure_synced(m) for w, m in zip(workers, managers)))
+    assert [m.syncs for m in managers] == [1, 1, 1]
+    assert await AgentOS.symbolic_memory.find_one(workers[0].spec.lease_collection, {"_id": "docs"}) is None
+
+
+async def test_expired_leases_are_taken_over(scheduler_fn):
+    crashed = await scheduler_fn(lease_seconds=0.05)
+    assert (await crashed._acquire("docs"))[0]
+    scheduler = await scheduler_fn(lease_seconds=0.05)
+    assert not (await scheduler._acquire("docs"))[0]
+    await asyncio.sleep(0.06)
+    assert (await scheduler._acquire("docs"))[0]
+
+
+async def test_collections_synced_recently_elsewhere_are_skipped(scheduler_fn):
+    workers = [await scheduler_fn(jitter=0) for _ in range(3)]
+    managers = [FakeManager("docs", recheck_frequency=0.2) for _ in workers]
+    for worker, manager in zip(workers, managers):
+        await worker.ensure_synced(manager)
+        await asyncio.sleep(0.03)
+    await asyncio.sleep(0.5)
+    # the workers' periods overlap, so each period one of them syncs and the others find the sync fresh
+    assert 3 <= sum(m.syncs for m in managers) <= 4
+    assert sum(w.status()[0].skipped for w in workers) >= 5
+
+
+async def test_stopping_releases_searches_waiting_for_a_first_sync(scheduler_fn):
+    scheduler = await scheduler_fn()
+    waiting = asyncio.create_task(scheduler.ensure_synced(FakeManager("docs", duration=10)))
+    await asyncio.sleep(0.05)
+    await scheduler.stop()
+    await asyncio.wait_for(waiting, 1)
+
+
+async def test_failed_syncs_are_reported(scheduler_fn):
+    scheduler = await scheduler_fn()
+    await scheduler.ensure_synced(FakeManager("docs", fail=True))
+    (status,) = scheduler.status()
+    assert status.last_error == "boom" and status.runs == 1
+
+
+async def test_machine_registers_document_managers(machine):
+    await machine.document_sync_scheduler.start()
+    assert AgentOS.document_sync_scheduler is machine.document_sync_scheduler
+    assert machine.document_sync_scheduler.status() == []
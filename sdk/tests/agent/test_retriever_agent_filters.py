@@ -0,0 +1,125 @@
+from contextlib import asynccontextmanager
+
+import pytest
+from bson import ObjectId
+
+from eidolon_ai_sdk.agent.retriever_agent.question_transformer import QuestionTransformer
+from eidolon_ai_sdk.agent.retriever_agent.retriever_agent import RetrieverAgent
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.embeddings import HashingEmbedding
+from eidolon_ai_sdk.memory.similarity_memory import SimilarityMemory
+from eidolon_ai_sdk.system.reference_model import Reference
+from eidolon_ai_sdk.util.class_utils import fqn
+
+FILES = {
+    "src/app.py": "def search_documents(question):\n    return question\n",
+    "src/notes.md": "# Search\nnotes about searching documents",
+    "docs/guide.md": "# Guide\na guide to searching documents",
+    "docs/readme.txt": "read me before searching documents",
+}
+
+
+class SameQuestion(QuestionTransformer):
+    async def transform(self, question):
+        return [question]
+
+
+@pytest.fixture(scope="module")
+def similarity_memory(tmp_path_factory):
+    @asynccontextmanager
+    async def cm():
+        ref = Reference(
+            implementation=fqn(SimilarityMemory),
+            embedder=dict(implementation=fqn(HashingEmbedding)),
+            vector_store=dict(url=f"file://{tmp_path_factory.mktemp(f'vector_store_{ObjectId()}')}"),
+        )
+        memory: SimilarityMemory = ref.instantiate()
+        await memory.start()
+        yield ref
+        await memory.stop()
+
+    return cm
+
+
+@pytest.fixture
+def docs_dir(tmp_path):
+    for path, text in FILES.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(text)
+    return tmp_path
+
+
+@pytest.fixture
+def agent_fn(machine, docs_dir, request):
+    def fn(**kwargs) -> RetrieverAgent:
+        return Reference(
+            implementation=fqn(RetrieverAgent),
+            name=f"filters_{request.node.name}",
+            description="A retriever searching test files",
+            loader_root_location=f"file://{docs_dir}",
+            question_transformer=dict(implementation=fqn(SameQuestion)),
+            **kwargs,
+        ).instantiate()
+
+    return fn
+
+
+async def search(agent: RetrieverAgent, root, source_prefix=None, **kwargs):
+    source_prefix = source_prefix and f"{root}/{source_prefix}"
+    found = await agent.search("searching documents", source_prefix=source_prefix, **kwargs)
+    return sorted({doc.file_path.removeprefix(f"{root}/") for doc in found})
+
+
+async def test_unfiltered_search_finds_every_file(agent_fn, docs_dir):
+    assert await search(agent_fn(), docs_dir) == sorted(FILES)
+
+
+async def test_search_by_source_prefix(agent_fn, docs_dir):
+    agent = agent_fn()
+    assert await search(agent, docs_dir, source_prefix="docs/") == ["docs/guide.md", "docs/readme.txt"]
+    assert await search(agent, docs_dir, source_prefix="src/n") == ["src/notes.md"]
+    assert await search(agent, docs_dir, source_prefix="missing/") == []
+
+
+async def test_search_by_mime_types(agent_fn, docs_dir):
+    agent = agent_fn()
+    assert await search(agent, docs_dir, mime_types=["text/markdown"]) == ["docs/guide.md", "src/notes.md"]
+    assert await search(agent, docs_dir, mime_types=["text/plain", "text/x-python"]) == [
+        "docs/readme.txt",
+        "src/app.py",
+    ]
+
+
+async def test_search_by_metadata(agent_fn, docs_dir):
+    agent = agent_fn()
+    assert await search(agent, docs_dir, metadata={"language": "python"}) == ["src/app.py"]
+    assert await search(agent, docs_dir, metadata={"language": ["python", "rust"]}) == ["src/app.py"]
+
+
+async def test_filters_are_combined(agent_fn, docs_dir):
+    agent = agent_fn()
+    assert await search(agent, docs_dir, source_prefix="src/", mime_types=["text/markdown"]) == ["src/notes.md"]
+    assert await search(agent, docs_dir, source_prefix="docs/", metadata={"language": "python"}) == []
+
+
+async def test_lexical_and_vector_results_are_fused(agent_fn, docs_dir, monkeypatch):
+    agent = agent_fn(document_manager=dict(lexical_index=dict(shards=4)))
+    reranked = []
+    rerank = agent.document_reranker.rerank
+
+    async def spy(documents):
+        reranked.append(documents)
+        return await rerank(documents)
+
+    monkeypatch.setattr(agent.document_reranker, "rerank", spy)
+    found = await search(agent, docs_dir, source_prefix="src/")
+    assert found == ["src/app.py", "src/notes.md"]
+    (documents,) = reranked
+    assert set(documents) == {"searching documents", "lexical: searching documents"}
+    # both searches found the chunks of the filtered files, and nothing else
+    for results in documents.values():
+        assert results
+        metadata = await AgentOS.similarity_memory.vector_store.get_metadata(
+            f"doc_contents_{agent.spec.name}", list(results)
+        )
+        assert all(m["source"].startswith(f"{docs_dir}/src/") for m in metadata)
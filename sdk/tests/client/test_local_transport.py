@@ -0,0 +1,97 @@
+from typing import Annotated
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import Body
+
+from eidolon_ai_client.client import Agent
+from eidolon_ai_client.events import StringOutputEvent, AgentStateEvent
+from eidolon_ai_client.util.aiohttp import AgentError, get_content
+from eidolon_ai_client.util.local_transport import EVENT_SINK, _MAX_BUFFERED_EVENTS, local_app, stream_local
+from eidolon_ai_client.util.request_context import RequestContext
+from eidolon_ai_sdk.agent.agent import register_program, register_action
+from eidolon_ai_sdk.agent_os import AgentOS
+
+
+class Callee:
+    @register_program()
+    async def greet(self, name: Annotated[str, Body(embed=True)]):
+        yield StringOutputEvent(content=f"Hello, {name}!")
+        yield StringOutputEvent(content=f" From {RequestContext.get('agent_name')}.")
+        yield AgentStateEvent(state="idle")
+
+    @register_action("idle")
+    async def again(self):
+        yield StringOutputEvent(content="Hello again!")
+
+
+class Caller:
+    @register_program()
+    async def call(self):
+        callee = Agent.get("Callee")
+        stream = (await callee.create_process()).stream_action("greet", dict(name="Caller"))
+        events = [e async for e in stream]
+        status = await callee.process(stream.process_id).status()
+        try:
+            await callee.process("missing").action("again")
+            missing = None
+        except AgentError as e:
+            missing = e.status_code
+        return dict(
+            local=local_app(AgentOS.current_machine_url()) is not None,
+            events=[e.event_type for e in events],
+            content="".join(e.content for e in events if isinstance(e, StringOutputEvent)),
+            state=status.state,
+            agent_name=RequestContext.get("agent_name"),
+            missing=missing,
+            process_id=stream.process_id,
+        )
+
+
+@pytest_asyncio.fixture(scope="module")
+async def server(run_app):
+    async with run_app(Callee, Caller) as ra:
+        yield ra
+
+
+async def test_calls_between_agents_on_a_machine_are_in_process(server):
+    # the test runs on its own event loop, so it calls the machine over http
+    assert local_app(AgentOS.current_machine_url()) is None
+    result = (await Agent.get("Caller").run_program("call")).data
+    process_id = result.pop("process_id")
+    assert result == dict(
+        local=True,
+        events=["user_input", "agent_call", "string", "string", "agent_state", "success"],
+        content="Hello, Caller! From Callee.",
+        state="idle",
+        agent_name="Caller",
+        missing=404,
+    )
+    # stored events are merged without affecting the events the caller received
+    stored = await get_content(f"{server}/agents/Callee/processes/{process_id}/events")
+    assert [e["content"] for e in stored if e["event_type"] == "string"] == ["Hello, Caller! From Callee."]
+
+
+async def test_streamed_events_are_bounded_by_the_caller():
+    emitted = []
+
+    async def app(scope, receive, send):
+        await receive()
+        for i in range(3 * _MAX_BUFFERED_EVENTS):
+            await scope[EVENT_SINK](i)
+            emitted.append(i)
+        status = 500 if scope["path"] == "/fail" else 202
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    received = []
+    async for event in stream_local(app, "http://local/ok", None, {}):
+        # the app waits for the caller rather than queueing every event, the queued events and the one received
+        assert len(emitted) - len(received) <= _MAX_BUFFERED_EVENTS + 1
+        received.append(event)
+    assert received == emitted == list(range(3 * _MAX_BUFFERED_EVENTS))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        async for _ in stream_local(app, "http://local/fail", None, {}):
+            pass
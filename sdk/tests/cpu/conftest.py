@@ -0,0 +1,50 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+
+from eidolon_ai_sdk.cpu.llm import open_ai_llm_unit
+
+
+def chunk(content):
+    return ChatCompletionChunk(
+        id="1",
+        choices=[Choice(delta=ChoiceDelta(content=content), index=0)],
+        created=0,
+        model="gpt-4",
+        object="chat.completion.chunk",
+    )
+
+
+class FakeCompletions:
+    """
+    Replaces the openai completion call. Streams string_chunks for string requests and object_chunks for json requests,
+    as content chunks unless they are already chunks.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.string_chunks = ["hello ", "world"]
+        self.object_chunks = ['{"answer"', ": 42}"]
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __call__(self, client_ref):
+        async def fn(client_args=None, **kwargs):
+            self.calls.append(kwargs)
+            for c in self.object_chunks if "response_format" in kwargs else self.string_chunks:
+                # let concurrent calls interleave, as they would waiting on the network
+                await asyncio.sleep(0)
+                yield chunk(c) if isinstance(c, str) else c
+
+        return fn
+
+
+@pytest.fixture
+def completions():
+    fake = FakeCompletions()
+    with patch.object(open_ai_llm_unit, "_openai_completion", fake):
+        yield fake
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from eidolon_ai_client.events import ErrorEvent, StringOutputEvent
+from eidolon_ai_sdk.cpu.agent_cpu import CPUException
+from eidolon_ai_sdk.cpu.agent_io import UserTextCPUMessage
+from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.conversational_agent_cpu import ConversationalAgentCPU, ConversationalAgentCPUSpec
+from eidolon_ai_sdk.cpu.llm.mock_llm_unit import MockLLMUnit
+from eidolon_ai_sdk.cpu.llm_message import ToolResponseMessage
+from eidolon_ai_sdk.cpu.logic_unit import LogicUnit, llm_function
+from eidolon_ai_sdk.system.reference_model import Reference
+from eidolon_ai_sdk.util.class_utils import fqn
+
+
+class SleepUnit(LogicUnit):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.running = 0
+        self.max_running = 0
+        self.finished = []
+
+    @llm_function()
+    async def sleep(self, seconds: float) -> str:
+        """
+        Sleep for a number of seconds
+        """
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(seconds)
+            self.finished.append(seconds)
+            return f"slept {seconds}"
+        finally:
+            self.running -= 1
+
+
+def cpu(*sleeps: float, **kwargs) -> ConversationalAgentCPU:
+    llm_unit = Reference(
+        implementation=fqn(MockLLMUnit),
+        script=[
+            dict(content="", tool_calls=[dict(name="*sleep", arguments=dict(seconds=s)) for s in sleeps]),
+            dict(content="done"),
+        ],
+    )
+    spec = ConversationalAgentCPUSpec(
+        llm_unit=llm_unit, logic_units=[Reference(implementation=fqn(SleepUnit))], **kwargs
+    )
+    return ConversationalAgentCPU(spec=spec)
+
+
+async def run(agent_cpu: ConversationalAgentCPU):
+    call_context = CallContext(process_id="pid")
+    prompts = [UserTextCPUMessage(prompt="hi")]
+    events = [e async for e in agent_cpu.schedule_request(call_context, prompts)]
+    conversation = await agent_cpu.memory_unit.getConversationHistory(call_context)
+    return events, [m for m in conversation if isinstance(m, ToolResponseMessage)]
+
+
+@pytest.fixture(autouse=True)
+def memory(machine):
+    return machine
+
+
+async def test_tool_calls_run_in_parallel_by_default():
+    agent_cpu = cpu(0.05, 0.05, 0.05)
+    events, responses = await run(agent_cpu)
+    assert agent_cpu.logic_units[0].max_running == 3
+    assert [r.result for r in responses] == ["slept 0.05"] * 3
+    assert events[-1] == StringOutputEvent(content="done")
+
+
+async def test_max_parallel_tool_calls():
+    agent_cpu = cpu(0.02, 0.02, 0.02, 0.02, max_parallel_tool_calls=2)
+    await run(agent_cpu)
+    assert agent_cpu.logic_units[0].max_running == 2
+    assert len(agent_cpu.logic_units[0].finished) == 4
+
+
+async def test_max_parallel_tool_calls_per_logic_unit_spans_requests():
+    agent_cpu = cpu(0.02, 0.02, max_parallel_tool_calls_per_logic_unit=1)
+    await asyncio.gather(run(agent_cpu), run(agent_cpu))
+    assert agent_cpu.logic_units[0].max_running == 1
+    assert len(agent_cpu.logic_units[0].finished) == 4
+
+
+async def test_slow_tool_times_out_and_llm_continues():
+    agent_cpu = cpu(0.01, 10, tool_call_timeout=0.2)
+    events, responses = await run(agent_cpu)
+    assert sorted(r.result for r in responses) == [
+        "TimeoutError: Tool call SleepUnit_sleep timed out after 0.2 seconds",
+        "slept 0.01",
+    ]
+    assert any(isinstance(e, ErrorEvent) for e in events)
+    assert events[-1] == StringOutputEvent(content="done")
+
+
+async def test_deadline_includes_queue_time():
+    agent_cpu = cpu(0.15, 0.15, max_parallel_tool_calls=1, tool_calls_deadline=0.25)
+    _, responses = await run(agent_cpu)
+    assert [r.result for r in responses][0] == "slept 0.15"
+    assert responses[1].result.startswith("TimeoutError: Tool call SleepUnit_sleep timed out")
+
+
+async def test_siblings_are_cancelled_when_tool_errors_are_not_allowed():
+    agent_cpu = cpu(0.01, 10, tool_call_timeout=0.1, allow_tool_errors=False)
+    with pytest.raises(CPUException):
+        await run(agent_cpu)
+    await asyncio.sleep(0.05)
+    assert agent_cpu.logic_units[0].running == 0
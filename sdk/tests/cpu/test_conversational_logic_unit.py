@@ -107,3 +107,59 @@ async def test_multiple_calls(conversational_logic_unit):
             tools = await clu.build_tools(CallContext(process_id="parent_pid"))
             output = {type(e) async for e in tools[0].fn(clu, body=dict(name="foo"))}
             assert SuccessEvent in output
+
+
+async def test_tool_definitions_are_reused_until_call_history_changes(conversational_logic_unit):
+    with conversational_logic_unit(Foo) as clu:
+        call_context = CallContext(process_id="versioned_pid")
+        first = await clu.tool_definitions(call_context)
+        assert await clu.tool_definitions(call_context) is first
+        assert len(first) == 1
+
+        call = AgentCallHistory(
+            parent_process_id="versioned_pid",
+            parent_thread_id=None,
+            machine=AgentOS.current_machine_url(),
+            agent="Foo",
+            remote_process_id="pid",
+            state="idle",
+            available_actions=["progress_idle"],
+        )
+        await call.upsert()
+        clu.record_call(call)
+        second = await clu.tool_definitions(call_context)
+        assert len(second) == 2
+        # the program's input model is built once per machine path
+        assert second[0].input_model is first[0].input_model
+
+
+async def test_call_history_is_cached_per_thread(conversational_logic_unit):
+    with conversational_logic_unit(Foo) as clu:
+        call_context = CallContext(process_id="cached_pid")
+        assert await clu.get_call_history(call_context) == []
+        call = AgentCallHistory(
+            parent_process_id="cached_pid",
+            parent_thread_id=None,
+            machine=AgentOS.current_machine_url(),
+            agent="Foo",
+            remote_process_id="pid",
+            state="idle",
+            available_actions=["progress_idle"],
+        )
+        await call.upsert()
+        assert await clu.get_call_history(call_context) == []
+        clu.record_call(call)
+        assert await clu.get_call_history(call_context) == [call]
+        # a fresh unit loads the stored history
+        with conversational_logic_unit(Foo) as fresh:
+            assert await fresh.get_call_history(call_context) == [call]
+
+
+async def test_recorded_calls_update_the_cached_history(conversational_logic_unit):
+    with conversational_logic_unit(Foo) as clu:
+        call_context = CallContext(process_id="recorded_pid")
+        assert await clu.get_call_history(call_context) == []
+        [program] = await clu.build_tools(call_context)
+        [e async for e in program.fn(clu, body=dict(name="foo"))]
+        [call] = await clu.get_call_history(call_context)
+        assert (call.agent, call.state) == ("Foo", "active")
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from eidolon_ai_client.events import LLMMetricsEvent, StringOutputEvent
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.llm.llm_metrics import Histogram, LLMMetrics, LLMMetricsSpec, LLMCallMetrics, get_metrics
+from eidolon_ai_sdk.cpu.llm.open_ai_llm_unit import OpenAIGPT, OpenAiGPTSpec
+from eidolon_ai_sdk.cpu.llm_message import UserMessage, UserMessageText
+
+
+def test_histogram_percentiles():
+    h = Histogram()
+    for i in range(1, 101):
+        h.record(i / 100)
+    summary = h.summary()
+    assert summary["count"] == 100
+    assert summary["min"] == 0.01 and summary["max"] == 1.0
+    assert summary["mean"] == pytest.approx(0.505)
+    assert 0.5 <= summary["p50"] <= 0.6
+    assert 0.95 <= summary["p95"] <= 1.0
+    assert summary["p99"] == 1.0
+
+
+def test_metrics_are_grouped_by_model_and_agent():
+    metrics = LLMMetrics(spec=LLMMetricsSpec(max_series=2))
+    metrics.record(LLMCallMetrics(model="a", agent="x", total_time=1), [0.1, 0.2])
+    metrics.record(LLMCallMetrics(model="a", agent="x", total_time=2))
+    metrics.record(LLMCallMetrics(model="b", agent="x", total_time=2))
+    metrics.record(LLMCallMetrics(model="c", agent="x", total_time=2))
+    summary = {(s["model"], s["agent"]): s["metrics"] for s in metrics.summary()}
+    assert set(summary) == {("a", "x"), ("b", "x")}
+    assert summary["a", "x"]["total_time"]["count"] == 2
+    assert summary["a", "x"]["inter_token_gap"]["count"] == 2
+    assert summary["a", "x"]["time_to_first_token"]["count"] == 0
+
+
+async def execute(**kwargs):
+    unit = OpenAIGPT(processing_unit_locator=None, spec=OpenAiGPTSpec(**kwargs))
+    messages = [UserMessage(content=[UserMessageText(text="hi")])]
+    return [e async for e in unit.execute_llm(CallContext(process_id="p"), messages, [], "str")]
+
+
+async def test_metrics_event_is_emitted(completions):
+    events = await execute(emit_metrics_event=True, coalesce_requests=False)
+    assert events[:2] == [StringOutputEvent(content="hello "), StringOutputEvent(content="world")]
+    assert isinstance(events[2], LLMMetricsEvent)
+    metrics = LLMCallMetrics.model_validate(events[2].metrics)
+    assert metrics.output_tokens == 2
+    assert metrics.time_to_first_token is not None
+    assert metrics.total_time >= metrics.build_time
+
+
+async def test_metrics_event_is_off_by_default(completions):
+    assert not any(isinstance(e, LLMMetricsEvent) for e in await execute())
+
+
+async def test_calls_are_recorded_on_the_machine(machine, completions):
+    await execute()
+    assert AgentOS.llm_metrics is get_metrics()
+    [series] = get_metrics().summary()
+    assert series["model"] == OpenAiGPTSpec().model
+    assert series["metrics"]["total_time"]["count"] == 1
+
+
+async def test_coalesced_calls_are_recorded_for_each_caller(machine, completions):
+    first, second = await asyncio.gather(execute(emit_metrics_event=True), execute(emit_metrics_event=True))
+    assert len(completions) == 1
+    for events in first, second:
+        metrics = LLMCallMetrics.model_validate(events[-1].metrics)
+        assert metrics.output_tokens == 2 and metrics.total_time >= metrics.build_time
+    [series] = get_metrics().summary()
+    assert series["metrics"]["total_time"]["count"] == 2
+    assert series["metrics"]["time_to_first_token"]["count"] == 2
+    # the gaps of the shared stream are recorded once
+    assert series["metrics"]["inter_token_gap"]["count"] == 1
@@ -0,0 +1,89 @@
+import time
+from unittest.mock import patch
+
+from eidolon_ai_client.events import StringOutputEvent, ObjectOutputEvent
+from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.llm.llm_response_cache import (
+    InMemoryLLMResponseCache,
+    InMemoryLLMResponseCacheSpec,
+    SymbolicMemoryLLMResponseCache,
+    SymbolicMemoryLLMResponseCacheSpec,
+    FileMemoryLLMResponseCache,
+    FileMemoryLLMResponseCacheSpec,
+    request_key,
+)
+from eidolon_ai_sdk.cpu.llm.open_ai_llm_unit import OpenAIGPT, OpenAiGPTSpec
+from eidolon_ai_sdk.cpu.llm_message import UserMessage, SystemMessage, UserMessageText
+from eidolon_ai_sdk.system.reference_model import Reference
+from eidolon_ai_sdk.util.class_utils import fqn
+
+
+def test_request_key_is_canonical():
+    assert request_key(dict(model="a", temperature=0.3)) == request_key(dict(temperature=0.3, model="a", stream=True))
+    assert request_key(dict(model="a", temperature=0.3)) != request_key(dict(model="a", temperature=0.4))
+
+
+async def test_in_memory_cache_evicts_least_recently_used():
+    cache = InMemoryLLMResponseCache(spec=InMemoryLLMResponseCacheSpec(max_entries=2))
+    await cache.put("a", [{}])
+    await cache.put("b", [{}])
+    await cache.get("a")
+    await cache.put("c", [{}])
+    assert await cache.get("a") is not None
+    assert await cache.get("b") is None
+    assert await cache.get("c") is not None
+
+
+async def test_in_memory_cache_expires():
+    cache = InMemoryLLMResponseCache(spec=InMemoryLLMResponseCacheSpec(ttl_seconds=10))
+    await cache.put("a", [{}])
+    with patch.object(time, "time", return_value=time.time() + 11):
+        assert await cache.get("a") is None
+
+
+async def test_symbolic_memory_cache_is_bounded(machine):
+    cache = SymbolicMemoryLLMResponseCache(spec=SymbolicMemoryLLMResponseCacheSpec(max_entries=2))
+    for key in ["a", "b", "c"]:
+        await cache.put(key, [dict(content=key)])
+    assert await cache.get("a") is None
+    assert await cache.get("c") == [dict(content="c")]
+
+
+async def test_file_memory_cache_skips_large_responses(machine):
+    cache = FileMemoryLLMResponseCache(spec=FileMemoryLLMResponseCacheSpec(max_entry_bytes=100))
+    await cache.put("small", [dict(content="hi")])
+    await cache.put("large", [dict(content="x" * 100)])
+    assert await cache.get("small") == [dict(content="hi")]
+    assert await cache.get("large") is None
+
+
+def llm(cache=True):
+    spec = dict(response_cache=Reference(implementation=fqn(InMemoryLLMResponseCache))) if cache else {}
+    return OpenAIGPT(processing_unit_locator=None, spec=OpenAiGPTSpec(**spec))
+
+
+async def execute(unit, output_format="str"):
+    messages = [SystemMessage(content="you are helpful"), UserMessage(content=[UserMessageText(text="hi")])]
+    return [e async for e in unit.execute_llm(CallContext(process_id="p"), messages, [], output_format)]
+
+
+async def test_cached_responses_are_replayed(completions):
+    unit = llm()
+    first = await execute(unit)
+    second = await execute(unit)
+    assert len(completions) == 1
+    assert first == second == [StringOutputEvent(content="hello "), StringOutputEvent(content="world")]
+
+
+async def test_cached_object_responses_are_replayed(completions):
+    unit = llm()
+    await execute(unit, dict(type="object"))
+    assert await execute(unit, dict(type="object")) == [ObjectOutputEvent(content=dict(answer=42))]
+    assert len(completions) == 1
+
+
+async def test_responses_are_not_cached_by_default(completions):
+    unit = llm(cache=False)
+    await execute(unit)
+    await execute(unit)
+    assert len(completions) == 2
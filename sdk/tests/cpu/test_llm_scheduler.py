@@ -0,0 +1,121 @@
+import asyncio
+from unittest.mock import patch
+
+import httpx
+import pytest
+from openai import APIConnectionError, RateLimitError
+
+from eidolon_ai_sdk.cpu.llm import llm_scheduler
+from eidolon_ai_sdk.cpu.llm.llm_scheduler import LLMScheduler, LLMSchedulerSpec, RateLimit
+
+
+def rate_limit_error(**headers):
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com"), headers=headers)
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def scheduler(**kwargs):
+    return LLMScheduler(spec=LLMSchedulerSpec(initial_backoff=0.01, jitter=0, **kwargs))
+
+
+def flaky_stream(failures, error_after_chunk=False):
+    calls = []
+
+    async def fn():
+        calls.append(len(calls))
+        if error_after_chunk:
+            yield "partial"
+        if len(calls) <= failures:
+            raise rate_limit_error(**{"retry-after-ms": "10"})
+        yield "done"
+
+    return fn, calls
+
+
+async def test_retries_rate_limits():
+    fn, calls = flaky_stream(failures=2)
+    s = scheduler()
+    assert [c async for c in s.stream("gpt", fn)] == ["done"]
+    assert len(calls) == 3
+    assert s.stats["default:gpt"].retries == 2
+
+
+async def test_gives_up_after_max_retries():
+    fn, calls = flaky_stream(failures=5)
+    with pytest.raises(RateLimitError):
+        [c async for c in scheduler(max_retries=2).stream("gpt", fn)]
+    assert len(calls) == 3
+
+
+async def test_does_not_retry_after_streaming_started():
+    fn, calls = flaky_stream(failures=1, error_after_chunk=True)
+    acc = []
+    with pytest.raises(RateLimitError):
+        async for c in scheduler().stream("gpt", fn):
+            acc.append(c)
+    assert acc == ["partial"]
+    assert len(calls) == 1
+
+
+def test_retry_after_headers():
+    assert llm_scheduler._retry_after(rate_limit_error(**{"retry-after-ms": "250"})) == 0.25
+    assert llm_scheduler._retry_after(rate_limit_error(**{"x-ratelimit-reset-requests": "1m6s"})) == 66
+    assert llm_scheduler._retry_after(rate_limit_error(**{"x-ratelimit-reset-tokens": "20ms"})) == 0.02
+    assert llm_scheduler._retry_after(rate_limit_error()) is None
+
+
+async def test_requests_per_minute_are_queued_by_priority():
+    order = []
+
+    def request(name):
+        async def fn():
+            order.append(name)
+            yield name
+
+        return fn
+
+    async def consume(name, priority):
+        return [c async for c in s.stream("gpt", request(name), priority=priority)]
+
+    with patch.object(llm_scheduler, "_WINDOW_SECONDS", 0.2):
+        s = scheduler(limits=dict(gpt=RateLimit(requests_per_minute=1)))
+        await consume("first", 0)
+        await asyncio.gather(consume("low", 0), consume("high", 5))
+    assert order == ["first", "high", "low"]
+    assert s.stats["default:gpt"].max_wait > 0.1
+
+
+async def test_tokens_per_minute_are_tracked():
+    with patch.object(llm_scheduler, "_WINDOW_SECONDS", 0.2):
+        s = scheduler(default_limits=RateLimit(tokens_per_minute=100))
+
+        async def fn():
+            yield "ok"
+
+        [c async for c in s.stream("gpt", fn, estimated_tokens=80)]
+        [c async for c in s.stream("gpt", fn, estimated_tokens=80)]
+    assert s.stats["default:gpt"].max_wait > 0.1
+
+
+async def test_retried_requests_keep_their_place_in_the_queue():
+    order = []
+
+    def request(name, failures=0):
+        async def fn():
+            order.append(name)
+            if order.count(name) <= failures:
+                raise APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+            yield name
+
+        return fn
+
+    async def consume(fn):
+        return [c async for c in s.stream("gpt", fn)]
+
+    with patch.object(llm_scheduler, "_WINDOW_SECONDS", 0.2):
+        s = scheduler(limits=dict(gpt=RateLimit(requests_per_minute=1)))
+        retried = asyncio.create_task(consume(request("retried", failures=1)))
+        await asyncio.sleep(0)
+        # queued behind the window while the first request backs off, then released after its retry
+        assert await asyncio.gather(retried, consume(request("later"))) == [["retried"], ["later"]]
+    assert order == ["retried", "retried", "later"]
@@ -0,0 +1,73 @@
+from typing import List
+
+from eidolon_ai_client.events import ToolCall, ObjectOutputEvent, SuccessEvent
+from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.logic_unit import LogicUnit, llm_function, LLMToolWrapper
+from eidolon_ai_sdk.system.fn_handler import FnHandler
+
+
+class Calculator(LogicUnit):
+    @llm_function()
+    async def add(self, a: int, b: int) -> int:
+        """
+        Add two numbers
+        """
+        return a + b
+
+    @llm_function()
+    async def echo(self, text: str) -> str:
+        """
+        Echo text
+        """
+        return text
+
+
+class PerCallCalculator(Calculator):
+    async def build_tools(self, call_context: CallContext) -> List[FnHandler]:
+        return await super().build_tools(call_context)
+
+
+class VersionedCalculator(PerCallCalculator):
+    max_tool_versions = 2
+
+    async def tools_version(self, call_context: CallContext):
+        return call_context.process_id
+
+
+ctx = CallContext(process_id="pid")
+
+
+async def test_all_handlers_are_built():
+    tools = await Calculator(processing_unit_locator=None).build_tools(ctx)
+    assert [(t.name, t.extra["sub_title"]) for t in tools] == [("add", "add"), ("echo", "echo")]
+
+
+async def test_static_tool_definitions_are_built_once():
+    unit = Calculator(processing_unit_locator=None)
+    definitions = await unit.tool_definitions(ctx)
+    assert await unit.tool_definitions(CallContext(process_id="other")) is definitions
+    assert definitions[0].parameters["required"] == ["a", "b"]
+    assert definitions[1].description.strip() == "Echo text"
+
+
+async def test_overridden_build_tools_are_rebuilt():
+    unit = PerCallCalculator(processing_unit_locator=None)
+    assert await unit.tools_version(ctx) is None
+    assert await unit.tool_definitions(ctx) is not await unit.tool_definitions(ctx)
+
+
+async def test_versioned_tool_definitions_are_bounded():
+    unit = VersionedCalculator(processing_unit_locator=None)
+    first = await unit.tool_definitions(ctx)
+    assert await unit.tool_definitions(ctx) is first
+    await unit.tool_definitions(CallContext(process_id="2"))
+    await unit.tool_definitions(CallContext(process_id="3"))
+    assert await unit.tool_definitions(ctx) is not first
+
+
+async def test_wrappers_execute_with_cached_definitions():
+    wrappers = await LLMToolWrapper.from_logic_units(ctx, [Calculator(processing_unit_locator=None)])
+    assert set(wrappers) == {"Calculator_add", "Calculator_echo"}
+    tool_call = ToolCall(tool_call_id="1", name="add", arguments=dict(a=1, b=2))
+    events = [e async for e in wrappers["Calculator_add"].execute(tool_call)]
+    assert events == [ObjectOutputEvent(content=3), SuccessEvent()]
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from eidolon_ai_client.events import StringOutputEvent, LLMToolCallRequestEvent, ObjectOutputEvent
+from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.llm.mock_llm_unit import MockLLMUnit, MockLLMUnitSpec, example_for_schema
+from eidolon_ai_sdk.cpu.llm_message import UserMessage, UserMessageText, AssistantMessage, ToolResponseMessage
+from eidolon_ai_sdk.cpu.llm_unit import LLMCallFunction
+
+
+def unit(**kwargs):
+    return MockLLMUnit(processing_unit_locator=None, spec=MockLLMUnitSpec.model_validate(kwargs))
+
+
+async def execute(llm, messages=None, tools=(), output_format="str"):
+    messages = messages or [UserMessage(content=[UserMessageText(text="hi")])]
+    return [e async for e in llm.execute_llm(CallContext(process_id="p"), messages, list(tools), output_format)]
+
+
+tool = LLMCallFunction(name="convo_search_converse", description="search", parameters={})
+
+
+async def test_streams_content_word_by_word():
+    assert await execute(unit(script=[dict(content="hello big world")])) == [
+        StringOutputEvent(content="hello "),
+        StringOutputEvent(content="big "),
+        StringOutputEvent(content="world"),
+    ]
+
+
+async def test_script_steps_follow_the_turn():
+    llm = unit(script=[dict(content="", tool_calls=[dict(name="convo_*", arguments=dict(q=1))]), dict(content="done")])
+    user = UserMessage(content=[UserMessageText(text="hi")])
+    [call] = await execute(llm, [user], [tool])
+    assert call == LLMToolCallRequestEvent(
+        tool_call=dict(tool_call_id="call_0_0", name="convo_search_converse", arguments=dict(q=1))
+    )
+
+    assistant = AssistantMessage(content="", tool_calls=[call.tool_call])
+    response = ToolResponseMessage(logic_unit_name="x", name=tool.name, tool_call_id="call_0_0", result="")
+    assert await execute(llm, [user, assistant, response], [tool]) == [StringOutputEvent(content="done")]
+    # a new user turn starts the script over
+    assert len(await execute(llm, [user, assistant, response, user], [tool])) == 1
+
+
+async def test_unknown_tools_are_reported():
+    llm = unit(script=[dict(content="ok", tool_calls=[dict(name="missing")])])
+    with pytest.raises(ValueError, match="missing"):
+        await execute(llm, tools=[tool])
+
+
+async def test_structured_output_is_generated_from_schema():
+    schema = dict(type="object", properties=dict(name=dict(type="string"), tags=dict(type="array", items={})))
+    assert await execute(unit(), output_format=schema) == [ObjectOutputEvent(content=dict(name="mock", tags=[]))]
+    assert await execute(unit(script=[dict(object=dict(a=1))]), output_format=schema) == [
+        ObjectOutputEvent(content=dict(a=1))
+    ]
+
+
+def test_example_for_schema():
+    assert example_for_schema(dict(enum=["b", "c"])) == "b"
+    assert example_for_schema(dict(anyOf=[dict(type="integer"), dict(type="null")])) == 0
+    assert example_for_schema(dict(type="array", items=dict(type="boolean"), minItems=2)) == [False, False]
+
+
+async def test_latency_profile():
+    llm = unit(script=[dict(content="a b c d e")], time_to_first_token=0.05, tokens_per_second=100)
+    started = time.perf_counter()
+    await execute(llm)
+    assert 0.1 <= time.perf_counter() - started < 0.5
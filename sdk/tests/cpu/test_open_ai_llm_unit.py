@@ -0,0 +1,117 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import (
+    Choice,
+    ChoiceDelta,
+    ChoiceDeltaToolCall,
+    ChoiceDeltaToolCallFunction,
+)
+
+from eidolon_ai_client.events import LLMToolCallRequestEvent, ObjectOutputEvent, PartialObjectOutputEvent
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.cpu.call_context import CallContext
+from eidolon_ai_sdk.cpu.llm import open_ai_llm_unit
+from eidolon_ai_sdk.cpu.llm.open_ai_llm_unit import convert_to_openai, image_cache, OpenAIGPT, OpenAiGPTSpec
+from eidolon_ai_sdk.cpu.llm_message import UserMessage, UserMessageImageURL, UserMessageText
+
+
+@pytest.fixture
+async def image_message(machine, dog):
+    await AgentOS.file_memory.write_file("dog.png", dog.read())
+    image_cache.clear()
+    yield UserMessage(content=[UserMessageText(text="what is this?"), UserMessageImageURL(image_url="dog.png")])
+    image_cache.clear()
+
+
+async def test_images_are_scaled_once(image_message):
+    with patch.object(open_ai_llm_unit, "scale_image", wraps=open_ai_llm_unit.scale_image) as scale:
+        first = await convert_to_openai(image_message)
+        second = await convert_to_openai(image_message)
+    assert scale.call_count == 1
+    assert first == second
+    assert first["content"][1]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+
+
+async def test_changed_image_is_rescaled(image_message, cat):
+    with patch.object(open_ai_llm_unit, "scale_image", wraps=open_ai_llm_unit.scale_image) as scale:
+        dog = await convert_to_openai(image_message)
+        await AgentOS.file_memory.write_file("dog.png", cat.read())
+        cat_ = await convert_to_openai(image_message)
+    assert scale.call_count == 2
+    assert dog != cat_
+
+
+def llm(**kwargs):
+    return OpenAIGPT(processing_unit_locator=None, spec=OpenAiGPTSpec(**kwargs))
+
+
+async def execute(unit):
+    messages = [UserMessage(content=[UserMessageText(text="hi")])]
+    return [e async for e in unit.execute_llm(CallContext(process_id="p"), messages, [], dict(type="object"))]
+
+
+async def test_partial_objects_are_streamed(completions):
+    completions.object_chunks = ['{"name": "Jo', 'hn", "age"', ': 42, "tags"', ': ["a"]}']
+    events = await execute(llm(stream_partial_objects=True))
+    assert events == [
+        PartialObjectOutputEvent(content={"name": "John"}),
+        PartialObjectOutputEvent(content={"name": "John", "age": 42}),
+        ObjectOutputEvent(content={"name": "John", "age": 42, "tags": ["a"]}),
+    ]
+
+
+async def test_partial_objects_are_off_by_default(completions):
+    assert await execute(llm()) == [ObjectOutputEvent(content={"answer": 42})]
+
+
+async def test_malformed_partial_stops_partials(completions):
+    completions.object_chunks = ['{"a": 1,', ' "b": nope', ', "c": 2}']
+    events = []
+    messages = [UserMessage(content=[UserMessageText(text="hi")])]
+    stream = llm(stream_partial_objects=True, coalesce_requests=False).execute_llm(
+        CallContext(process_id="p"), messages, [], dict(type="object")
+    )
+    with pytest.raises(json.JSONDecodeError):
+        async for event in stream:
+            events.append(event)
+    # only the object before the malformed chunk was streamed, nothing after it
+    assert events == [PartialObjectOutputEvent(content={"a": 1})]
+
+
+async def test_identical_requests_share_a_call(completions):
+    first, second = await asyncio.gather(execute(llm()), execute(llm()))
+    assert first == second == [ObjectOutputEvent(content={"answer": 42})]
+    assert len(completions) == 1
+
+
+async def test_units_with_different_client_args_do_not_share_calls(completions):
+    first, second = llm(client_args=dict(api_key="a")), llm(client_args=dict(api_key="b"))
+    await asyncio.gather(execute(first), execute(second), execute(llm(stream_partial_objects=True)))
+    assert len(completions) == 3
+
+
+async def test_tool_calls_are_yielded_when_the_content_fails_to_parse(completions):
+    call = ChoiceDeltaToolCall(index=0, id="t1", function=ChoiceDeltaToolCallFunction(name="f", arguments='{"x": 1}'))
+    completions.object_chunks = [
+        ChatCompletionChunk(
+            id="1",
+            choices=[Choice(delta=ChoiceDelta(tool_calls=[call]), index=0)],
+            created=0,
+            model="gpt-4",
+            object="chat.completion.chunk",
+        ),
+        '{"answer": ',
+    ]
+    events = []
+    with pytest.raises(json.JSONDecodeError):
+        async for event in llm(force_json=True).execute_llm(
+            CallContext(process_id="p"), [UserMessage(content=[UserMessageText(text="hi")])], [], dict(type="object")
+        ):
+            events.append(event)
+    assert [(e.tool_call.tool_call_id, e.tool_call.arguments) for e in events] == [("t1", {"x": 1})]
+    assert all(isinstance(e, LLMToolCallRequestEvent) for e in events)
@@ -0,0 +1,83 @@
+import pytest
+from fastapi import Body
+from typing import Annotated
+
+from eidolon_ai_client.client import Agent
+from eidolon_ai_client.util import aiohttp
+from eidolon_ai_client.util.aiohttp import get_content_if_modified
+from eidolon_ai_sdk.agent.agent import register_program
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.cpu import remote_agent_cache
+from eidolon_ai_sdk.cpu.remote_agent_cache import RemoteAgentCache, _scoped_document
+
+
+class Baz:
+    @register_program()
+    async def init(self, name: Annotated[str, Body(embed=True)]):
+        """
+        init docs
+        """
+        return name
+
+
+@pytest.fixture(scope="module")
+async def server(run_app):
+    async with run_app(Baz) as ra:
+        yield ra
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    acc = []
+
+    async def fn(url, etag=None):
+        result = await get_content_if_modified(url, etag)
+        acc.append((url.rsplit("/", 1)[-1], result[0]))
+        return result
+
+    monkeypatch.setattr(remote_agent_cache, "get_content_if_modified", fn)
+    return acc
+
+
+async def test_schema_and_programs_have_etags(server):
+    url = AgentOS.current_machine_url() + "/openapi.json"
+    modified, content, etag = await get_content_if_modified(url)
+    assert modified and etag and "paths" in content
+    assert await aiohttp.get_content_if_modified(url, etag) == (False, None, etag)
+    modified, programs, etag = await get_content_if_modified(AgentOS.current_machine_url() + "/agents/Baz/programs")
+    assert (modified, programs) == (True, ["init"])
+
+
+async def test_documents_are_reused_within_ttl(server, fetches):
+    cache = RemoteAgentCache(ttl_seconds=60)
+    agent = Agent.get("Baz")
+    path = "/agents/Baz/processes/{process_id}/actions/init"
+    for _ in range(3):
+        assert await cache.programs(agent) == ["init"]
+        schema = await cache.endpoint_schema(agent.machine, path)
+    assert schema["description"].strip() == "init docs"
+    assert fetches == [("programs", True), ("openapi.json", True)]
+
+
+async def test_expired_documents_are_revalidated(server, fetches):
+    cache = RemoteAgentCache(ttl_seconds=0)
+    agent = Agent.get("Baz")
+    path = "/agents/Baz/processes/{process_id}/actions/init"
+    first = await cache.endpoint_schema(agent.machine, path)
+    assert await cache.endpoint_schema(agent.machine, path) is first
+    assert fetches == [("openapi.json", True), ("openapi.json", False)]
+
+
+def test_scoped_document_only_includes_referenced_components():
+    document = dict(
+        components=dict(
+            schemas=dict(
+                A=dict(type="object", properties=dict(b={"$ref": "#/components/schemas/B"})),
+                B=dict(type="string"),
+                Unused=dict(type="integer"),
+            )
+        )
+    )
+    node = dict(schema={"$ref": "#/components/schemas/A"})
+    scoped = _scoped_document(document, node)
+    assert set(scoped["components"]["schemas"]) == {"A", "B"}
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from chromadb.api.models.Collection import Collection
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.chroma_vector_store import ChromaVectorStore, ChromaVectorStoreConfig
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+
+
+@pytest.fixture
+async def store(machine, tmp_path):
+    store = ChromaVectorStore(ChromaVectorStoreConfig(url=f"file://{tmp_path}", max_batch_size=2, max_workers=2))
+    await store.start()
+    yield store
+    await store.stop()
+
+
+def doc(doc_id, *embedding, **metadata):
+    return EmbeddedDocument(id=doc_id, embedding=list(embedding), metadata=dict(metadata, n=int(doc_id)))
+
+
+async def ids(store, query, num_results=10):
+    return [r.id for r in await store.query_embedding("docs", query, num_results)]
+
+
+async def test_upserts_are_batched(store):
+    await store.add_embedding("docs", [doc(str(i), 1, i) for i in range(5)])
+    assert await ids(store, [1, 4], 2) == ["4", "3"]
+    assert await store.get_metadata("docs", ["2"]) == [dict(n=2)]
+    # batches sharing ids are upserted in order
+    await store.add_embedding("docs", [doc("1", 1, 0, v=1), doc("2", 1, 0), doc("1", 1, 10, v=2)])
+    assert await store.get_metadata("docs", ["1"]) == [dict(n=1, v=2)]
+    await store.delete_embedding("docs", ["4"])
+    assert await ids(store, [1, 10], 1) == ["1"]
+
+
+async def test_query_batch(store):
+    await store.add_embedding("docs", [doc(str(i), 1, i) for i in range(5)])
+    batch = await store.raw_query_batch("docs", [[1, 0], [1, 4]], 2, include_embeddings=True)
+    assert [[r.id for r in results] for results in batch] == [["0", "1"], ["4", "3"]]
+    assert batch[1][0].embedding == [1, 4]
+    assert batch[1] == await store.query_embedding("docs", [1, 4], 2, include_embeddings=True)
+
+
+async def test_calls_run_on_the_chroma_threads(store):
+    assert "chroma" in await store._run(lambda: threading.current_thread().name)
+    with pytest.raises(RuntimeError):
+        await store._run(next, iter([]))
+
+
+async def test_client_batch_size_is_read_on_the_chroma_threads_once(store, monkeypatch):
+    store.spec = store.spec.model_copy(update=dict(max_batch_size=None))
+    threads = []
+
+    def max_batch_size(client):
+        threads.append(threading.current_thread().name)
+        return 2
+
+    monkeypatch.setattr(type(store.client), "max_batch_size", property(max_batch_size))
+    for i in range(2):
+        await store.add_embedding("docs", [doc(str(j), 1, j) for j in range(3 * i, 3 * i + 3)])
+    assert len(threads) == 1 and "chroma" in threads[0]
+    assert len(await ids(store, [1, 0])) == 6
+
+
+async def test_concurrent_calls_create_the_collection_once(store):
+    await asyncio.gather(*(store.add_embedding("docs", [doc(str(i), 1, i)]) for i in range(8)))
+    assert sorted(await ids(store, [1, 0])) == [str(i) for i in range(8)]
+
+
+async def test_failed_calls_invalidate_the_collection(store):
+    await store.add_embedding("docs", [doc("1", 1, 0)])
+    cached = store._collections["docs"]
+    await store._run(store.client.delete_collection, "docs")
+    with pytest.raises(Exception):
+        await store.query_embedding("docs", [1, 0], 1)
+    assert "docs" not in store._collections
+    await store.add_embedding("docs", [doc("2", 1, 0)])
+    assert store._collections["docs"] is not cached
+    assert await ids(store, [1, 0]) == ["2"]
+
+
+async def test_where_is_translated_for_chroma(store):
+    await store.add_embedding(
+        "docs",
+        [
+            doc("1", 1, 0, source="docs/a.md", mime_type="text/markdown"),
+            doc("2", 1, 1, source="docs/api/b.py", mime_type="text/x-python"),
+            doc("3", 1, 2, source="src/c.py", mime_type="text/x-python"),
+        ],
+    )
+
+    async def ids_where(where):
+        return [r.id for r in await store.query_embedding("docs", [1, 0], 10, where)]
+
+    assert await ids_where(dict(source={"$prefix": "docs/"})) == ["1", "2"]
+    assert await ids_where(dict(source={"$prefix": "docs/"}, mime_type="text/x-python")) == ["2"]
+    assert await ids_where({"$or": [dict(source={"$prefix": "src/"}), dict(n={"$lte": 1})]}) == ["1", "3"]
+    assert await ids_where(dict(source={"$prefix": "missing/"})) == []
+    with pytest.raises(ValueError):
+        await ids_where(dict(n={"$prefix": "1"}))
+
+    # values are shared by every worker using the database, so each sees the files the others added once its cached
+    # values expire
+    worker = ChromaVectorStore(store.spec.model_copy(update=dict(metadata_values_ttl=0)))
+    await worker.start()
+    assert [r.id for r in await worker.query_embedding("docs", [1, 0], 10, dict(source={"$prefix": "src/"}))] == ["3"]
+    await store.add_embedding("docs", [doc("4", 1, 3, source="src/d.py")])
+    assert [r.id for r in await worker.query_embedding("docs", [1, 0], 10, dict(source={"$prefix": "src/"}))] == [
+        "3",
+        "4",
+    ]
+    await worker.stop()
+
+
+async def test_values_are_cached_between_queries(store, monkeypatch):
+    await store.add_embedding("docs", [doc("1", 1, 0, source="docs/a.md")])
+
+    async def ids_where(where):
+        return [r.id for r in await store.query_embedding("docs", [1, 0], 10, where)]
+
+    assert await ids_where(dict(source={"$prefix": "docs/"})) == ["1"]
+    finds = []
+    find = AgentOS.symbolic_memory.find
+
+    def counting_find(*args, **kwargs):
+        finds.append(args)
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(AgentOS.symbolic_memory, "find", counting_find)
+    # values this worker records are added to its cached values
+    await store.add_embedding("docs", [doc("2", 1, 1, source="docs/b.md"), doc("3", 1, 2, source="docs/a.md")])
+    assert await ids_where(dict(source={"$prefix": "docs/"})) == ["1", "2", "3"]
+    assert store._values["docs"][1]["source"] == ["docs/a.md", "docs/b.md"]
+    assert finds == []
+
+
+async def test_values_of_existing_collections_are_recorded_once(store):
+    await store.add_embedding("docs", [doc("1", 1, 0, source="docs/a.md")])
+    await AgentOS.symbolic_memory.delete(store.spec.metadata_values_collection, {})
+    worker = ChromaVectorStore(store.spec)
+    await worker.start()
+    with patch.object(Collection, "get", autospec=True, side_effect=Collection.get) as get:
+        for _ in range(2):
+            results = await worker.query_embedding("docs", [1, 0], 10, dict(source={"$prefix": "docs/"}))
+            assert [r.id for r in results] == ["1"]
+    assert get.call_count == 1
+    await worker.stop()
@@ -0,0 +1,249 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from openai import RateLimitError
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.document import Document
+from eidolon_ai_sdk.memory.embeddings import (
+    Embedding,
+    EmbeddingSpec,
+    HashingEmbedding,
+    HashingEmbeddingSpec,
+    OpenAIEmbedding,
+    OpenAIEmbeddingSpec,
+)
+
+
+class BatchEmbedding(Embedding):
+    def __init__(self, **kwargs):
+        super().__init__(EmbeddingSpec(**kwargs))
+        self.batches = []
+        self.running = 0
+        self.max_running = 0
+
+    async def create_embedding(self, text, **kwargs):
+        return (await self.create_embeddings([text]))[0]
+
+    async def create_embeddings(self, texts, **kwargs):
+        self.batches.append(texts)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        # later batches finish first
+        await asyncio.sleep(0.05 / len(self.batches))
+        self.running -= 1
+        return [[float(len(t))] for t in texts]
+
+
+def docs(*texts):
+    return [Document(id=str(i), page_content=t) for i, t in enumerate(texts)]
+
+
+async def test_batches_are_bounded_by_inputs_and_tokens():
+    embedding = BatchEmbedding(max_batch_inputs=3, max_batch_tokens=10)
+    texts = ["a", "b", "c", "d", "x" * 36, "e"]
+    result = [d async for d in embedding.embed(docs(*texts))]
+    assert [d.id for d in result] == [str(i) for i in range(6)]
+    assert [d.embedding for d in result] == [[float(len(t))] for t in texts]
+    assert embedding.batches == [["a", "b", "c"], ["d"], ["x" * 36], ["e"]]
+
+
+async def test_batches_run_concurrently():
+    embedding = BatchEmbedding(max_batch_inputs=2, max_concurrent_batches=3)
+    result = [d async for d in embedding.embed(docs(*"abcdefghij"))]
+    assert len(result) == 10
+    assert embedding.max_running == 3
+
+
+class LegacyEmbedding(Embedding):
+    async def embed_text(self, text, **kwargs):
+        return [float(len(text))]
+
+
+async def test_embedders_overriding_embed_text_still_embed():
+    embedding = LegacyEmbedding(EmbeddingSpec(cache_directory=None))
+    assert [d.embedding async for d in embedding.embed(docs("a", "bb"))] == [[1.0], [2.0]]
+    assert await embedding.embed_texts(["ccc"]) == [[3.0]]
+    with pytest.raises(NotImplementedError):
+        await Embedding(EmbeddingSpec(cache_directory=None)).create_embedding("a")
+
+
+class FakeEmbeddings:
+    def __init__(self, failures=0):
+        self.calls = []
+        self.failures = failures
+
+    async def create(self, input, model):
+        self.calls.append(input)
+        if self.failures:
+            self.failures -= 1
+            response = SimpleNamespace(status_code=429, headers={"retry-after-ms": "1"}, request=None)
+            raise RateLimitError("rate limited", response=response, body=None)
+        texts = [input] if isinstance(input, str) else input
+        data = [SimpleNamespace(index=i, embedding=[float(len(t))]) for i, t in enumerate(texts)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+@pytest.fixture
+def openai_embedding(monkeypatch):
+    def fn(failures=0):
+        embedding = OpenAIEmbedding(OpenAIEmbeddingSpec(max_batch_inputs=2))
+        fake = FakeEmbeddings(failures)
+        monkeypatch.setattr(OpenAIEmbedding, "llm", SimpleNamespace(embeddings=fake))
+        return embedding, fake
+
+    return fn
+
+
+async def test_open_ai_embeds_batches_in_one_request(openai_embedding):
+    embedding, fake = openai_embedding()
+    result = [d.embedding async for d in embedding.embed(docs("a", "bb", "ccc"))]
+    assert result == [[1.0], [2.0], [3.0]]
+    assert fake.calls == [["a", "bb"], "ccc"]
+
+
+async def test_open_ai_retries_rate_limited_batches(openai_embedding):
+    embedding, fake = openai_embedding(failures=1)
+    assert await embedding.create_embeddings(["a", "bb"]) == [[1.0], [2.0]]
+    assert len(fake.calls) == 2
+
+
+def test_open_ai_client_leaves_retries_to_the_scheduler():
+    assert OpenAIEmbedding(OpenAIEmbeddingSpec()).llm.max_retries == 0
+
+
+async def test_embed_text_is_cached():
+    embedding = BatchEmbedding()
+    assert await embedding.embed_text("abc") == [3.0]
+    assert await embedding.embed_text("abc") == [3.0]
+    assert embedding.batches == [["abc"]]
+
+
+async def test_embed_only_creates_uncached_embeddings():
+    embedding = BatchEmbedding()
+    await embedding.embed_text("bb")
+    result = [d.embedding async for d in embedding.embed(docs("a", "bb", "ccc", "bb"))]
+    assert result == [[1.0], [2.0], [3.0], [2.0]]
+    assert embedding.batches == [["bb"], ["a", "ccc"]]
+
+
+async def test_embed_texts_creates_identical_texts_once():
+    embedding = BatchEmbedding()
+    assert await embedding.embed_texts(["a", "bb", "a", "ccc"]) == [[1.0], [2.0], [1.0], [3.0]]
+    assert embedding.batches == [["a", "bb", "ccc"]]
+
+
+async def test_cache_is_bounded():
+    embedding = BatchEmbedding(cache_size=1)
+    await embedding.embed_text("a")
+    await embedding.embed_text("b")
+    await embedding.embed_text("a")
+    assert embedding.batches == [["a"], ["b"], ["a"]]
+
+
+async def test_cache_is_not_persisted_by_default(machine):
+    await BatchEmbedding().embed_text("abc")
+    restarted = BatchEmbedding()
+    await restarted.embed_text("abc")
+    assert restarted.batches == [["abc"]]
+    assert not await AgentOS.file_memory.exists("embedding_cache")
+
+
+async def test_cache_is_persisted_in_file_memory_segments(machine):
+    await BatchEmbedding(cache_directory="embedding_cache").embed_texts(["a", "bb", "ccc"])
+    restarted = BatchEmbedding(cache_directory="embedding_cache")
+    result = [d.embedding async for d in restarted.embed(docs("bb", "abc", "de", "a"))]
+    assert result == [[2.0], [3.0], [2.0], [1.0]]
+    assert restarted.batches == [["abc", "de"]]
+    # a segment of two files per batch, rather than a file per embedding
+    files = await AgentOS.file_memory.glob(f"embedding_cache/{restarted.cache_namespace()}/*.*")
+    assert sorted(str(f).rsplit(".", 1)[-1] for f in files) == ["keys", "keys", "vectors", "vectors"]
+
+
+async def test_cache_holds_float32_arrays():
+    embedding = BatchEmbedding()
+    await embedding.embed_text("abc")
+    (cached,) = embedding._cache._entries.values()
+    assert cached.dtype == np.float32
+    assert await embedding.embed_text("abc") == [3.0]
+
+
+async def test_misses_only_list_the_directory_after_it_changes(machine, monkeypatch):
+    embedding = BatchEmbedding(cache_directory="embedding_cache")
+    await embedding.embed_text("listed a")
+    globs = []
+    glob = AgentOS.file_memory.glob
+
+    async def counting_glob(pattern):
+        globs.append(pattern)
+        return await glob(pattern)
+
+    monkeypatch.setattr(AgentOS.file_memory, "glob", counting_glob)
+    await embedding.embed_text("listed bb")
+    await embedding.embed_text("listed ccc")
+    assert globs == []
+    await BatchEmbedding(cache_directory="embedding_cache").embed_text("listed dddd")
+    globs.clear()
+    assert await embedding.embed_text("listed dddd") == [11.0]
+    assert embedding.batches == [["listed a"], ["listed bb"], ["listed ccc"]]
+    assert len(globs) == 1
+
+
+async def test_small_segments_are_merged(machine):
+    embedding = BatchEmbedding(cache_directory="embedding_cache")
+    texts = [f"merged {i}" for i in range(20)]
+    for text in texts:
+        await embedding.embed_text(text)
+    files = await AgentOS.file_memory.glob(f"embedding_cache/{embedding.cache_namespace()}/*.keys")
+    assert len(files) < 16
+    restarted = BatchEmbedding(cache_directory="embedding_cache")
+    assert await restarted.embed_texts(texts) == [[float(len(t))] for t in texts]
+    assert restarted.batches == []
+
+
+async def test_segments_written_by_other_workers_are_read(machine):
+    embedding = BatchEmbedding(cache_directory="embedding_cache")
+    await embedding.embed_text("first worker")
+    await BatchEmbedding(cache_directory="embedding_cache").embed_text("second worker")
+    assert await embedding.embed_text("second worker") == [13.0]
+    assert embedding.batches == [["first worker"]]
+
+
+async def test_cache_is_keyed_by_model(openai_embedding):
+    embedding, fake = openai_embedding()
+    other = OpenAIEmbedding(OpenAIEmbeddingSpec(model="text-embedding-3-small"))
+    await embedding.embed_text("a")
+    await other.embed_text("a")
+    await embedding.embed_text("a")
+    assert fake.calls == ["a", "a"]
+
+
+def similarity(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+async def test_hashing_embedding_is_deterministic_and_normalized():
+    embedding = HashingEmbedding(HashingEmbeddingSpec(dimensions=64))
+    vector = await embedding.create_embedding("The quick brown fox")
+    assert len(vector) == 64
+    assert vector == await HashingEmbedding(HashingEmbeddingSpec(dimensions=64)).create_embedding("the quick brown fox")
+    assert similarity(vector, vector) == pytest.approx(1.0)
+
+
+async def test_hashing_embedding_batches_match_single_texts():
+    embedding = HashingEmbedding(HashingEmbeddingSpec())
+    texts = ["how do I reset my password", "resetting passwords", "", "quarterly revenue report"]
+    assert await embedding.create_embeddings(texts) == [await embedding.create_embedding(t) for t in texts]
+
+
+async def test_hashing_embedding_ranks_related_text_higher():
+    embedding = HashingEmbedding(HashingEmbeddingSpec())
+    query, related, unrelated = [
+        d.embedding
+        async for d in embedding.embed(
+            docs("how do I reset my password", "steps to reset a forgotten password", "quarterly revenue report")
+        )
+    ]
+    assert similarity(query, related) > similarity(query, unrelated)
@@ -0,0 +1,188 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+from eidolon_ai_sdk.memory.hnsw import HnswIndex
+from eidolon_ai_sdk.memory.hnsw_vector_store import HnswParams, HnswVectorStore, HnswVectorStoreSpec
+
+DIMENSIONS = 16
+
+
+@pytest.fixture
+def store_fn(tmp_path):
+    def fn(**kwargs):
+        kwargs.setdefault("index", HnswParams(m=8, ef_construction=64, ef_search=32))
+        return HnswVectorStore(HnswVectorStoreSpec(root_dir=str(tmp_path), exact_search_limit=0, **kwargs))
+
+    return fn
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return np.random.default_rng(0).standard_normal((400, DIMENSIONS)).astype(np.float32)
+
+
+def docs(vectors, start=0):
+    return [
+        EmbeddedDocument(id=str(i), embedding=v.tolist(), metadata=dict(even=i % 2 == 0))
+        for i, v in enumerate(vectors, start)
+    ]
+
+
+def exact(vectors, query, k, rows=None):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ query
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    return [str(r) for r in rows[np.argsort(-scores[rows])[:k]]]
+
+
+async def ids(store, query, k=10, where=None):
+    return [r.id for r in await store.query_embedding("c", query.tolist(), k, where)]
+
+
+async def indexed(store):
+    await asyncio.gather(*store._indexers.values())
+
+
+def recall(found, expected):
+    return len(set(found) & set(expected)) / len(expected)
+
+
+async def test_search_recall(store_fn, vectors):
+    store = store_fn()
+    await store.add_embedding("c", docs(vectors))
+    await indexed(store)
+    queries = np.random.default_rng(1).standard_normal((20, DIMENSIONS)).astype(np.float32)
+    recalls = [recall(await ids(store, q), exact(vectors, q, 10)) for q in queries]
+    assert np.mean(recalls) >= 0.9
+    results = await store.query_embedding("c", vectors[3].tolist(), 3)
+    assert results[0].id == "3"
+    assert results[0].score == pytest.approx(0, abs=1e-6)
+    assert results[0].score <= results[1].score <= results[2].score
+
+
+async def test_query_batch_matches_single_queries(store_fn, vectors):
+    store = store_fn()
+    await store.add_embedding("c", docs(vectors))
+    await indexed(store)
+    queries = vectors[:5].tolist()
+    batch = await store.query_embedding_batch("c", queries, 5, dict(even=True), ef_search=16)
+    assert batch == [await store.query_embedding("c", q, 5, dict(even=True), ef_search=16) for q in queries]
+
+
+async def test_filters_and_deletes(store_fn, vectors):
+    store = store_fn(compaction_threshold=1)
+    await store.add_embedding("c", docs(vectors))
+    await store.delete_embedding("c", ["3", "5"])
+    await indexed(store)
+    found = await ids(store, vectors[3], where=dict(even=False))
+    assert len(found) == 10
+    assert all(int(i) % 2 == 1 for i in found)
+    assert "3" not in found and "5" not in found
+
+
+async def test_selective_filters_are_searched_exactly(store_fn, vectors):
+    store = store_fn()
+    await store.add_embedding("c", docs(vectors))
+    store.spec.exact_search_limit = 10
+    where = dict(even={"$in": []})
+    assert await ids(store, vectors[0], where=where) == []
+    assert await ids(store, vectors[0], where={"$or": [where, dict(even=True)]}) == exact(
+        vectors, vectors[0], 10, range(0, 400, 2)
+    )
+
+
+async def test_index_is_saved_and_extended_on_load(store_fn, vectors, tmp_path):
+    store = store_fn(checkpoint_rows=1000)
+    await store.add_embedding("c", docs(vectors[:300]))
+    await indexed(store)
+    await store.stop()
+    # rows added after the last save are indexed when the collection is loaded
+    await store.add_embedding("c", docs(vectors[300:], 300))
+    restarted = store_fn()
+    assert await ids(restarted, vectors[350], 1) == ["350"]
+    await indexed(restarted)
+    collection = await restarted._get_collection("c")
+    assert len(collection.indexed[1]) == 400
+    assert collection.saved == 300
+    with open(tmp_path / "c" / "0.hnsw", "rb") as f:
+        assert len(HnswIndex.load(dict(np.load(f)))) == 300
+
+
+async def test_compaction_keeps_the_index(store_fn, vectors, tmp_path):
+    store = store_fn(compaction_threshold=0.5)
+    await store.add_embedding("c", docs(vectors[:100]))
+    await indexed(store)
+    await store.delete_embedding("c", [str(i) for i in range(50)])
+    await asyncio.wait(store._compactions)
+    # the index was renumbered with the rows, there is nothing left to index
+    assert (await store._get_collection("c")).unindexed() == 0
+    await store.stop()
+    assert sorted(p.name for p in (tmp_path / "c").iterdir()) == ["1.hnsw", "1.log", "1.vectors", "CURRENT"]
+    collection = await store._get_collection("c")
+    assert collection.indexed[0] == 1
+    assert len(collection.indexed[1]) == 50
+    assert await ids(store, vectors[60], 1) == ["60"]
+
+
+async def test_rows_are_searched_exactly_until_indexed(store_fn, vectors):
+    store = store_fn()
+    await store.add_embedding("c", docs(vectors[:200]))
+    await indexed(store)
+    await store.add_embedding("c", docs(vectors[200:], 200))
+    collection = await store._get_collection("c")
+    assert collection.covered < 400
+    assert await ids(store, vectors[350], 1) == ["350"]
+    await indexed(store)
+    assert collection.covered == len(collection.indexed[1]) == 400
+    assert await ids(store, vectors[350], 1) == ["350"]
+
+
+async def test_rows_added_before_a_compaction_are_indexed_after_it(store_fn, vectors, monkeypatch):
+    store = store_fn(compaction_threshold=0.5)
+    await store.add_embedding("c", docs(vectors[:100]))
+    await indexed(store)
+    with monkeypatch.context() as m:
+        m.setattr(store, "_schedule_indexing", lambda collection: None)
+        await store.add_embedding("c", docs(vectors[100:110], 100))
+        await store.delete_embedding("c", [str(i) for i in range(60)])
+        await asyncio.wait(store._compactions)
+    collection = await store._get_collection("c")
+    # the 40 indexed rows left are the first rows of the new generation, the 10 after them are searched exactly
+    assert collection.indexed[0] == 1 and collection.covered == 40
+    assert await ids(store, vectors[105], 1) == ["105"]
+    await indexed(store)
+    assert collection.covered == 50
+    assert await ids(store, vectors[105], 1) == ["105"]
+    assert await ids(store, vectors[70], 1) == ["70"]
+
+
+def test_index_round_trip(vectors):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = HnswIndex(m=4, ef_construction=16)
+    index.add(normalized, len(normalized))
+    loaded = HnswIndex.load(index.save())
+    assert all(loaded.neighbors(n) == index.neighbors(n) for n in range(len(normalized)))
+    assert loaded.entry_points == index.entry_points
+    assert loaded.search(normalized, normalized[7], 5, 16) == index.search(normalized, normalized[7], 5, 16)
+
+
+def test_compacted_index_keeps_its_recall(vectors):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = HnswIndex(m=8, ef_construction=64)
+    index.add(normalized, len(normalized))
+    keep = np.random.default_rng(2).random(len(normalized)) >= 0.3
+    compacted = index.compacted(keep, normalized[keep])
+    assert len(compacted) == np.count_nonzero(keep)
+    kept = np.flatnonzero(keep)
+    queries = np.random.default_rng(3).standard_normal((20, DIMENSIONS)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    recalls = [
+        recall([str(kept[r]) for _, r in compacted.search(normalized[keep], q, 10, 32)], exact(vectors, q, 10, kept))
+        for q in queries
+    ]
+    assert np.mean(recalls) >= 0.9
+    # rows link to the kept rows only, renumbered
+    assert all(0 <= n < len(compacted) for node in range(len(compacted)) for n in compacted.neighbors(node))
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.memory.document import Document
+from eidolon_ai_sdk.memory.lexical_index import LexicalIndex, LexicalIndexSpec, tokenize
+
+DOCS = {
+    "parser": "def parseHttpRequest(raw): raise ValueError('E1042 malformed header')",
+    "client": "class HttpClient: sends requests and retries on timeouts",
+    "readme": "The http client retries requests. See the parser for header handling.",
+    "cli": "command line entry point, reads arguments and prints results",
+}
+
+
+def docs(**texts):
+    return [Document(id=doc_id, page_content=text) for doc_id, text in texts.items()]
+
+
+@pytest.fixture
+def index_fn(machine, request):
+    # file memory is shared by the tests of a module
+    def fn(**kwargs):
+        return LexicalIndex(request.node.name, LexicalIndexSpec(shards=4, **kwargs))
+
+    return fn
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("parseHttpRequest E1042 snake_case") == [
+        "parsehttprequest",
+        "parse",
+        "http",
+        "request",
+        "e1042",
+        "e",
+        "1042",
+        "snake_case",
+        "snake",
+        "case",
+    ]
+
+
+async def test_search_ranks_rare_terms_and_identifiers(index_fn):
+    index = index_fn()
+    await index.add(docs(**DOCS))
+    assert [doc_id for doc_id, _ in await index.search("E1042", 3)] == ["parser"]
+    assert [doc_id for doc_id, _ in await index.search("parseHttpRequest", 3)][0] == "parser"
+    results = await index.search("http client retries", 2)
+    assert [doc_id for doc_id, _ in results] == ["client", "readme"]
+    assert results[0][1] > results[1][1] > 0
+    assert await index.search("unknown words", 3) == []
+
+
+async def test_updates_are_incremental_and_persisted(index_fn):
+    index = index_fn()
+    await index.add(docs(**DOCS))
+    await index.remove(["client", "missing"])
+    await index.add(docs(cli="an http timeout handler"))
+    assert [doc_id for doc_id, _ in await index.search("timeouts timeout", 5)] == ["cli"]
+    assert [doc_id for doc_id, _ in await index.search("http", 5)] == ["cli", "readme", "parser"]
+    assert "retries" in index.vocabulary and "sends" not in index.vocabulary
+
+    restarted = index_fn()
+    assert await restarted.search("http", 5) == await index.search("http", 5)
+    assert restarted.vocabulary == index.vocabulary
+    assert len(await AgentOS.file_memory.glob(f"{index.directory}/postings/*")) <= 4
+
+
+async def test_concurrent_updates_are_written_together(index_fn):
+    index = index_fn()
+    await asyncio.gather(*(index.add(docs(**{doc_id: text})) for doc_id, text in DOCS.items()), index.remove(["cli"]))
+    assert set(index.numbers) == {"parser", "client", "readme"}
+    assert [doc_id for doc_id, _ in await index.search("arguments", 5)] == []
+
+
+async def test_search_filters_metadata(index_fn):
+    index = index_fn()
+    await index.add(
+        [
+            Document(id="a", page_content="http client", metadata=dict(source="src/client.py")),
+            Document(id="b", page_content="http client http", metadata=dict(source="docs/client.md")),
+        ]
+    )
+    assert [doc_id for doc_id, _ in await index.search("http", 5)] == ["b", "a"]
+    assert [doc_id for doc_id, _ in await index.search("http", 5, dict(source={"$prefix": "src/"}))] == ["a"]
+    assert [doc_id for doc_id, _ in await index_fn().search("http", 5, dict(source="docs/client.md"))] == ["b"]
+
+
+async def test_searches_read_cached_shards(index_fn, monkeypatch):
+    index = index_fn()
+    await index.add(docs(**DOCS))
+    reads = []
+    read_file = AgentOS.file_memory.read_file
+
+    async def counting_read(path):
+        reads.append(path)
+        return await read_file(path)
+
+    monkeypatch.setattr(AgentOS.file_memory, "read_file", counting_read)
+    for _ in range(3):
+        assert [doc_id for doc_id, _ in await index.search("http client retries", 2)] == ["client", "readme"]
+    assert reads == []
+    assert index.lengths[index.numbers["cli"]] == 9
+
+
+async def test_document_table_is_logged_and_folded_into_snapshots(index_fn):
+    index = index_fn()
+    await index.add(docs(**DOCS))
+    await index.remove(["cli"])
+    assert not await AgentOS.file_memory.exists(f"{index.directory}/docs.json")
+    assert len(await AgentOS.file_memory.glob(f"{index.directory}/docs/*.json")) == 2
+    restarted = index_fn()
+    assert await restarted.search("http", 5) == await index.search("http", 5)
+    assert set(restarted.numbers) == {"parser", "client", "readme"}
+
+    # once the log holds more entries than there are documents, it is folded into a snapshot
+    await index.add([Document(id=str(i), page_content=f"word{i}") for i in range(1100)])
+    await index.remove([str(i) for i in range(100)])
+    assert await AgentOS.file_memory.exists(f"{index.directory}/docs.json")
+    # the removes were logged after the snapshot of the adds, and the last batch folded is kept
+    assert len(await AgentOS.file_memory.glob(f"{index.directory}/docs/*.json")) == 2
+    await index.add(docs(extra="an http extra"))
+    restarted = index_fn()
+    assert await restarted.search("http", 5) == await index.search("http", 5)
+    assert restarted.numbers == index.numbers
+    assert restarted.total_length == index.total_length
+
+
+async def test_searches_apply_batches_of_other_workers(index_fn, monkeypatch):
+    index, other = index_fn(), index_fn()
+    await index.add(docs(**DOCS))
+    assert [doc_id for doc_id, _ in await other.search("http", 5)] == ["client", "readme", "parser"]
+    await index.remove(["client"])
+    await index.add(docs(cli="an http command line"))
+    assert await other.search("http", 5) == await index.search("http", 5)
+    assert "client" not in other.numbers
+
+    # folded into a snapshot past the batches the other worker applied
+    await index.remove(["cli"])
+    await index.add([Document(id=str(i), page_content=f"word{i}") for i in range(1100)])
+    await index.add(docs(extra="an http extra"))
+    resets = []
+    monkeypatch.setattr(other, "_reset", lambda reset=other._reset: resets.append(1) or reset())
+    assert await other.search("http", 5) == await index.search("http", 5)
+    assert other.numbers == index.numbers
+    assert other.total_length == index.total_length
+    assert resets == [1]
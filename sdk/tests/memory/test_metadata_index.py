@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+from eidolon_ai_sdk.memory.metadata_index import MetadataIndex, matches
+from eidolon_ai_sdk.memory.numpy_vector_store import NumpyVectorStore, NumpyVectorStoreSpec
+
+METADATA = [
+    dict(source="docs/a.md", mime_type="text/markdown", tenant="t1"),
+    dict(source="docs/api/b.py", mime_type="text/x-python", tenant="t1"),
+    dict(source="docs/api/c.py", mime_type="text/x-python", tenant="t2"),
+    dict(source="src/d.py", mime_type="text/x-python"),
+    dict(source="docs/apiary.md", mime_type="text/markdown", tenant="t2", page=3),
+]
+
+
+@pytest.fixture
+def index():
+    index = MetadataIndex(["source", "mime_type", "tenant"])
+    index.add(range(len(METADATA)), METADATA)
+    return index
+
+
+def rows(index, where):
+    found, rest = index.plan(where)
+    return None if found is None else found.tolist(), rest
+
+
+@pytest.mark.parametrize(
+    "where, expected",
+    [
+        (dict(tenant="t1"), [0, 1]),
+        (dict(mime_type={"$in": ["text/markdown", "text/html"]}), [0, 4]),
+        (dict(source={"$prefix": "docs/api/"}), [1, 2]),
+        (dict(source={"$prefix": "docs/api"}), [1, 2, 4]),
+        (dict(source={"$prefix": "nothing/"}), []),
+        ({"$and": [dict(tenant="t2"), dict(mime_type={"$eq": "text/x-python"})]}, [2]),
+        ({"$or": [dict(tenant="t1"), dict(source={"$prefix": "src/"})]}, [0, 1, 3]),
+    ],
+)
+def test_indexed_conditions_are_answered_from_postings(index, where, expected):
+    assert rows(index, where) == (expected, None)
+    assert [i for i, m in enumerate(METADATA) if matches(m, where)] == expected
+
+
+def test_other_conditions_are_left_to_check(index):
+    assert rows(index, dict(page={"$gt": 1})) == (None, dict(page={"$gt": 1}))
+    assert rows(index, dict(tenant="t2", page=3)) == ([2, 4], dict(page=3))
+    where = {"$or": [dict(tenant="t1"), dict(page=3)]}
+    assert rows(index, where) == (None, where)
+    assert rows(index, dict(tenant={"$ne": "t1"})) == (None, dict(tenant={"$ne": "t1"}))
+
+
+def test_values_of_different_types_are_kept_apart():
+    metadata = [dict(flag=True), dict(flag=1), dict(flag=1.0), dict(flag="1")]
+    index = MetadataIndex(["flag"])
+    index.add(range(len(metadata)), metadata)
+    for where, expected in [
+        (dict(flag=True), [0]),
+        (dict(flag={"$eq": 1}), [1]),
+        (dict(flag={"$in": [1.0, "1"]}), [2, 3]),
+    ]:
+        assert rows(index, where) == (expected, None)
+        assert [i for i, m in enumerate(metadata) if matches(m, where)] == expected
+
+
+def test_new_values_are_found_by_prefix(index):
+    index.add([5], [dict(source="docs/api/e.py")])
+    assert rows(index, dict(source={"$prefix": "docs/api/"})) == ([1, 2, 5], None)
+
+
+async def test_store_filters_indexed_metadata(tmp_path):
+    store = NumpyVectorStore(NumpyVectorStoreSpec(root_dir=str(tmp_path), indexed_metadata=["source", "tenant"]))
+    docs = [EmbeddedDocument(id=str(i), embedding=[1, i], metadata=m) for i, m in enumerate(METADATA)]
+    await store.add_embedding("c", docs)
+    await store.delete_embedding("c", ["1"])
+
+    async def ids(where):
+        return [r.id for r in await store.query_embedding("c", [1, 0], 10, where)]
+
+    assert await ids(dict(source={"$prefix": "docs/api/"})) == ["2"]
+    assert await ids(dict(tenant="t2", page={"$gte": 3})) == ["4"]
+    assert await ids(dict(mime_type="text/x-python")) == ["2", "3"]
+
+    collection = await store._get_collection("c")
+    assert np.array_equal(collection.snapshot.index.postings["tenant"][str, "t1"], [0, 1])
+    await store._compact(collection)
+    assert collection.snapshot.index.postings["tenant"] == {(str, "t1"): [0], (str, "t2"): [1, 3]}
+    assert await ids(dict(tenant={"$in": ["t1", "t3"]})) == ["0"]
+    restarted = NumpyVectorStore(NumpyVectorStoreSpec(root_dir=str(tmp_path), indexed_metadata=["source", "tenant"]))
+    assert [r.id for r in await restarted.query_embedding("c", [1, 0], 10, dict(tenant="t2"))] == ["2", "4"]
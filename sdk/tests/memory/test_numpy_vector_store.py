@@ -0,0 +1,119 @@
+import pytest
+
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+from eidolon_ai_sdk.memory.numpy_vector_store import NumpyVectorStore, NumpyVectorStoreSpec, matches
+
+
+@pytest.fixture
+def store_fn(tmp_path):
+    def fn(**kwargs):
+        return NumpyVectorStore(NumpyVectorStoreSpec(root_dir=str(tmp_path), **kwargs))
+
+    return fn
+
+
+def doc(doc_id, *embedding, **metadata):
+    return EmbeddedDocument(id=doc_id, embedding=list(embedding), metadata=metadata)
+
+
+async def ids(store, query, num_results=10, where=None):
+    return [r.id for r in await store.query_embedding("c", query, num_results, where)]
+
+
+async def test_query_returns_closest_documents_first(store_fn):
+    store = store_fn()
+    await store.add_embedding("c", [doc("a", 1, 0), doc("b", 1, 1), doc("c", 0, 1), doc("d", -1, 0)])
+    results = await store.query_embedding("c", [2, 0], 2, include_embeddings=True)
+    assert [r.id for r in results] == ["a", "b"]
+    assert results[0].score == pytest.approx(0)
+    assert results[1].score == pytest.approx(1 - 2**-0.5)
+    assert results[1].embedding == pytest.approx([2**-0.5, 2**-0.5])
+    assert await ids(store, [0, 1]) == ["c", "b", "a", "d"]
+
+
+async def test_missing_collection_is_empty(store_fn):
+    store = store_fn()
+    assert await store.query_embedding("missing", [1, 0], 3) == []
+    assert await store.get_metadata("missing", ["a"]) == [None]
+
+
+async def test_upsert_and_delete(store_fn):
+    store = store_fn(compaction_threshold=1)
+    await store.add_embedding("c", [doc("a", 1, 0, v=1), doc("b", 0, 1), doc("a", 0, 1, v=2)])
+    assert await ids(store, [1, 0]) == ["b", "a"]
+    assert await store.get_metadata("c", ["a", "b"]) == [dict(v=2), {}]
+    await store.add_embedding("c", [doc("b", 1, 0)])
+    await store.delete_embedding("c", ["a", "missing"])
+    assert await ids(store, [1, 0]) == ["b"]
+
+
+async def test_metadata_where(store_fn):
+    store = store_fn()
+    await store.add_embedding("c", [doc("a", 1, 0, kind="x", n=1), doc("b", 1, 1, kind="y", n=2), doc("c", 0, 1)])
+    assert await ids(store, [1, 0], where=dict(kind="y")) == ["b"]
+    assert await ids(store, [1, 0], where=dict(n={"$gte": 1})) == ["a", "b"]
+    assert await ids(store, [1, 0], where={"$or": [dict(kind="y"), dict(n={"$lt": 2})]}) == ["a", "b"]
+
+
+async def test_query_batch_matches_single_queries(store_fn):
+    store = store_fn()
+    await store.add_embedding("c", [doc("a", 1, 0, n=1), doc("b", 1, 1, n=2), doc("c", 0, 1, n=3), doc("d", -1, 0)])
+    queries = [[1, 0], [0, 1], [-1, -1]]
+    for where in [None, dict(n={"$gte": 2})]:
+        batch = await store.query_embedding_batch("c", queries, 2, where)
+        assert batch == [await store.query_embedding("c", q, 2, where) for q in queries]
+    assert await store.query_embedding_batch("c", [], 2) == []
+    assert await store.query_embedding_batch("missing", queries, 2) == [[], [], []]
+
+
+def test_matches():
+    assert matches(dict(a=1, b="x"), {"$and": [dict(a={"$in": [1, 2]}), dict(b={"$ne": "y"})]})
+    assert not matches(dict(a=1), dict(a={"$nin": [1]}))
+    assert not matches({}, dict(a={"$gt": 1}))
+    assert not matches(dict(a="x"), dict(a={"$gt": 1}))
+
+
+async def test_collections_are_reloaded_after_a_restart(store_fn):
+    store = store_fn(compaction_threshold=1)
+    await store.add_embedding("c", [doc("a", 1, 0, v=1), doc("b", 0, 1), doc("c", 1, 1)])
+    await store.add_embedding("c", [doc("a", 1, 0.1, v=2)])
+    await store.delete_embedding("c", ["b"])
+
+    restarted = store_fn()
+    assert await ids(restarted, [1, 0]) == ["a", "c"]
+    assert await restarted.get_metadata("c", ["a", "b"]) == [dict(v=2), None]
+
+
+async def test_rows_missing_from_the_log_are_ignored(store_fn, tmp_path):
+    store = store_fn()
+    await store.add_embedding("c", [doc("a", 1, 0)])
+    # a crash after writing vectors, but before writing the log
+    with open(tmp_path / "c" / "0.vectors", "ab") as f:
+        f.write(b"\0" * 6)
+    restarted = store_fn()
+    await restarted.add_embedding("c", [doc("b", 0, 1)])
+    assert await ids(restarted, [0, 1]) == ["b", "a"]
+    assert await ids(store_fn(), [0, 1]) == ["b", "a"]
+
+
+async def test_deletes_are_compacted_in_the_background(store_fn, tmp_path):
+    store = store_fn(compaction_threshold=0.5)
+    await store.add_embedding("c", [doc(str(i), 1, i) for i in range(4)])
+    await store.delete_embedding("c", ["0"])
+    await store.stop()
+    assert sorted(p.name for p in (tmp_path / "c").iterdir()) == ["0.log", "0.vectors", "CURRENT"]
+
+    await store.delete_embedding("c", ["1"])
+    await store.stop()
+    assert sorted(p.name for p in (tmp_path / "c").iterdir()) == ["1.log", "1.vectors", "CURRENT"]
+    assert await ids(store, [0, 1]) == ["3", "2"]
+    await store.add_embedding("c", [doc("4", 0, 1)])
+    assert await ids(store_fn(), [0, 1]) == ["4", "3", "2"]
+
+
+async def test_metadata_is_read_without_waiting_for_writes(store_fn):
+    store = store_fn()
+    await store.add_embedding("c", [doc("a", 1, 0, v=1)])
+    c = await store._get_collection("c")
+    async with c.lock:
+        assert await store.get_metadata("c", ["a", "b"]) == [dict(v=1), None]
@@ -0,0 +1,99 @@
+import pytest
+
+from eidolon_ai_sdk.memory.document import Document, EmbeddedDocument
+from eidolon_ai_sdk.memory.numpy_vector_store import NumpyVectorStore, NumpyVectorStoreSpec
+from eidolon_ai_sdk.memory.packed_text import PackedTextCollection, PackedTextSpec, PackedTextStore
+
+
+def docs(*texts, start=0):
+    return [Document(id=str(i), page_content=text) for i, text in enumerate(texts, start)]
+
+
+@pytest.fixture
+def collection_fn(tmp_path):
+    def fn(segment_bytes=1024):
+        collection = PackedTextCollection(tmp_path / "c", segment_bytes)
+        collection.load()
+        return collection
+
+    return fn
+
+
+def test_read_returns_text_in_requested_order(collection_fn):
+    collection = collection_fn()
+    collection.append(docs("zero", "one", "två", ""))
+    assert collection.read(["2", "missing", "0", "3", "1"]) == ["två", None, "zero", "", "one"]
+
+
+def test_segments_roll_over_and_reload(collection_fn, tmp_path):
+    collection = collection_fn(segment_bytes=10)
+    collection.append(docs("aaaaaa", "bbbbbb", "cccccccccccccccc"))
+    collection.append(docs("dd", start=3))
+    assert sorted(p.name for p in (tmp_path / "c").glob("*.text")) == ["0.text", "1.text", "2.text", "3.text"]
+    # a segment written by a crashed append, before its index entries
+    (tmp_path / "c" / "5.text").write_bytes(b"partial")
+    reloaded = collection_fn(segment_bytes=10)
+    assert reloaded.read(["0", "1", "2", "3"]) == ["aaaaaa", "bbbbbb", "cccccccccccccccc", "dd"]
+    assert not (tmp_path / "c" / "5.text").exists()
+    reloaded.append(docs("e", start=4))
+    assert reloaded.read(["4"]) == ["e"]
+
+
+def test_deletes_and_replacements_are_compacted(collection_fn, tmp_path):
+    collection = collection_fn(segment_bytes=8)
+    collection.append(docs("aaaa", "bbbb", "cccc", "dddd"))
+    collection.append([Document(id="1", page_content="BB")])
+    collection.delete(["0", "2", "missing"])
+    assert collection.read(["0", "1", "2", "3"]) == [None, "BB", None, "dddd"]
+    assert (collection.total_bytes, collection.dead_bytes) == (18, 12)
+    reloaded = collection_fn(segment_bytes=8)
+    assert (reloaded.total_bytes, reloaded.dead_bytes) == (18, 12)
+
+    reloaded.compact()
+    assert reloaded.read(["0", "1", "3"]) == [None, "BB", "dddd"]
+    assert (reloaded.total_bytes, reloaded.dead_bytes) == (6, 0)
+    assert sorted(p.name for p in (tmp_path / "c").iterdir()) == ["3.text", "index.log"]
+    assert collection_fn().read(["1", "3"]) == ["BB", "dddd"]
+
+
+def test_compaction_closes_the_replaced_files_once_reads_are_done(collection_fn, monkeypatch):
+    collection = collection_fn(segment_bytes=8)
+    collection.append(docs("aaaa", "bbbb", "cccc"))
+    collection.delete(["0"])
+    assert collection.read(["1", "2"]) == ["bbbb", "cccc"]
+    opened = list(collection.files.files.values())
+    assert opened and not any(f.closed for f in opened)
+
+    # a read in progress on another thread while the collection is compacted
+    read_run = collection._read_run
+
+    def compacting_read_run(files, run, results):
+        monkeypatch.setattr(collection, "_read_run", read_run)
+        collection.compact()
+        assert not any(f.closed for f in opened)
+        read_run(files, run, results)
+
+    monkeypatch.setattr(collection, "_read_run", compacting_read_run)
+    assert collection.read(["1"]) == ["bbbb"]
+    assert all(f.closed for f in opened)
+    assert collection.read(["1", "2"]) == ["bbbb", "cccc"]
+
+
+async def test_store_compacts_in_background(tmp_path):
+    store = PackedTextStore(PackedTextSpec(root_dir=str(tmp_path), compaction_threshold=0.5))
+    await store.add("c", docs("aaaa", "bbbb"))
+    await store.delete("c", ["0"])
+    await store.stop()
+    collection = await store._get_collection("c")
+    assert collection.dead_bytes == 0
+    assert await store.read("c", ["0", "1"]) == [None, "bbbb"]
+
+
+async def test_vector_store_reads_packed_text(tmp_path):
+    spec = NumpyVectorStoreSpec(root_dir=str(tmp_path / "vectors"), packed_text=dict(root_dir=str(tmp_path / "text")))
+    store = NumpyVectorStore(spec)
+    await store.add_embedding("c", [EmbeddedDocument(id=str(i), embedding=[1, i], metadata=dict(n=i)) for i in range(3)])
+    await store._packed_text.add("c", docs("zero", "one", "two"))
+    await store.delete("c", ["1"])
+    found = [(d.id, d.metadata, d.page_content) async for d in store.get_docs("c", ["2", "1", "0"])]
+    assert found == [("2", dict(n=2), "two"), ("0", dict(n=0), "zero")]
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from eidolon_ai_sdk.bin.vector_benchmark import clustered_vectors
+from eidolon_ai_sdk.memory.document import EmbeddedDocument
+from eidolon_ai_sdk.memory.numpy_vector_store import NumpyVectorStore, NumpyVectorStoreSpec, normalize
+from eidolon_ai_sdk.memory.quantization import Int8Codec, ProductCodec, QuantizationSpec, load_codec
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return normalize(clustered_vectors(2000, 32, 20))
+
+
+@pytest.fixture(scope="module")
+def queries():
+    return normalize(clustered_vectors(20, 32, 20, seed=1))
+
+
+def exact(vectors, query, k):
+    return set(np.argsort(-(vectors @ query))[:k].tolist())
+
+
+def approximate(codec, codes, query, k):
+    return set(np.argsort(-codec.similarities(codes, query))[:k].tolist())
+
+
+@pytest.mark.parametrize("codec", [Int8Codec(32), ProductCodec(32, 8), ProductCodec(30, 7)])
+def test_codecs(codec, vectors, queries):
+    vectors = vectors[:, : codec.code_size if isinstance(codec, Int8Codec) else codec.dimensions]
+    queries = queries[:, : vectors.shape[1]]
+    codec.train(vectors)
+    codes = codec.encode(vectors)
+    assert codes.dtype == np.uint8
+    assert codes.shape == (len(vectors), codec.code_size)
+    recall = np.mean([len(approximate(codec, codes, q, 10) & exact(vectors, q, 10)) / 10 for q in queries])
+    assert recall >= (0.9 if isinstance(codec, Int8Codec) else 0.5)
+
+    loaded = load_codec(codec.state())
+    assert type(loaded) is type(codec)
+    assert np.array_equal(loaded.encode(vectors[:10]), codes[:10])
+
+
+def test_int8_similarities_are_close(vectors, queries):
+    codec = Int8Codec(32)
+    codec.train(vectors)
+    error = codec.similarities(codec.encode(vectors), queries[0]) - vectors @ queries[0]
+    assert np.abs(error).max() < 0.02
+
+
+@pytest.fixture
+def store_fn(tmp_path):
+    def fn(**kwargs):
+        quantization = QuantizationSpec(**dict(dict(train_rows=500, rescore=50), **kwargs))
+        return NumpyVectorStore(NumpyVectorStoreSpec(root_dir=str(tmp_path), quantization=quantization))
+
+    return fn
+
+
+def docs(vectors, start=0):
+    return [EmbeddedDocument(id=str(i), embedding=v.tolist()) for i, v in enumerate(vectors, start)]
+
+
+async def ids(store, query, k=10):
+    return {int(r.id) for r in await store.query_embedding("c", query.tolist(), k)}
+
+
+@pytest.mark.parametrize("codec", ["int8", "pq"])
+async def test_store_rescores_quantized_candidates(store_fn, codec, vectors, queries):
+    store = store_fn(codec=codec, pq_subvectors=8)
+    await store.add_embedding("c", docs(vectors[:400]))
+    collection = await store._get_collection("c")
+    assert collection.snapshot.codes is None
+    await store.add_embedding("c", docs(vectors[400:], 400))
+    assert collection.snapshot.codes.shape[0] == len(vectors)
+    recall = np.mean([len(await ids(store, q) & exact(vectors, q, 10)) / 10 for q in queries])
+    assert recall >= 0.9
+    results = await store.query_embedding("c", vectors[5].tolist(), 1)
+    assert results[0].id == "5"
+    assert results[0].score == pytest.approx(0, abs=1e-6)
+
+
+async def test_approximate_scores_without_rescoring(store_fn, vectors, queries):
+    store = store_fn(rescore=0)
+    await store.add_embedding("c", docs(vectors))
+    results = await store.query_embedding("c", queries[0].tolist(), 5)
+    assert {int(r.id) for r in results} & exact(vectors, queries[0], 5)
+    for r in results:
+        assert 1 - r.score == pytest.approx(float(vectors[int(r.id)] @ queries[0]), abs=0.02)
+
+
+async def test_codes_are_persisted_and_compacted(store_fn, vectors, tmp_path):
+    store = store_fn()
+    await store.add_embedding("c", docs(vectors[:1000]))
+    # a crash after writing the log, but before writing the codes of the last rows
+    with open(tmp_path / "c" / "0.codes", "r+b") as f:
+        f.truncate(990 * 32 + 5)
+    restarted = store_fn()
+    collection = await restarted._get_collection("c")
+    assert np.array_equal(collection.snapshot.codes, (await store._get_collection("c")).snapshot.codes)
+    assert (tmp_path / "c" / "0.codes").stat().st_size == 1000 * 32
+
+    restarted.spec.compaction_threshold = 0.5
+    await restarted.delete_embedding("c", [str(i) for i in range(500)])
+    await restarted.stop()
+    assert sorted(p.name for p in (tmp_path / "c").iterdir()) == [
+        "1.codes",
+        "1.log",
+        "1.vectors",
+        "CURRENT",
+        "codec.npz",
+    ]
+    assert len(collection.snapshot.codes) == 500
+    assert await ids(store_fn(), vectors[600], 1) == {600}
+
+
+async def test_selective_filters_score_only_the_codes_they_match(store_fn, vectors, queries, monkeypatch):
+    store = store_fn()
+    sources = ["a" if i % 10 == 0 else "b" for i in range(len(vectors))]
+    await store.add_embedding(
+        "c",
+        [
+            EmbeddedDocument(id=str(i), embedding=v.tolist(), metadata=dict(source=s))
+            for i, (v, s) in enumerate(zip(vectors, sources))
+        ],
+    )
+    collection = await store._get_collection("c")
+    scored = []
+    similarities = collection.codec.similarities
+    monkeypatch.setattr(
+        collection.codec, "similarities", lambda codes, q: scored.append(len(codes)) or similarities(codes, q)
+    )
+    results = await store.query_embedding("c", queries[0].tolist(), 5, dict(source="a"))
+    assert scored == [len(vectors) // 10]
+    rows = np.arange(0, len(vectors), 10)
+    assert {int(r.id) for r in results} == set(rows[np.argsort(-(vectors[rows] @ queries[0]))[:5]].tolist())
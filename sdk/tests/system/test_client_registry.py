@@ -0,0 +1,50 @@
+from openai import AsyncOpenAI
+
+from eidolon_ai_sdk.agent_os import AgentOS
+from eidolon_ai_sdk.system.client_registry import ClientRegistry, ClientRegistrySpec, get_client
+from eidolon_ai_sdk.system.reference_model import Reference
+
+
+def client_ref():
+    return Reference[AsyncOpenAI]()
+
+
+async def test_clients_are_shared():
+    registry = ClientRegistry(spec=ClientRegistrySpec())
+    client = registry.get(client_ref(), dict(api_key="foo"))
+    assert registry.get(client_ref(), dict(api_key="foo")) is client
+    assert registry.get(client_ref(), dict(api_key="bar")) is not client
+    await registry.stop()
+
+
+async def test_stop_closes_clients():
+    registry = ClientRegistry(spec=ClientRegistrySpec())
+    client = registry.get(client_ref(), dict(api_key="foo"))
+    await registry.stop()
+    assert client.is_closed()
+    assert registry.get(client_ref(), dict(api_key="foo")) is not client
+    await registry.stop()
+
+
+async def test_pool_limits_are_applied():
+    registry = ClientRegistry(spec=ClientRegistrySpec(max_connections=7, max_keepalive_connections=3))
+    client = registry.get(client_ref(), dict(api_key="foo"))
+    pool = client._client._transport._pool
+    assert pool._max_connections == 7
+    assert pool._max_keepalive_connections == 3
+    await registry.stop()
+
+
+async def test_scheduled_clients_do_not_retry():
+    registry = ClientRegistry(spec=ClientRegistrySpec())
+    assert registry.get(client_ref(), dict(api_key="foo")).max_retries == 2
+    scheduled = registry.get(client_ref(), dict(api_key="foo"), scheduled=True)
+    assert scheduled.max_retries == 0
+    assert registry.get(client_ref(), dict(api_key="foo", max_retries=1), scheduled=True).max_retries == 1
+    assert get_client(client_ref(), dict(api_key="foo"), scheduled=True).max_retries == 0
+    await registry.stop()
+
+
+async def test_machine_provides_registry(machine):
+    assert isinstance(AgentOS.client_registry, ClientRegistry)
+    assert get_client(client_ref(), dict(api_key="foo")) is get_client(client_ref(), dict(api_key="foo"))
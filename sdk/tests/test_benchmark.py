@@ -0,0 +1,47 @@
+import os
+import tempfile
+
+import httpx
+
+from eidolon_ai_sdk.bin.benchmark import (
+    run_benchmark,
+    SIMPLE,
+    CONVERSATIONAL,
+    LoopLagMonitor,
+    _free_port,
+    benchmark_resources,
+    run_server,
+)
+
+
+async def test_benchmark_runs_offline():
+    llm_unit = dict(implementation="MockLLMUnit")
+    report = await run_benchmark([SIMPLE, CONVERSATIONAL], concurrency=2, requests=4, llm_unit=llm_unit)
+    assert report["total"]["completed"] == 4
+    assert report["total"]["errors"] == 0
+    assert report[CONVERSATIONAL]["completed"] == 2
+    assert report["total"]["p99"] >= report["total"]["p50"] > 0
+    assert report["memory"]["peak_rss_mb"] > 0
+    assert "EIDOLON_LOCAL_MACHINE" not in os.environ
+
+
+async def test_conversational_agent_calls_the_simple_agent():
+    with tempfile.TemporaryDirectory() as loc:
+        resources = benchmark_resources(loc, dict(implementation="MockLLMUnit"))
+        async with run_server(resources, _free_port(), LoopLagMonitor()) as url:
+            async with httpx.AsyncClient(base_url=url) as client:
+                process = (await client.post(f"/agents/{CONVERSATIONAL}/processes")).json()["process_id"]
+                response = await client.post(
+                    f"/agents/{CONVERSATIONAL}/processes/{process}/actions/converse",
+                    json=dict(question="what is the answer?"),
+                    headers={"Accept": "application/json"},
+                )
+                events = (await client.get(f"/agents/{CONVERSATIONAL}/processes/{process}/events")).json()
+    assert response.json()["data"] == "The simple agent says it is a mock response."
+    [tool_call] = [e["tool_call"]["name"] for e in events if e["event_type"] == "llm_tool_call_request"]
+    assert tool_call == f"AgentsLogicUnit_convo_{SIMPLE}_converse"
+    nested = [e for e in events if e.get("stream_context") == "call_0_0"]
+    assert [e["event_type"] for e in nested][-2:] == ["agent_state", "success"]
+    assert dict(event_type="string", content="This is a mock response.", category="output") in [
+        {k: v for k, v in e.items() if k != "stream_context"} for e in nested
+    ]
@@ -0,0 +1,8 @@
+from eidolon_ai_sdk.bin.vector_benchmark import run_vector_benchmark
+
+
+async def test_vector_benchmark_runs_offline():
+    report = await run_vector_benchmark(rows=300, dimensions=8, queries=10, k=5, ef_search=[8, 64], m=8)
+    assert report["exact"]["recall"] == 1.0
+    assert 0 < report["hnsw ef_search=8"]["recall"] <= report["hnsw ef_search=64"]["recall"] <= 1.0
+    assert report["hnsw ef_search=64"]["p99"] >= report["hnsw ef_search=64"]["p50"] > 0
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from eidolon_ai_sdk.util.partial_json import PartialJsonParser
+
+
+def snapshots(chunks):
+    parser = PartialJsonParser()
+    return [parser.snapshot() for c in chunks if parser.feed(c)], parser
+
+
+def test_values_are_added_once_complete():
+    result, parser = snapshots(['{"name": "Jo', 'hn", "age": 4', '2, "tags": ["a",', ' "b"]}'])
+    assert result == [
+        {"name": "John"},
+        {"name": "John", "age": 42, "tags": ["a"]},
+        {"name": "John", "age": 42, "tags": ["a", "b"]},
+    ]
+    assert parser.complete
+
+
+def test_nested_objects():
+    result, _ = snapshots(['{"a": {"b": 1, ', '"c": {"d": null}}, "e": true}'])
+    assert result == [{"a": {"b": 1}}, {"a": {"b": 1, "c": {"d": None}}, "e": True}]
+
+
+def test_escaped_strings():
+    text = json.dumps({"quote": 'say "hi"\n', "unicode": "é"})
+    result, _ = snapshots(list(text))
+    assert result[-1] == json.loads(text)
+
+
+def test_ignores_text_around_json_section():
+    result, parser = snapshots(['json```{"a": 1', "}``` and more {"])
+    assert result == [{"a": 1}]
+    assert parser.complete
+
+
+@pytest.mark.parametrize("text", ['{"a": [1, 2.5, -3e2], "b": [], "c": {}}', '[1, {"x": [true, false]}]'])
+def test_final_snapshot_matches_json(text):
+    for size in [1, 3, 7]:
+        result, _ = snapshots([text[i : i + size] for i in range(0, len(text), size)])
+        assert result[-1] == json.loads(text)
+
+
+def test_invalid_literal_raises():
+    with pytest.raises(json.JSONDecodeError):
+        PartialJsonParser().feed('{"a": nope}')
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from eidolon_ai_sdk.memory.embeddings import Embedding, EmbeddingSpec
+from eidolon_ai_sdk.util.single_flight import SingleFlight
+
+
+def upstream(calls, items=("a", "b", "c"), delay=0.01):
+    async def fn():
+        calls.append(1)
+        for item in items:
+            await asyncio.sleep(delay)
+            yield item
+
+    return fn
+
+
+async def consume(flight, fn, key="k"):
+    return [item async for item in flight.stream(key, fn)]
+
+
+async def test_concurrent_calls_are_coalesced():
+    calls = []
+    flight = SingleFlight()
+    fn = upstream(calls)
+    results = await asyncio.gather(*(consume(flight, fn) for _ in range(5)))
+    assert results == [["a", "b", "c"]] * 5
+    assert len(calls) == 1
+    assert len(flight) == 0
+
+
+async def test_late_subscribers_receive_the_full_stream():
+    calls = []
+    flight = SingleFlight()
+    fn = upstream(calls)
+    first = asyncio.create_task(consume(flight, fn))
+    await asyncio.sleep(0.015)
+    assert await consume(flight, fn) == ["a", "b", "c"]
+    assert await first == ["a", "b", "c"]
+    assert len(calls) == 1
+
+
+async def test_sequential_calls_are_not_coalesced():
+    calls = []
+    flight = SingleFlight()
+    await consume(flight, upstream(calls))
+    await consume(flight, upstream(calls))
+    assert len(calls) == 2
+
+
+async def test_errors_are_raised_to_every_subscriber():
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+        yield
+
+    flight = SingleFlight()
+    results = await asyncio.gather(consume(flight, fn), consume(flight, fn), return_exceptions=True)
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+
+async def test_upstream_is_cancelled_with_the_last_subscriber():
+    cancelled = asyncio.Event()
+
+    async def fn():
+        try:
+            yield "a"
+            await asyncio.sleep(10)
+            yield "b"
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    flight = SingleFlight()
+    first = asyncio.create_task(consume(flight, fn))
+    second = asyncio.create_task(consume(flight, fn))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    await asyncio.sleep(0.01)
+    assert not cancelled.is_set()
+    second.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert len(flight) == 0
+
+
+async def test_do_returns_the_shared_result():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    flight = SingleFlight()
+    assert await asyncio.gather(flight.do("k", fn), flight.do("k", fn)) == [42, 42]
+    assert len(calls) == 1
+
+
+class CountingEmbedding(Embedding):
+    def __init__(self):
+        super().__init__(EmbeddingSpec())
+        self.calls = []
+
+    async def create_embedding(self, text, **kwargs):
+        self.calls.append(text)
+        await asyncio.sleep(0.01)
+        return [float(len(text))]
+
+
+@pytest.mark.parametrize("texts, expected_calls", [(["a", "a", "a"], 1), (["a", "bb", "a"], 2)])
+async def test_identical_embeddings_are_coalesced(texts, expected_calls):
+    embedding = CountingEmbedding()
+    results = await asyncio.gather(*(embedding.embed_text(t) for t in texts))
+    assert results == [[float(len(t))] for t in texts]
+    assert len(embedding.calls) == expected_calls